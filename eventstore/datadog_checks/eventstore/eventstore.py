@@ -1,19 +1,56 @@
 # (C) Calastone Ltd. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-import copy
 import datetime
-import fnmatch
 import re
-from collections import defaultdict
+import time
+from collections import namedtuple
+from functools import lru_cache, partial
 
 import requests
 
 from datadog_checks.base import AgentCheck
 from datadog_checks.base.errors import CheckException
 
+from .json_path import WILDCARD, JsonPathIndex
 from .metrics import ALL_METRICS
 
+DURATION_RE = re.compile(r'^(\d+):(\d\d):(\d\d):(\d\d).(\d+)$')
+
+# A metric definition resolved once per endpoint: `submit` is the bound
+# gauge or histogram method, `convert` turns the raw value into a number
+# and `tags` holds (tag name or None, json path, wildcard index) triples.
+MetricSpec = namedtuple('MetricSpec', ['json_path', 'metric_name', 'submit', 'convert', 'tags'])
+EndpointPlan = namedtuple('EndpointPlan', ['path_index', 'metrics'])
+
+
+@lru_cache(maxsize=4096)
+def parse_duration(string):
+    """
+    Returns a time delta for strings in a format of: 0:00:00:00.0000, None
+    when the string doesn't match. Using RegEx to not introduce a dependency
+    on another package, the same durations are reported on every run so
+    the results are memoized.
+    """
+    match = DURATION_RE.match(string)
+    if match is None:
+        return None
+    days, hours, mins, secs, subsecs = (int(group) for group in match.groups())
+    return datetime.timedelta(days=days, seconds=secs, microseconds=subsecs, minutes=mins, hours=hours)
+
+
+@lru_cache(maxsize=1024)
+def _snake_case(name):
+    # https://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-snake-case
+    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+
+
+def format_value(value):
+    """Returns the string form of a raw JSON value, as used for tags and conversions"""
+    value = str(value)
+    return value if value else 'N/A'
+
 
 class EventStoreCheck(AgentCheck):
 
@@ -30,6 +67,11 @@ class EventStoreCheck(AgentCheck):
         },
     }
 
+    def __init__(self, *args, **kwargs):
+        super(EventStoreCheck, self).__init__(*args, **kwargs)
+        # (endpoint, instance json paths) -> EndpointPlan
+        self._plans = {}
+
     def check(self, instance):
         """Main method"""
         endpoints_def = instance.get('endpoints')
@@ -51,7 +93,7 @@ class EventStoreCheck(AgentCheck):
         url = base_url + endpoint
         tag_by_url = instance.get('tag_by_url', False)
         name_tag = instance.get('name', url)
-        metric_def = copy.deepcopy(metrics)
+        extraction_stats = instance.get('extraction_stats', False)
 
         try:
             r = self.http.get(url)
@@ -74,196 +116,172 @@ class EventStoreCheck(AgentCheck):
         except Exception as e:
             raise CheckException(f'{url} returned an unserializable payload: {e}')
 
-        eventstore_paths = self.walk(parsed_api)
-        self.log.debug("Event Store Paths:")
-        self.log.debug(eventstore_paths)
-
-        # Flatten the self.init_config definitions into valid metric definitions
-        metric_definitions = defaultdict(list)
-        for metric in metric_def:
-            self.log.debug("metric %s", metric)
-            json_path = metric.get('json_path', '')
-            self.log.debug("json_path %s", json_path)
-            tags = metric.get('tag_by', {})
-            self.log.debug("tags %s", tags)
-            paths = self.get_json_path(json_path, eventstore_paths)
-            self.log.debug("paths %s", paths)
-
-            for path in paths:
-                # Deep copy needed else it will overwrite previous metric data
-                metric_builder = copy.deepcopy(metric)
-                metric_builder['json_path'] = path
-                tag_builder = []
-                if tag_by_url:
-                    tag_builder.append(f'instance:{url}')
-                tag_builder.append(f'name:{name_tag}')
-                for tag in tags:
-                    if ':' in tag:
-                        # example: projection:projections.*.effectiveName
-                        tag_name, tag = tag.rsplit(':', 1)
-                        tag_path = self.get_tag_path(tag, path, eventstore_paths)
-                    else:
-                        # example: projections.*.effectiveName
-                        tag_path = self.get_tag_path(tag, path, eventstore_paths)
-                        tag_name = self.format_tag(tag_path.split('.')[-1])
-                    tag_value = self.get_value(parsed_api, tag_path)
-                    tag_builder.append(f'{tag_name}:{tag_value}')
-                metric_builder['tag_by'] = tag_builder
-                metric_definitions[path].append(metric_builder)
+        start = time.perf_counter()
+        plan = self.get_endpoint_plan(endpoint, metrics, instance['json_path'])
+        values = {}
+        path_matches = plan.path_index.match(parsed_api, values)
+        self.log.debug("Event Store Paths: %s", path_matches)
 
         # Find metrics to check:
-        metrics_to_check = {}
-        for metric in instance['json_path']:
-            self.log.debug("metric: %s", metric)
-            paths = self.get_json_path(metric, eventstore_paths)
-            self.log.debug("paths: %s", paths)
-            for path in paths:
-                self.log.debug("path: %s", path)
-                try:
-                    metrics_to_check[path] = metric_definitions[path]
-                    self.log.debug("metrics_to_check: %s", metric_definitions[path])
-                except KeyError:
-                    self.log.info("Skipping metric: %s as it is not defined", path)
-
-        # Now we need to get the metrics from the endpoint
-        # Get the value for a given key
-        self.log.debug("parsed_api:")
-        self.log.debug(parsed_api)
-        for path, metrics in metrics_to_check.items():
-            raw_value = self.get_value(parsed_api, path)
-            for metric in metrics:
-                metric_value = self.convert_value(raw_value, metric)
-                if metric_value is not None:
-                    self.dispatch_metric(metric_value, metric)
-                else:
-                    # self.dispatch_metric(0, metric)
-                    self.log.debug("Metric %s did not return a value, skipping", path)
+        selected = set()
+        for json_path in instance['json_path']:
+            selected.update(path_matches[json_path])
+
+        base_tags = [f'instance:{url}'] if tag_by_url else []
+        base_tags.append(f'name:{name_tag}')
+        # tag pattern -> {key at the wildcard position: first matching path}
+        tag_lookups = {}
+        # (tag name, tag path) -> formatted tag
+        formatted_tags = {}
+        submitted = 0
+        for metric in plan.metrics:
+            for keys in path_matches[metric.json_path]:
+                if keys not in selected:
+                    continue
+                metric_value = metric.convert(format_value(values[keys]))
+                if metric_value is None:
+                    self.log.debug("Metric %s did not return a value, skipping", '.'.join(keys))
+                    continue
+
+                tags = list(base_tags)
+                for tag_name, tag, wildcard_index in metric.tags:
+                    tag_path = self.get_tag_path(tag, wildcard_index, keys, path_matches, tag_lookups)
+                    if tag_path is None:
+                        continue
+                    tag_key = (tag_name, tag_path)
+                    formatted = formatted_tags.get(tag_key)
+                    if formatted is None:
+                        if tag_name is None:
+                            # example: projections.*.effectiveName
+                            tag_name = self.format_tag(tag_path[-1])
+                        formatted = formatted_tags[tag_key] = f'{tag_name}:{format_value(values[tag_path])}'
+                    tags.append(formatted)
+                metric.submit(metric.metric_name, metric_value, tags)
+                submitted += 1
+
+        elapsed = time.perf_counter() - start
+        self.log.debug(
+            "Extracted %d metrics from %d paths of %s in %.6fs", submitted, len(values), url, elapsed
+        )
+        if extraction_stats:
+            stats_tags = base_tags + [f'endpoint:{endpoint}']
+            self.gauge('eventstore.check.extraction_time', elapsed, stats_tags)
+            self.gauge('eventstore.check.matched_paths', len(values), stats_tags)
+            self.gauge('eventstore.check.submitted_metrics', submitted, stats_tags)
 
     @classmethod
     def format_tag(cls, name):
         """Converts the string to snake case from camel case"""
-        # https://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-snake-case
-        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-        return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-
-    def walk(self, json_obj, p=None, es_paths=None):
-        """Walk a JSON tree and return the json paths in a list"""
-        if p is None:
-            p = []
-        if es_paths is None:
-            es_paths = []
-
-        if isinstance(json_obj, list):
-            json_obj = {str(k): v for k, v in enumerate(json_obj)}
-
-        for key, value in json_obj.items():
-            # We add the instance to the path global variable to build up a map
-            p.append(key)
-            if isinstance(value, (dict, list)):
-                self.walk(value, p, es_paths)
-                # Once we have finished with this path we remove it from the global variable
-                p.pop()
-            else:
-                tmp = f'{".".join(p)}'
-                p.pop()
-                # Add the full key name to the "flat" global variable
-                if tmp not in es_paths:
-                    es_paths.append(tmp)
-        return es_paths
-
-    def get_tag_path(self, tag, metric_json_path, eventstore_paths):
-        """Returns the paths for the given tags"""
-        # This function will return the tag as a validated path,
-        # if the tag has a wildcard it will return
-        try:
-            # Wildcard
+        return _snake_case(name)
+
+    def get_endpoint_plan(self, endpoint, metrics, json_paths):
+        """Returns the compiled path index and metric definitions of an endpoint"""
+        key = (endpoint, tuple(json_paths))
+        plan = self._plans.get(key)
+        if plan is None:
+            path_index = JsonPathIndex()
+            specs = []
+            for metric in metrics:
+                spec = self.get_metric_spec(metric)
+                if spec is None:
+                    continue
+                path_index.add(spec.json_path)
+                for _, tag, _ in spec.tags:
+                    path_index.add(tag)
+                specs.append(spec)
+            for json_path in json_paths:
+                path_index.add(json_path)
+            plan = self._plans[key] = EndpointPlan(path_index, tuple(specs))
+        return plan
+
+    def get_metric_spec(self, metric):
+        """Resolves a metric definition, returns None when it can't be submitted"""
+        metric_name = metric['metric_name']
+        metric_type = metric['metric_type']
+        if metric_type == 'gauge':
+            submit = self.gauge
+        elif metric_type == 'histogram':
+            submit = self.histogram
+        else:
+            self.log.info('Unable to send metric %s due to invalid metric type of %s', metric_name, metric_type)
+            return None
+
+        convert = self.get_converter(metric)
+        if convert is None:
+            return None
+
+        tags = []
+        for tag in metric.get('tag_by', ()):
+            tag_name = None
+            if ':' in tag:
+                # example: projection:projections.*.effectiveName
+                tag_name, tag = tag.rsplit(':', 1)
             tag_split = tag.split('.')
-            wildcard_index = tag.split('.').index('*')
-            json_path_split = metric_json_path.split('.')
-            tag_split[wildcard_index] = json_path_split[wildcard_index]
-            tag_path = '.'.join(tag_split)
-            return self.get_json_path(tag_path, eventstore_paths)[0]
-        except ValueError:
-            # No wildcard
-            return self.get_json_path(tag, eventstore_paths)[0]
-        except IndexError:
-            self.log.warning('No tag value found for %s, path %s', tag, metric_json_path)
-
-    def get_json_path(self, json_path, eventstore_paths):
-        """Find all the possible keys for a given path"""
-        self.log.debug("json paths: %s", json_path)
-        self.log.debug("eventstore_paths: %s", eventstore_paths)
-        response = []
-        self.log.debug("response: %s", response)
-        try:
-            match = eventstore_paths.index(json_path)
-            self.log.debug("match: %s", match)
-            if match is not None:
-                response.append(json_path)
-                self.log.debug("match json path: %s", json_path)
-        except ValueError:
-            # Loop through all possible keys to find matches
-            # Value Error means it didn't find it, so it must be
-            # a wildcard
-            self.log.debug("value error")
-            for path in eventstore_paths:
-                self.log.debug("path: %s", path)
-                match = fnmatch.fnmatch(path, json_path)
-                self.log.debug("match ve: %s", match)
-                if match:
-                    response.append(path)
-                    self.log.debug("path ve: %s", path)
-        return response
-
-    # Fill out eventstore_paths using walk of json
-
-    def get_value(self, json_obj, metric_path, index=0):
-        """Returns the value for the supplied metric path"""
-        split = metric_path.split('.')
-        key = split[index]
-        if isinstance(json_obj, list):
-            json_obj = {str(k): v for k, v in enumerate(json_obj)}
-        try:
-            v = json_obj[key]
-            if isinstance(v, (dict, list)):
-                index += 1
-                v = self.get_value(v, metric_path, index=index)
-            else:
-                v = str(v)
-            if len(v) == 0:
-                v = 'N/A'
-            return v
-        except KeyError:
-            self.log.info('No value found for Metric: %s', metric_path)
-
-    def convert_value(self, value, metric):
-        """Returns the metric formatted in the specified value"""
+            wildcard_index = tag_split.index(WILDCARD) if WILDCARD in tag_split else None
+            tags.append((tag_name, tag, wildcard_index))
+        return MetricSpec(metric.get('json_path', ''), metric_name, submit, convert, tuple(tags))
+
+    def get_tag_path(self, tag, wildcard_index, metric_keys, path_matches, tag_lookups):
+        """Returns the keys of the tag value for the metric at `metric_keys`"""
+        tag_matches = path_matches[tag]
+        if wildcard_index is None:
+            if tag_matches:
+                return tag_matches[0]
+        else:
+            # If the tag has a wildcard, the tag path is the one sharing
+            # the metric key at the wildcard position
+            lookup = tag_lookups.get(tag)
+            if lookup is None:
+                lookup = tag_lookups[tag] = {}
+                for keys in tag_matches:
+                    lookup.setdefault(keys[wildcard_index], keys)
+            if wildcard_index < len(metric_keys) and metric_keys[wildcard_index] in lookup:
+                return lookup[metric_keys[wildcard_index]]
+        self.log.warning('No tag value found for %s, path %s', tag, '.'.join(metric_keys))
+        return None
+
+    def get_converter(self, metric):
+        """Returns the function converting the values of the metric, None for invalid definitions"""
         data_type = metric['json_type']
-        v = None
         if data_type == 'bool':
-            v = 1 if value else 0
+            return self.convert_bool
         elif data_type == 'datetime':
-            v = (
-                float(dt.total_seconds())
-                if (dt := self.convert_to_timedelta(value))
-                else float(0)
-            )
+            return self.convert_datetime
         elif data_type == 'float':
-            try:
-                v = float(value)
-            except ValueError:
-                v = None
+            return self.convert_float
         elif data_type == 'int':
-            try:
-                v = int(value)
-            except ValueError:
-                v = None
+            return self.convert_int
         elif data_type == 'str':
-            v = self.convert_str_to_gauge(value, metric)
-        return v
+            checklist = self.get_str_checklist(metric)
+            if checklist is None:
+                return None
+            return partial(self.convert_str_to_gauge, checklist=checklist, match=bool(metric.get('match')))
+        self.log.info('Unable to convert metric %s of type %s', metric['metric_name'], data_type)
+        return None
+
+    @staticmethod
+    def convert_bool(value):
+        return 1 if value else 0
+
+    def convert_datetime(self, value):
+        return float(dt.total_seconds()) if (dt := self.convert_to_timedelta(value)) else float(0)
 
-    def convert_str_to_gauge(self, value, metric):
-        v = None
+    @staticmethod
+    def convert_float(value):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def convert_int(value):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    def get_str_checklist(self, metric):
+        """Returns the values to match or mismatch to convert the str metric to a gauge"""
         match = metric.get('match')
         mismatch = metric.get('mismatch')
         if match and mismatch:
@@ -272,67 +290,29 @@ class EventStoreCheck(AgentCheck):
                 metric['json_path'],
                 metric['metric_name'],
             )
+            return None
         elif not match and not mismatch:
             self.log.info(
                 'Match or mismatch should be specified to convert the str metric to a gauge for: %s %s',
                 metric['json_path'],
                 metric['metric_name'],
             )
-        else:
-            checklist = match or mismatch
-            if isinstance(checklist, (frozenset, list, set, tuple)):
-                checklist = frozenset(checklist)
-            else:
-                checklist = frozenset((checklist,))
-            if match:
-                v = 1 if value in checklist else 0
-            elif mismatch:
-                v = 0 if value in checklist else 1
-        return v
+            return None
 
-    def convert_to_timedelta(self, string):
-        """
-        Returns a time delta for strings in a format of: 0:00:00:00.0000
-        Using RegEx to not introduce a dependency on another package
-        """
-        dt_re = re.compile(r'^(\d+):(\d\d):(\d\d):(\d\d).(\d+)$')
-        tmp = dt_re.match(string)
-        try:
-            days = self._regex_number_to_int(tmp, 1)
-            hours = self._regex_number_to_int(tmp, 2)
-            mins = self._regex_number_to_int(tmp, 3)
-            secs = self._regex_number_to_int(tmp, 4)
-            subsecs = self._regex_number_to_int(tmp, 5)
-            return datetime.timedelta(
-                days=days,
-                seconds=secs,
-                microseconds=subsecs,
-                minutes=mins,
-                hours=hours,
-            )
-        except AttributeError:
-            self.log.info('Unable to convert %s to timedelta', string)
-        except TypeError:
-            self.log.info('Unable to convert %s to type timedelta', string)
+        checklist = match or mismatch
+        if isinstance(checklist, (frozenset, list, set, tuple)):
+            return frozenset(checklist)
+        return frozenset((checklist,))
 
-    @classmethod
-    def _regex_number_to_int(cls, number, group_index):
-        """Returns the number for the group or 0"""
-        try:
-            return int(number.group(group_index)) or 0
-        except AttributeError:
-            return 0
+    @staticmethod
+    def convert_str_to_gauge(value, checklist, match):
+        if match:
+            return 1 if value in checklist else 0
+        return 0 if value in checklist else 1
 
-    def dispatch_metric(self, value, metric):
-        """Formats the metric into the correct type with relevant tags"""
-        metric_type = metric['metric_type']
-        tags = metric['tag_by']
-        metric_name = metric['metric_name']
-        if metric_type == 'gauge':
-            self.log.debug("Sending gauge %s v: %s t: %s", metric_name, value, tags)
-            self.gauge(metric_name, value, tags)
-        elif metric_type == 'histogram':
-            self.log.debug("Sending histogram %s v: %s t: %s", metric_name, value, tags)
-            self.histogram(metric_name, value, tags)
-        else:
-            self.log.info('Unable to send metric %s due to invalid metric type of %s', metric_name, metric_type)
+    def convert_to_timedelta(self, string):
+        """Returns a time delta for strings in a format of: 0:00:00:00.0000"""
+        dt = parse_duration(string)
+        if dt is None:
+            self.log.info('Unable to convert %s to timedelta', string)
+        return dt
@@ -0,0 +1,105 @@
+# (C) Calastone Ltd. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import fnmatch
+import re
+
+WILDCARD = '*'
+GLOB_CHARS = frozenset('*?[')
+
+
+class _Node(object):
+    __slots__ = ('literals', 'wildcard', 'globs', 'patterns')
+
+    def __init__(self):
+        # segment -> node
+        self.literals = {}
+        # node for a `*` segment, it matches any single segment
+        self.wildcard = None
+        # (compiled segment pattern, node) for segments such as `disk*`
+        self.globs = []
+        # patterns ending at this node
+        self.patterns = []
+
+
+class JsonPathIndex(object):
+    """
+    Trie of dotted json paths such as `es.queue.*.length`.
+
+    Every segment is either a literal key, a `*` matching any single
+    key or a shell style pattern matched against a single key. List
+    items are addressed by their index. The trie is built once and
+    matched against a JSON document in a single pass, subtrees that no
+    path can match are not visited.
+    """
+
+    def __init__(self, patterns=()):
+        self._root = _Node()
+        self.patterns = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        node = self._root
+        for segment in pattern.split('.'):
+            if segment == WILDCARD:
+                if node.wildcard is None:
+                    node.wildcard = _Node()
+                node = node.wildcard
+            elif GLOB_CHARS.intersection(segment):
+                for regex, child in node.globs:
+                    if regex.pattern == fnmatch.translate(segment):
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.globs.append((re.compile(fnmatch.translate(segment)), child))
+                    node = child
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        if pattern not in node.patterns:
+            node.patterns.append(pattern)
+            self.patterns.append(pattern)
+
+    def match(self, json_obj, values=None):
+        """
+        Return the leaf paths matched by each pattern, in document order.
+
+        Paths are returned as tuples of keys, a pattern without any
+        match maps to an empty list. When a `values` dict is given, it
+        is filled with the raw value of every matched path.
+        """
+        matches = {pattern: [] for pattern in self.patterns}
+        self._match(json_obj, [self._root], [], matches, values)
+        return matches
+
+    def _match(self, json_obj, states, keys, matches, values):
+        items = enumerate(json_obj) if isinstance(json_obj, list) else json_obj.items()
+        for key, value in items:
+            key = str(key)
+            next_states = []
+            for node in states:
+                child = node.literals.get(key)
+                if child is not None:
+                    next_states.append(child)
+                if node.wildcard is not None:
+                    next_states.append(node.wildcard)
+                for regex, child in node.globs:
+                    if regex.match(key):
+                        next_states.append(child)
+            if not next_states:
+                continue
+
+            keys.append(key)
+            if isinstance(value, (dict, list)):
+                self._match(value, next_states, keys, matches, values)
+            else:
+                path = None
+                for node in next_states:
+                    for pattern in node.patterns:
+                        if path is None:
+                            path = tuple(keys)
+                            if values is not None:
+                                values[path] = value
+                        matches[pattern].append(path)
+            keys.pop()
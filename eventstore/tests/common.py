@@ -6,3 +6,145 @@ from datadog_checks.dev import get_docker_hostname, get_here
 HERE = get_here()
 HOST = get_docker_hostname()
 PORT = '2113'
+
+INSTANCE_JSON_PATHS = ['*', '*.*', '*.*.*', '*.*.*.*']
+
+
+def make_stats(queues=1):
+    """Build a /stats payload of an Event Store node running `queues` queues"""
+    return {
+        'proc': {
+            'startTime': '2021-05-01T10:00:00Z',
+            'id': 1,
+            'mem': 123456789,
+            'cpu': 1.5,
+            'threadsCount': 42,
+            'contentionsRate': 0.1,
+            'thrownExceptionsRate': 0.0,
+            'gc': {
+                'allocationSpeed': 1024.5,
+                'gen0ItemsCount': 10,
+                'gen0Size': 2048,
+                'gen1ItemsCount': 5,
+                'gen1Size': 4096,
+                'gen2ItemsCount': 1,
+                'gen2Size': 8192,
+                'largeHeapSize': 16384,
+                'timeInGc': 0.5,
+                'totalBytesInHeaps': 30720,
+            },
+            'diskIo': {'readBytes': 100, 'writtenBytes': 200, 'readOps': 3, 'writeOps': 4},
+            'tcp': {
+                'connections': 2,
+                'receivingSpeed': 10.5,
+                'sendingSpeed': 20.5,
+                'inSend': 0,
+                'measureTime': '0:00:00:01.5000',
+                'pendingReceived': 0,
+                'pendingSend': 0,
+                'receivedBytesSinceLastRun': 300,
+                'receivedBytesTotal': 3000,
+                'sentBytesSinceLastRun': 400,
+                'sentBytesTotal': 4000,
+            },
+        },
+        'sys': {
+            'loadavg': {'1m': 0.5, '5m': 0.4, '15m': 0.3},
+            'freeMem': 987654321,
+            'drive': {'/data': {'availableBytes': 1000, 'totalBytes': 2000, 'usage': '50%', 'usedBytes': 1000}},
+        },
+        'es': {
+            'checksum': 123456,
+            'checksumNonFlushed': 123456,
+            'queue': {
+                f'Queue #{i}': {
+                    'queueName': f'Queue #{i}',
+                    'groupName': f'Group #{i % 4}',
+                    'avgItemsPerSecond': i,
+                    'avgProcessingTime': 0.01,
+                    'currentIdleTime': '0:00:00:00.1230000',
+                    'currentItemProcessingTime': None,
+                    'idleTimePercent': 99.5,
+                    'length': i % 10,
+                    'lengthCurrentTryPeak': 5,
+                    'lengthLifetimePeak': 50,
+                    'totalItemsProcessed': 1000 * i,
+                    'inProgressMessage': '<none>',
+                    'lastProcessedMessage': 'SystemMessage.CheckpointMessage',
+                }
+                for i in range(queues)
+            },
+            'writer': {
+                'lastFlushSize': 100,
+                'lastFlushDelayMs': 0.5,
+                'meanFlushSize': 120,
+                'meanFlushDelayMs': 0.6,
+                'maxFlushSize': 500,
+                'maxFlushDelayMs': 5.5,
+                'queuedFlushMessages': 0,
+            },
+            'readIndex': {
+                'cachedRecord': 1,
+                'notCachedRecord': 2,
+                'cachedStreamInfo': 3,
+                'notCachedStreamInfo': 4,
+                'cachedTransInfo': 5,
+                'notCachedTransInfo': 6,
+            },
+        },
+    }
+
+
+PROJECTIONS = {
+    'projections': [
+        {
+            'effectiveName': name,
+            'status': status,
+            'coreProcessingTime': 10,
+            'version': 1,
+            'epoch': -1,
+            'readsInProgress': 0,
+            'writesInProgress': 0,
+            'partitionsCached': 1,
+            'progress': 100.0,
+            'eventsProcessedAfterRestart': 5,
+            'bufferedEvents': 0,
+            'writePendingEventsBeforeCheckpoint': 0,
+            'writePendingEventsAfterCheckpoint': 0,
+        }
+        for name, status in (('$by_category', 'Running'), ('$streams', 'Stopped'))
+    ]
+}
+
+SUBSCRIPTIONS = [
+    {
+        'links': [{'href': 'http://localhost:2113/subscriptions/stream/group/info', 'rel': 'detail'}],
+        'eventStreamId': 'stream',
+        'groupName': 'group',
+        'status': 'Live',
+        'averageItemsPerSecond': 1.5,
+        'totalItemsProcessed': 10,
+        'lastProcessedEventNumber': 9,
+        'lastKnownEventNumber': 9,
+        'connectionCount': 1,
+        'totalInFlightMessages': 0,
+    }
+]
+
+GOSSIP = {
+    'members': [
+        {
+            'httpEndPointIp': '127.0.0.1',
+            'httpEndPointPort': 2113,
+            'isAlive': True,
+            'lastCommitPosition': 1000,
+            'writerCheckpoint': 1000,
+            'chaserCheckpoint': 1000,
+            'epochPosition': 0,
+            'epochNumber': 0,
+            'nodePriority': 0,
+        }
+    ],
+    'serverIp': '127.0.0.1',
+    'serverPort': 2113,
+}
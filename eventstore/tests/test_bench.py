@@ -0,0 +1,76 @@
+# (C) Calastone Ltd. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import fnmatch
+import tracemalloc
+
+import pytest
+
+from datadog_checks.eventstore import EventStoreCheck
+from datadog_checks.eventstore.json_path import JsonPathIndex
+from datadog_checks.eventstore.metrics import ALL_METRICS
+
+from .common import INSTANCE_JSON_PATHS, make_stats
+
+QUEUES = 500
+
+
+def _patterns():
+    patterns = []
+    for metric in ALL_METRICS['/stats']:
+        patterns.append(metric['json_path'])
+        patterns.extend(tag.rsplit(':', 1)[-1] for tag in metric.get('tag_by', ()))
+    return patterns + INSTANCE_JSON_PATHS
+
+
+def _walk(json_obj, p, es_paths):
+    """Flatten the payload to dotted leaf paths, as done before the path index"""
+    if isinstance(json_obj, list):
+        json_obj = {str(k): v for k, v in enumerate(json_obj)}
+    for key, value in json_obj.items():
+        p.append(key)
+        if isinstance(value, (dict, list)):
+            _walk(value, p, es_paths)
+        else:
+            path = '.'.join(p)
+            if path not in es_paths:
+                es_paths.append(path)
+        p.pop()
+    return es_paths
+
+
+def _match_walk_fnmatch(payload, patterns):
+    es_paths = _walk(payload, [], [])
+    return {pattern: [path for path in es_paths if fnmatch.fnmatch(path, pattern)] for pattern in patterns}
+
+
+def _match_path_index(payload, patterns):
+    return JsonPathIndex(patterns).match(payload)
+
+
+@pytest.mark.parametrize('match', [_match_walk_fnmatch, _match_path_index], ids=['walk_fnmatch', 'path_index'])
+def test_match_paths(benchmark, match):
+    payload = make_stats(queues=QUEUES)
+    patterns = _patterns()
+
+    benchmark.pedantic(match, args=(payload, patterns), rounds=3, warmup_rounds=1)
+
+    tracemalloc.start()
+    match(payload, patterns)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info['peak_bytes'] = peak
+
+
+def test_check_endpoint(benchmark, aggregator, mock_http_response):
+    mock_http_response(json_data=make_stats(queues=QUEUES))
+    instance = {'url': 'http://localhost:2113', 'endpoints': ['/stats'], 'json_path': INSTANCE_JSON_PATHS}
+    c = EventStoreCheck('eventstore', {}, [instance])
+
+    benchmark.pedantic(c.check, args=(instance,), rounds=5, warmup_rounds=1)
+
+    tracemalloc.start()
+    c.check(instance)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info['peak_bytes'] = peak
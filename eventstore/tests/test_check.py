@@ -1,13 +1,18 @@
 # (C) Calastone Ltd. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import datetime
 
 import pytest
 
 from datadog_checks.base.errors import CheckException
 from datadog_checks.eventstore import EventStoreCheck
+from datadog_checks.eventstore.eventstore import parse_duration
+from datadog_checks.eventstore.json_path import JsonPathIndex
 from datadog_checks.eventstore.metrics import ALL_METRICS
 
+from .common import GOSSIP, INSTANCE_JSON_PATHS, PROJECTIONS, SUBSCRIPTIONS, make_stats
+
 
 @pytest.mark.unit
 def test_config():
@@ -64,3 +69,149 @@ def test_integration(aggregator, instance):
             aggregator.assert_metric(metric['metric_name'], tags=[])
 
     aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_json_path_index():
+    index = JsonPathIndex(['proc.cpu', 'proc.tcp.*', 'es.queue.*.length', '*.status', 'proc.disk*.readOps', 'missing'])
+    matches = index.match(
+        {
+            'proc': {'cpu': 1.5, 'tcp': {'connections': 2, 'inSend': 0}, 'diskIo': {'readOps': 3, 'writeOps': 4}},
+            'es': {'queue': {'a': {'length': 1}, 'b': {'length': 2}}},
+            'subscriptions': {'status': 'Live'},
+            'projections': [{'status': 'Running'}],
+        }
+    )
+
+    assert matches['proc.cpu'] == [('proc', 'cpu')]
+    assert matches['proc.tcp.*'] == [('proc', 'tcp', 'connections'), ('proc', 'tcp', 'inSend')]
+    assert matches['es.queue.*.length'] == [('es', 'queue', 'a', 'length'), ('es', 'queue', 'b', 'length')]
+    # a wildcard matches a single key
+    assert matches['*.status'] == [('subscriptions', 'status')]
+    assert matches['proc.disk*.readOps'] == [('proc', 'diskIo', 'readOps')]
+    assert matches['missing'] == []
+
+
+@pytest.mark.unit
+def test_json_path_index_lists():
+    index = JsonPathIndex(['*.status', 'projections.*.status', 'projections.*'])
+    matches = index.match({'projections': [{'status': 'Running'}, {'status': 'Stopped'}]})
+
+    assert matches['projections.*.status'] == [('projections', '0', 'status'), ('projections', '1', 'status')]
+    # only leaves are matched
+    assert matches['projections.*'] == []
+    assert matches['*.status'] == []
+    assert JsonPathIndex(['*.status']).match([{'status': 'Live'}])['*.status'] == [('0', 'status')]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    'endpoint, payload',
+    [
+        ('/stats', make_stats(queues=3)),
+        ('/projections/all-non-transient', PROJECTIONS),
+        ('/subscriptions', SUBSCRIPTIONS),
+        ('/gossip', GOSSIP),
+    ],
+)
+def test_check_endpoint(aggregator, mock_http_response, endpoint, payload):
+    mock_http_response(json_data=payload)
+    instance = {'url': 'http://localhost:2113', 'endpoints': [endpoint], 'json_path': INSTANCE_JSON_PATHS}
+    c = EventStoreCheck('eventstore', {}, [instance])
+    c.check(instance)
+    plan = c._plans[(endpoint, tuple(INSTANCE_JSON_PATHS))]
+    c.check(instance)
+
+    # the path index and metric definitions are resolved once
+    assert c._plans == {(endpoint, tuple(INSTANCE_JSON_PATHS)): plan}
+    for metric in ALL_METRICS[endpoint]:
+        aggregator.assert_metric(metric['metric_name'])
+    aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_check_endpoint_tags(aggregator, mock_http_response):
+    mock_http_response(json_data=make_stats(queues=2))
+    instance = {'url': 'http://localhost:2113', 'endpoints': ['/stats'], 'json_path': ['es.queue.*.length']}
+    c = EventStoreCheck('eventstore', {}, [instance])
+    c.check(instance)
+
+    name_tag = 'name:http://localhost:2113/stats'
+    aggregator.assert_metric(
+        'eventstore.es.queue.length', value=0, tags=[name_tag, 'queue_name:Queue #0', 'group_name:Group #0'], count=1
+    )
+    aggregator.assert_metric(
+        'eventstore.es.queue.length', value=1, tags=[name_tag, 'queue_name:Queue #1', 'group_name:Group #1'], count=1
+    )
+    aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_check_endpoint_named_tags(aggregator, mock_http_response):
+    mock_http_response(json_data=PROJECTIONS)
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': ['/projections/all-non-transient'],
+        'json_path': ['projections.*.status'],
+        'tag_by_url': True,
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    c.check(instance)
+
+    url = 'http://localhost:2113/projections/all-non-transient'
+    tags = [f'instance:{url}', f'name:{url}']
+    aggregator.assert_metric('eventstore.projection.running', value=1, tags=tags + ['projection:$by_category'])
+    aggregator.assert_metric('eventstore.projection.running', value=0, tags=tags + ['projection:$streams'])
+    aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_extraction_stats(aggregator, mock_http_response):
+    mock_http_response(json_data=make_stats(queues=2))
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': ['/stats'],
+        'json_path': ['es.queue.*.length', 'proc.cpu'],
+        'extraction_stats': True,
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    c.check(instance)
+
+    tags = ['name:http://localhost:2113/stats', 'endpoint:/stats']
+    aggregator.assert_metric('eventstore.check.extraction_time', tags=tags, count=1)
+    # every path of the endpoint definitions is matched, the instance only selects some
+    aggregator.assert_metric('eventstore.check.matched_paths', tags=tags, count=1)
+    assert aggregator.metrics('eventstore.check.matched_paths')[0].value > 3
+    aggregator.assert_metric('eventstore.check.submitted_metrics', value=3, tags=tags, count=1)
+
+
+@pytest.mark.unit
+def test_parse_duration():
+    assert parse_duration('1:02:03:04.5') == datetime.timedelta(days=1, hours=2, minutes=3, seconds=4, microseconds=5)
+    assert parse_duration('None') is None
+    assert parse_duration('0:00:00:01.5000') is parse_duration('0:00:00:01.5000')
+
+
+@pytest.mark.unit
+def test_metric_specs():
+    c = EventStoreCheck('eventstore', {}, [{}])
+    definition = {
+        "json_path": "projections.*.status",
+        "json_type": "str",
+        "metric_name": "eventstore.projection.running",
+        "metric_type": "gauge",
+        "match": ["Running", "Starting"],
+        "tag_by": ["projection:projections.*.effectiveName", "version"],
+    }
+
+    spec = c.get_metric_spec(definition)
+    assert spec.tags == (('projection', 'projections.*.effectiveName', 1), (None, 'version', None))
+    assert spec.convert('Starting') == 1
+    assert spec.convert('Stopped') == 0
+    assert c.get_metric_spec(dict(definition, match=None, mismatch='Stopped')).convert('Stopped') == 0
+
+    assert c.get_metric_spec(dict(definition, mismatch='Stopped')) is None
+    assert c.get_metric_spec(dict(definition, metric_type='count')) is None
+    assert c.get_metric_spec(dict(definition, json_type='datetime')).convert('0:00:00:01.0') == 1.0
+    assert c.get_metric_spec(dict(definition, json_type='datetime')).convert('N/A') == 0.0
+    assert c.get_metric_spec(dict(definition, json_type='int')).convert('1.5') is None
@@ -4,21 +4,18 @@
 
 # stdlib
 import errno
-import json
 import os
 import re
 import sre_constants
+import time
 
-import six
 from six import iteritems
 
 from datadog_checks.base import AgentCheck, is_affirmative
 from datadog_checks.base.utils.containers import hash_mutable
 
-if six.PY3:
-    from collections.abc import MutableMapping
-else:
-    from collections import MutableMapping
+from .registry import RegistryReader
+from .stats import StatsExtractor
 
 EVENT_TYPE = SOURCE_TYPE_NAME = "filebeat"
 
@@ -89,32 +86,42 @@ class FilebeatCheckHttpProfiler:
     def __init__(self, config, http):
         self._config = config
         self._http = http
-        self._previous_increment_values = {}
-        # regex matching ain't free, let's cache this
-        self._should_keep_metrics = {}
+        # compiled on the first run, from the metrics matching the `only_metrics` regexes
+        self._extractor = None
+        self._increment_count = 0
+        # values of the increment metrics at the previous run, in the order of the extractor's names
+        self._previous_increment_values = None
 
     def gather_metrics(self):
         if not self._config.stats_endpoint:
             return {}
 
-        response = self._make_request()
+        if self._extractor is None:
+            self._extractor = self._compile_extractor()
 
-        return {"increment": self._gather_increment_metrics(response), "gauge": self._gather_gauge_metrics(response)}
+        values = self._extractor.extract(self._make_request())
+        increment_values = values[: self._increment_count]
+        gauge_values = values[self._increment_count :]
+
+        return {
+            "increment": self._gather_increment_metrics(increment_values),
+            "gauge": self._gather_gauge_metrics(gauge_values),
+        }
+
+    def _compile_extractor(self):
+        increment_names = [name for name in self.INCREMENT_METRIC_NAMES if self._config.should_keep_metric(name)]
+        gauge_names = [name for name in self.GAUGE_METRIC_NAMES if self._config.should_keep_metric(name)]
+        self._increment_count = len(increment_names)
+        return StatsExtractor(increment_names + gauge_names)
 
     def _make_request(self):
 
         response = self._http.get(self._config.stats_endpoint)
         response.raise_for_status()
 
-        return self.flatten(response.json())
-
-    def _gather_increment_metrics(self, response):
-        new_values = {
-            name: response[name]
-            for name in self.INCREMENT_METRIC_NAMES
-            if self._should_keep_metric(name) and name in response
-        }
+        return response.json()
 
+    def _gather_increment_metrics(self, new_values):
         deltas = self._compute_increment_deltas(new_values)
 
         self._previous_increment_values = new_values
@@ -122,42 +129,34 @@ class FilebeatCheckHttpProfiler:
         return deltas
 
     def _compute_increment_deltas(self, new_values):
-        deltas = {}
+        previous_values = self._previous_increment_values
+        if previous_values is None:
+            return {}
 
-        for name, new_value in iteritems(new_values):
-            if name not in self._previous_increment_values or self._previous_increment_values[name] > new_value:
-                # either the agent or filebeat got restarted, we're not
-                # reporting anything this time around
+        deltas = {}
+        names = self._extractor.names
+        for position, new_value in enumerate(new_values):
+            previous_value = previous_values[position]
+            if new_value is None or previous_value is None:
+                # the counter isn't reported anymore or only started being reported
+                continue
+            if new_value < previous_value:
+                # counters only go down when filebeat got restarted, all of them
+                # restarted from zero so we're not reporting anything this time around
                 return {}
-            deltas[name] = new_value - self._previous_increment_values[name]
+            deltas[names[position]] = new_value - previous_value
 
         return deltas
 
-    def _gather_gauge_metrics(self, response):
-        return {
-            name: response[name]
-            for name in self.GAUGE_METRIC_NAMES
-            if self._should_keep_metric(name) and name in response
-        }
-
-    def _should_keep_metric(self, name):
-        if name not in self._should_keep_metrics:
-            self._should_keep_metrics[name] = self._config.should_keep_metric(name)
-        return self._should_keep_metrics[name]
-
-    def flatten(self, d, parent_key="", sep="."):
-        items = []
-        for k, v in d.items():
-            new_key = parent_key + sep + k if parent_key else k
-            if isinstance(v, MutableMapping):
-                items.extend(self.flatten(v, new_key, sep=sep).items())
-            else:
-                items.append((new_key, v))
-        return dict(items)
+    def _gather_gauge_metrics(self, values):
+        names = self._extractor.names[self._increment_count :]
+        return {name: value for name, value in zip(names, values) if value is not None}
 
 
 class FilebeatCheckInstanceConfig:
 
+    DEFAULT_SOURCE_STAT_INTERVAL = 60
+
     _only_metrics_regexes = None
 
     def __init__(self, instance):
@@ -171,6 +170,12 @@ class FilebeatCheckInstanceConfig:
 
         self._ignore_registry = instance.get("ignore_registry", False)
 
+        self._source_stat_interval = instance.get("source_stat_interval", self.DEFAULT_SOURCE_STAT_INTERVAL)
+        if not isinstance(self._source_stat_interval, (int, float)) or self._source_stat_interval < 0:
+            raise Exception(
+                f"If given, filebeat's source_stat_interval must be a non-negative number, got {self._source_stat_interval}"
+            )
+
         if not isinstance(self._only_metrics, list):
             raise Exception(
                 f"If given, filebeat's only_metrics must be a list of regexes, got {self._only_metrics}"
@@ -188,6 +193,10 @@ class FilebeatCheckInstanceConfig:
     def ignore_registry(self):
         return self._ignore_registry
 
+    @property
+    def source_stat_interval(self):
+        return self._source_stat_interval
+
     def should_keep_metric(self, metric_name):
 
         if not self._only_metrics:
@@ -239,42 +248,34 @@ class FilebeatCheck(AgentCheck):
         if instance_key in self.instance_cache:
             config = self.instance_cache[instance_key]["config"]
             profiler = self.instance_cache[instance_key]["profiler"]
+            registry = self.instance_cache[instance_key]["registry"]
         else:
             config = FilebeatCheckInstanceConfig(instance)
             profiler = FilebeatCheckHttpProfiler(config, self.http)
-            self.instance_cache[instance_key] = {"config": config, "profiler": profiler}
+            registry = {"reader": RegistryReader(config.registry_file_path, self.log), "sources": {}}
+            self.instance_cache[instance_key] = {"config": config, "profiler": profiler, "registry": registry}
 
         if not config.ignore_registry:
-            self._process_registry(config)
+            self._process_registry(config, registry)
 
         self._gather_http_profiler_metrics(config, profiler, normalize_metrics)
 
-    def _process_registry(self, config):
-        registry_contents = self._parse_registry_file(config.registry_file_path)
-
-        if isinstance(registry_contents, dict):
-            # filebeat version < 5
-            registry_contents = registry_contents.values()
+    def _process_registry(self, config, registry):
+        registry_contents = self._parse_registry_file(registry["reader"])
 
+        # source -> (offset, stats or None when they couldn't be read, time of the os.stat call)
+        previous_sources = registry["sources"]
+        sources = registry["sources"] = {}
+        now = time.time()
         for item in registry_contents:
-            self._process_registry_item(item)
+            self._process_registry_item(item, previous_sources, sources, now, config.source_stat_interval)
 
-    def _parse_registry_file(self, registry_file_path):
+    def _parse_registry_file(self, reader):
         try:
-            with open(registry_file_path) as registry_file:
-                return json.load(registry_file)
-
-        except ValueError:
-            contents = []
-            with open(registry_file_path) as registry_file:
-                for line in registry_file:
-                    content = json.loads(line)
-                    if 'op' not in content.keys():
-                        contents.append(content['v'])
-            return contents
+            return reader.read()
 
         except IOError as ex:
-            self.log.error("Cannot read the registry log file at %s: %s", registry_file_path, ex)
+            self.log.error("Cannot read the registry log file at %s: %s", reader.path, ex)
 
             if ex.errno == errno.EACCES:
                 self.log.error(
@@ -283,22 +284,31 @@ class FilebeatCheck(AgentCheck):
 
             return []
 
-    def _process_registry_item(self, item):
+    def _process_registry_item(self, item, previous_sources, sources, now, stat_interval):
         source = item["source"]
         offset = item["offset"]
         tags = self.tags + ["source:{0}".format(source)]
 
-        try:
-            stats = os.stat(source)
-
-            if self._is_same_file(stats, item["FileStateOS"]):
-                unprocessed_bytes = stats.st_size - offset
+        # A source is only stat'ed again when filebeat read it or its stats are older than the interval
+        cached = previous_sources.get(source)
+        if cached is not None and cached[0] == offset and now - cached[2] < stat_interval:
+            stats, stat_time = cached[1], cached[2]
+        else:
+            try:
+                stats = os.stat(source)
+            except OSError:
+                stats = None
+            stat_time = now
+        sources[source] = (offset, stats, stat_time)
 
-                self.gauge("registry.unprocessed_bytes", unprocessed_bytes, tags=tags)
-            else:
-                self.log.debug("Filebeat source %s appears to have changed", source)
-        except OSError:
+        if stats is None:
             self.log.debug("Unable to get stats on filebeat source %s", source)
+        elif self._is_same_file(stats, item["FileStateOS"]):
+            unprocessed_bytes = stats.st_size - offset
+
+            self.gauge("registry.unprocessed_bytes", unprocessed_bytes, tags=tags)
+        else:
+            self.log.debug("Filebeat source %s appears to have changed", source)
 
     def _is_same_file(self, stats, file_state_os):
         return stats.st_dev == file_state_os["device"] and stats.st_ino == file_state_os["inode"]
@@ -0,0 +1,134 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import json
+import os
+
+
+class RegistryReader(object):
+    """
+    Incremental reader of a filebeat registry.
+
+    Filebeat >= 7 appends every update of its registry to an NDJSON log.
+    Only the operations appended since the previous read are parsed and
+    applied to an in-memory map of the source states. The byte offset and
+    the inode of the log are remembered, a log that was replaced or
+    truncated is read again from the start.
+
+    Older registries are JSON documents rewritten as a whole, they are
+    only parsed again when their inode, size or modification time changed.
+    """
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        self._reset(None)
+
+    def _reset(self, file_id):
+        self._file_id = file_id
+        self._offset = 0
+        self._json_version = None
+        # Whether the registry is an NDJSON log, None until it is read
+        self._ndjson = None
+        self._items = []
+        # source -> latest state of the source
+        self._sources = {}
+        # registry key -> sources, to apply removals
+        self._keys = {}
+        self._operation = None
+
+    def read(self):
+        """Return the registry items, after applying the operations written since the previous read."""
+        with open(self.path, 'rb') as registry_file:
+            stats = os.fstat(registry_file.fileno())
+            file_id = (stats.st_dev, stats.st_ino)
+            if file_id != self._file_id or stats.st_size < self._offset:
+                self._reset(file_id)
+
+            if self._ndjson is False:
+                version = (stats.st_size, stats.st_mtime_ns)
+                if version == self._json_version:
+                    return self._items
+                try:
+                    self._read_json(registry_file.read())
+                except ValueError:
+                    # Not a JSON document anymore, the format is detected again
+                    self._reset(file_id)
+                    registry_file.seek(0)
+                else:
+                    self._json_version = version
+                    return self._items
+
+            registry_file.seek(self._offset)
+            contents = registry_file.read()
+
+        if self._ndjson is None:
+            self._ndjson = self._detect_ndjson(contents)
+            if self._ndjson is None:
+                return []
+            if not self._ndjson:
+                self._read_json(contents)
+                self._json_version = (stats.st_size, stats.st_mtime_ns)
+                return self._items
+
+        # A last line without a newline may still be being written, it is read on the next run
+        end = contents.rfind(b'\n') + 1
+        for line in contents[:end].splitlines():
+            if line.strip():
+                self._apply(line)
+        self._offset += end
+
+        return self._sources.values()
+
+    @staticmethod
+    def _detect_ndjson(contents):
+        """
+        Return whether the registry is an NDJSON log, from its first line, or None for an empty registry.
+
+        The log may only hold a single operation, which is also a valid JSON document,
+        so the format is told from the keys of the operations.
+        """
+        contents = contents.lstrip()
+        if not contents:
+            return None
+        try:
+            first = json.loads(contents.split(b'\n', 1)[0])
+        except ValueError:
+            # A JSON document spanning several lines, or a first line still being written
+            try:
+                json.loads(contents)
+            except ValueError:
+                return True
+            return False
+        return isinstance(first, dict) and ('op' in first or 'k' in first)
+
+    def _read_json(self, contents):
+        items = json.loads(contents)
+        if isinstance(items, dict):
+            # filebeat version < 5
+            items = list(items.values())
+        self._items = items
+
+    def _apply(self, line):
+        try:
+            content = json.loads(line)
+        except ValueError as e:
+            self.log.warning("Skipping malformed line of the registry log file at %s: %s", self.path, e)
+            return
+
+        if 'op' in content:
+            self._operation = content['op']
+            return
+
+        key = content.get('k')
+        if self._operation == 'remove':
+            for source in self._keys.pop(key, ()):
+                self._sources.pop(source, None)
+            return
+
+        state = content.get('v')
+        if state is None or 'source' not in state:
+            return
+        source = state['source']
+        self._sources[source] = state
+        self._keys.setdefault(key, set()).add(source)
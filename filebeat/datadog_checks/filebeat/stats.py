@@ -0,0 +1,49 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import six
+
+if six.PY3:
+    from collections.abc import MutableMapping
+else:
+    from collections import MutableMapping
+
+
+class StatsExtractor(object):
+    """
+    Extracts the values of known metrics from the stats of filebeat's HTTP profiler.
+
+    Metric names are the dotted paths of the values in the stats, whose keys
+    may themselves contain dots depending on filebeat's version. Every prefix
+    of the metric names is indexed once, only the objects on the way to one
+    of the metrics are visited and the rest of the stats is skipped.
+    """
+
+    def __init__(self, names, sep="."):
+        self.names = tuple(names)
+        self._sep = sep
+        self._positions = {name: position for position, name in enumerate(self.names)}
+        self._prefixes = set()
+        for name in self.names:
+            parts = name.split(sep)
+            for end in range(1, len(parts)):
+                self._prefixes.add(sep.join(parts[:end]))
+
+    def extract(self, stats):
+        """Return the values of the metrics in the order of their names, None for missing ones."""
+        values = [None] * len(self.names)
+        if self.names:
+            self._visit(stats, "", values)
+        return values
+
+    def _visit(self, stats, parent_key, values):
+        for key, value in stats.items():
+            if parent_key:
+                key = parent_key + self._sep + key
+            if isinstance(value, MutableMapping):
+                if key in self._prefixes:
+                    self._visit(value, key, values)
+            else:
+                position = self._positions.get(key)
+                if position is not None:
+                    values[position] = value
@@ -0,0 +1,122 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import json
+import os
+from collections import namedtuple
+from itertools import count
+
+import mock
+import pytest
+
+from datadog_checks.filebeat import FilebeatCheck
+from datadog_checks.filebeat.filebeat import FilebeatCheckHttpProfiler
+from datadog_checks.filebeat.stats import StatsExtractor
+
+SOURCES = 50000
+UPDATES = SOURCES // 100
+
+file_stats = namedtuple("file_stats", ["st_size", "st_ino", "st_dev"])
+
+
+def write_operations(f, sources, ids, offset):
+    for source in sources:
+        state = {
+            "source": "/var/log/{}.log".format(source),
+            "offset": offset,
+            "FileStateOS": {"inode": source, "device": 1},
+        }
+        f.write(json.dumps({"op": "set", "id": next(ids)}) + "\n")
+        f.write(json.dumps({"k": "filebeat::logs::native::{}-1".format(source), "v": state}) + "\n")
+
+
+@pytest.mark.parametrize("mode", ["full", "incremental"])
+def test_registry_log(benchmark, aggregator, tmp_path, mode):
+    registry = str(tmp_path / "log.json")
+    ids = count()
+    with open(registry, "w") as f:
+        write_operations(f, range(SOURCES), ids, 0)
+
+    stats = {"/var/log/{}.log".format(i): file_stats(1000000, i, 1) for i in range(SOURCES)}
+    config = {"registry_file_path": registry}
+    check = FilebeatCheck("filebeat", {}, [config])
+    offsets = count(1)
+
+    def append_updates():
+        offset = next(offsets)
+        with open(registry, "a") as f:
+            start = offset * UPDATES % SOURCES
+            write_operations(f, range(start, start + UPDATES), ids, offset)
+
+    def run(check):
+        aggregator.reset()
+        check.check(config)
+
+    def fresh_check():
+        # Every run reads the whole registry and stats every source, like a check without state
+        append_updates()
+        return (FilebeatCheck("filebeat", {}, [config]),), {}
+
+    vanilla_os_stat = os.stat
+    with mock.patch.object(os, "stat", side_effect=lambda path: stats.get(path) or vanilla_os_stat(path)):
+        if mode == "full":
+            benchmark.pedantic(run, setup=fresh_check, rounds=5)
+        else:
+            run(check)
+            benchmark.pedantic(run, args=(check,), setup=append_updates, rounds=20)
+
+    assert len(aggregator.metrics("filebeat.registry.unprocessed_bytes")) == SOURCES
+
+
+def make_stats():
+    """Stats of a filebeat 7 with many inputs, nested objects like /stats returns them."""
+    stats = {}
+    for name in FilebeatCheckHttpProfiler.INCREMENT_METRIC_NAMES + FilebeatCheckHttpProfiler.GAUGE_METRIC_NAMES:
+        node = stats
+        *parents, leaf = name.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = 1000
+    stats["beat"] = {
+        "memstats": {
+            "BySize": [{"Size": size, "Mallocs": size, "Frees": size} for size in range(61)],
+            "PauseNs": list(range(256)),
+        },
+        "handles": {"limit": {"hard": 1048576, "soft": 1048576}, "open": 42},
+    }
+    stats["filebeat"]["inputs"] = {
+        "input-{}".format(i): {
+            "harvester": {"running": 1, "started": 10, "closed": 9},
+            "files": {"file-{}".format(f): {"size": f, "offset": f, "read_errors": 0} for f in range(10)},
+        }
+        for i in range(200)
+    }
+    return stats
+
+
+def flatten(d, parent_key="", sep="."):
+    items = []
+    for k, v in d.items():
+        new_key = parent_key + sep + k if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+@pytest.mark.parametrize("method", ["flatten", "extractor"])
+def test_profiler_stats(benchmark, method):
+    stats = make_stats()
+    names = FilebeatCheckHttpProfiler.INCREMENT_METRIC_NAMES + FilebeatCheckHttpProfiler.GAUGE_METRIC_NAMES
+    if method == "flatten":
+        # what the profiler did before: flatten all the stats, then pick the metrics
+        def extract(stats):
+            flat = flatten(stats)
+            return [flat.get(name) for name in names]
+
+    else:
+        extract = StatsExtractor(names).extract
+
+    values = benchmark(extract, stats)
+    assert values.count(1000) == len(names)
@@ -2,6 +2,7 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+import json
 import os
 import re
 from collections import namedtuple
@@ -10,6 +11,8 @@ import mock
 import pytest
 
 from datadog_checks.filebeat import FilebeatCheck
+from datadog_checks.filebeat.filebeat import FilebeatCheckHttpProfiler, FilebeatCheckInstanceConfig
+from datadog_checks.filebeat.stats import StatsExtractor
 
 from .common import BAD_ENDPOINT, registry_file_path
 
@@ -174,6 +177,135 @@ def test_source_file_device_has_changed(aggregator):
     aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=0)
 
 
+def registry_operations(states, op="set"):
+    lines = []
+    for i, (source, offset, inode) in enumerate(states):
+        key = "filebeat::logs::native::{}-51713".format(inode)
+        lines.append(json.dumps({"op": op, "id": i}))
+        if op == "remove":
+            lines.append(json.dumps({"k": key}))
+        else:
+            state = {"source": source, "offset": offset, "FileStateOS": {"inode": inode, "device": 51713}}
+            lines.append(json.dumps({"k": key, "v": state}))
+    return "".join(line + "\n" for line in lines)
+
+
+def unprocessed_bytes(aggregator):
+    return {metric.tags[0]: metric.value for metric in aggregator.metrics("filebeat.registry.unprocessed_bytes")}
+
+
+def test_registry_log_is_read_incrementally(aggregator, tmp_path):
+    registry = tmp_path / "log.json"
+    registry.write_text(registry_operations([("/var/log/a.log", 10, 1), ("/var/log/b.log", 20, 2)]))
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    stats = {"/var/log/a.log": mocked_file_stats(100, 1, 51713), "/var/log/b.log": mocked_file_stats(100, 2, 51713)}
+
+    with mocked_os_stat(stats):
+        check.check(config)
+    assert unprocessed_bytes(aggregator) == {"source:/var/log/a.log": 90, "source:/var/log/b.log": 80}
+
+    # Appended operations are applied, a line still being written is left for the next run
+    with open(str(registry), "a") as f:
+        f.write(registry_operations([("/var/log/a.log", 50, 1)]))
+        f.write(registry_operations([("/var/log/b.log", 20, 2)], op="remove"))
+        f.write('{"op": "set", "id"')
+    aggregator.reset()
+    with mocked_os_stat(stats), mock.patch("datadog_checks.filebeat.registry.json.loads", wraps=json.loads) as loads:
+        check.check(config)
+    assert loads.call_count == 4
+    assert unprocessed_bytes(aggregator) == {"source:/var/log/a.log": 50}
+
+    # A registry replaced by a shorter one is read from the start
+    registry.write_text(registry_operations([("/var/log/c.log", 30, 3)]))
+    stats["/var/log/c.log"] = mocked_file_stats(100, 3, 51713)
+    aggregator.reset()
+    with mocked_os_stat(stats):
+        check.check(config)
+    assert unprocessed_bytes(aggregator) == {"source:/var/log/c.log": 70}
+
+
+def test_registry_log_starting_with_a_single_operation(aggregator, tmp_path):
+    # Right after a checkpoint, the log may only hold the first line of an operation
+    registry = tmp_path / "log.json"
+    operations = registry_operations([("/var/log/a.log", 10, 1)])
+    first_line, second_line = operations.splitlines(True)
+    registry.write_text(first_line)
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    stats = {"/var/log/a.log": mocked_file_stats(100, 1, 51713)}
+
+    with mocked_os_stat(stats):
+        check.check(config)
+        assert unprocessed_bytes(aggregator) == {}
+
+        with open(str(registry), "a") as f:
+            f.write(second_line)
+        check.check(config)
+    assert unprocessed_bytes(aggregator) == {"source:/var/log/a.log": 90}
+
+
+def test_registry_format_detected_again(aggregator, tmp_path):
+    # A JSON registry rewritten in place as an NDJSON log
+    registry = tmp_path / "log.json"
+    state = {"source": "/var/log/a.log", "offset": 10, "FileStateOS": {"inode": 1, "device": 51713}}
+    registry.write_text(json.dumps([state]))
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    stats = {"/var/log/a.log": mocked_file_stats(100, 1, 51713), "/var/log/b.log": mocked_file_stats(100, 2, 51713)}
+
+    with mocked_os_stat(stats):
+        check.check(config)
+        assert unprocessed_bytes(aggregator) == {"source:/var/log/a.log": 90}
+
+        with open(str(registry), "w") as f:
+            f.write(registry_operations([("/var/log/b.log", 20, 2), ("/var/log/a.log", 30, 1)]))
+        aggregator.reset()
+        check.check(config)
+    assert unprocessed_bytes(aggregator) == {"source:/var/log/a.log": 70, "source:/var/log/b.log": 80}
+
+
+def test_sources_are_only_stated_when_read_or_stale(aggregator, tmp_path):
+    registry = tmp_path / "log.json"
+    registry.write_text(registry_operations([("/var/log/a.log", 10, 1), ("/var/log/b.log", 20, 2)]))
+    config = {"registry_file_path": str(registry), "source_stat_interval": 30}
+    check = FilebeatCheck("filebeat", {}, [config])
+    stats = {"/var/log/a.log": mocked_file_stats(100, 1, 51713), "/var/log/b.log": mocked_file_stats(100, 2, 51713)}
+
+    with mocked_os_stat(stats) as os_stat, mock.patch("datadog_checks.filebeat.filebeat.time.time") as now:
+
+        def stated_sources():
+            sources = [c.args[0] for c in os_stat.call_args_list if c.args[0] in stats]
+            os_stat.reset_mock()
+            return sources
+
+        now.return_value = 1000
+        check.check(config)
+        assert sorted(stated_sources()) == ["/var/log/a.log", "/var/log/b.log"]
+
+        # Only the source read by filebeat is stat'ed again
+        with open(str(registry), "a") as f:
+            f.write(registry_operations([("/var/log/a.log", 60, 1)]))
+        now.return_value = 1010
+        check.check(config)
+        assert stated_sources() == ["/var/log/a.log"]
+
+        now.return_value = 1035
+        check.check(config)
+        assert stated_sources() == ["/var/log/b.log"]
+
+    metrics = aggregator.metrics("filebeat.registry.unprocessed_bytes")
+    assert [m.value for m in metrics if m.tags[0].endswith("a.log")] == [90, 40, 40]
+
+
+def test_invalid_source_stat_interval():
+    config = _build_instance("happy_path")
+    config["source_stat_interval"] = -1
+    check = FilebeatCheck("filebeat", {}, [config])
+    with pytest.raises(Exception, match="source_stat_interval must be a non-negative number"):
+        check.check(config)
+
+
 def generate_http_profiler_body(body_update):
     base_body = {
         "cmdline": [
@@ -400,6 +532,59 @@ def test_when_filebeat_restarts(aggregator):
     aggregator.assert_metric("libbeat.kafka.published_and_acked_events", metric_type=aggregator.COUNTER, value=11)
 
 
+def gather_profiler_metrics(profiler, body):
+    profiler._http.get.return_value = mock.MagicMock(status_code=200, json=lambda: body)
+    return profiler.gather_metrics()
+
+
+def build_profiler(only_metrics=None):
+    instance = _build_instance("empty", stats_endpoint="http://localhost:9999", only_metrics=only_metrics)
+    return FilebeatCheckHttpProfiler(FilebeatCheckInstanceConfig(instance), mock.Mock())
+
+
+def test_profiler_reads_nested_stats():
+    profiler = build_profiler(only_metrics=[r"^libbeat.output", r"^filebeat.harvester.running$"])
+    body = {
+        "beat": {"memstats": {"gc_next": 10}},
+        "filebeat": {"harvester": {"running": 3, "started": 4}},
+        "libbeat": {"output": {"events": {"acked": 10, "total": 12}}, "pipeline": {"events": {"total": 12}}},
+    }
+    assert gather_profiler_metrics(profiler, body) == {"increment": {}, "gauge": {"filebeat.harvester.running": 3}}
+
+    body["libbeat"]["output"]["events"] = {"acked": 15, "total": 19}
+    assert gather_profiler_metrics(profiler, body) == {
+        "increment": {"libbeat.output.events.acked": 5, "libbeat.output.events.total": 7},
+        "gauge": {"filebeat.harvester.running": 3},
+    }
+
+
+def test_profiler_counter_resets():
+    profiler = build_profiler(only_metrics=[r"^libbeat.output"])
+    gather_profiler_metrics(profiler, {"libbeat.output.events.acked": 10})
+
+    # a counter reported for the first time has nothing to be compared to
+    metrics = gather_profiler_metrics(profiler, {"libbeat.output.events.acked": 15, "libbeat.output.events.total": 20})
+    assert metrics["increment"] == {"libbeat.output.events.acked": 5}
+
+    # a counter going down means filebeat restarted, none of the counters are reported
+    metrics = gather_profiler_metrics(profiler, {"libbeat.output.events.acked": 2, "libbeat.output.events.total": 30})
+    assert metrics["increment"] == {}
+
+    metrics = gather_profiler_metrics(profiler, {"libbeat.output.events.acked": 4, "libbeat.output.events.total": 31})
+    assert metrics["increment"] == {"libbeat.output.events.acked": 2, "libbeat.output.events.total": 1}
+
+
+def test_stats_extractor():
+    extractor = StatsExtractor(["a.b.c", "a.d", "e"])
+    stats = {"a": {"b.c": 1, "d": {"f": 2}, "x": {"b": {"c": 3}}}, "e": 4, "a.d": 5}
+    assert extractor.extract(stats) == [1, 5, 4]
+
+    # unrelated objects aren't visited
+    stats = {"a": {"b": {"c": 1}}, "x": mock.MagicMock(spec=dict)}
+    assert extractor.extract(stats) == [1, None, None]
+    stats["x"].items.assert_not_called()
+
+
 def test_when_the_http_call_times_out(aggregator):
     config = _build_instance("empty", stats_endpoint="http://localhost:9999")
     check = FilebeatCheck("filebeat", {}, [config])
@@ -0,0 +1,57 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import time
+from collections import OrderedDict
+
+
+class CounterStore(object):
+    """
+    Last values of the NATS counters, to submit their deltas.
+
+    Counters are keyed by metric path and connection or route id, so every
+    new connection adds keys that are useless once it is closed. Keys are
+    kept in least recently updated order: the ones not updated for `ttl`
+    seconds are dropped by `expire`, and the least recently updated ones are
+    dropped when there are more than `max_size`.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        # count id -> (last value, time of the last update)
+        self._values = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, count_id):
+        return count_id in self._values
+
+    def delta(self, count_id, current_value):
+        """Return the difference with the previous value of the counter, which starts at 0."""
+        previous, _ = self._values.pop(count_id, (0, None))
+        self._values[count_id] = (current_value, self.clock())
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+            self.evicted += 1
+        return current_value - previous
+
+    def expire(self):
+        """Drop the counters that were not updated for `ttl` seconds."""
+        deadline = self.clock() - self.ttl
+        while self._values:
+            count_id, (_, updated) = next(iter(self._values.items()))
+            if updated >= deadline:
+                break
+            del self._values[count_id]
+            self.expired += 1
+
+    def pop_stats(self):
+        """Return the number of counters expired and evicted since the previous call."""
+        stats = self.expired, self.evicted
+        self.expired = self.evicted = 0
+        return stats
@@ -2,12 +2,20 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
-from datadog_checks.base import AgentCheck
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from datadog_checks.base import AgentCheck, ConfigurationError
+
+from .counters import CounterStore
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'gnatsd'
 
 
 class GnatsdConfig:
+    DEFAULT_MAX_COUNTERS = 100000
+    DEFAULT_COUNTER_TTL = 600
+
     def __init__(self, instance):
         self.instance = instance
         self.host = instance.get('host', '')
@@ -15,6 +23,13 @@ class GnatsdConfig:
         self.url = f'{self.host}:{self.port}'
         self.server_name = instance.get('server_name', '')
         self.tags = instance.get('tags', [])
+        self.max_counters = instance.get('max_counters', self.DEFAULT_MAX_COUNTERS)
+        self.counter_ttl = instance.get('counter_ttl', self.DEFAULT_COUNTER_TTL)
+
+        if not isinstance(self.max_counters, int) or self.max_counters < 1:
+            raise ConfigurationError('max_counters must be a positive integer')
+        if not isinstance(self.counter_ttl, (int, float)) or self.counter_ttl <= 0:
+            raise ConfigurationError('counter_ttl must be a positive number')
 
 
 class GnatsdCheckInvocation:
@@ -75,13 +90,23 @@ class GnatsdCheckInvocation:
         # Confirm monitor endpoint is available
         self._status_check()
 
-        # Gather NATS metrics
+        # Gather NATS metrics, the endpoints are fetched at the same time but processed in order
+        executor = self.checker.get_executor()
+        responses = {endpoint: executor.submit(self._fetch_endpoint, endpoint) for endpoint in self.METRICS}
         for endpoint, metrics in self.METRICS.items():
-            self._check_endpoint(endpoint, metrics)
+            self._track_metrics(endpoint, metrics, responses[endpoint].result())
+
+        # Forget the counters of the closed connections and routes
+        counts = self.checker.counts
+        counts.expire()
+        expired, evicted = counts.pop_stats()
+        self.checker.gauge('gnatsd.counters.size', len(counts), tags=self.tags)
+        self.checker.count('gnatsd.counters.expired', expired, tags=self.tags)
+        self.checker.count('gnatsd.counters.evicted', evicted, tags=self.tags)
 
     def _status_check(self):
         try:
-            response = self.checker.http.get(self.config.url)
+            response = self.checker.http.get(self.config.url, persist=True)
 
             if response.status_code == 200:
                 self.checker.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=self.service_check_tags)
@@ -94,9 +119,8 @@ class GnatsdCheckInvocation:
             )
             raise e
 
-    def _check_endpoint(self, endpoint, metrics):
-        data = self.checker.http.get(f'{self.config.url}/{endpoint}').json()
-        self._track_metrics(endpoint, metrics, data)
+    def _fetch_endpoint(self, endpoint):
+        return self.checker.http.get(f'{self.config.url}/{endpoint}', persist=True).json()
 
     def _track_metrics(self, namespace, metrics, data, tags=None):
         if not tags:
@@ -138,17 +162,29 @@ class GnatsdCheckInvocation:
         return tags
 
     def _count_delta(self, count_id, current_value):
-        self.checker.counts.setdefault(count_id, 0)
-        delta = current_value - self.checker.counts[count_id]
-        self.checker.counts[count_id] = current_value
-
-        return delta
+        return self.checker.counts.delta(count_id, current_value)
 
 
 class GnatsdCheck(AgentCheck):
     def __init__(self, name, init_config, instances):
         super(GnatsdCheck, self).__init__(name, init_config, instances)
-        self.counts = {}
+        config = GnatsdConfig(self.instance)
+        self.counts = CounterStore(config.max_counters, config.counter_ttl)
+        # varz, connz and routez are fetched at the same time over the keep-alive connections of self.http
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def check(self, instance):
         GnatsdCheckInvocation(instance, self).check()
+
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(GnatsdCheckInvocation.METRICS))
+            return self._executor
+
+    def cancel(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -1,4 +1,8 @@
+import json
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
@@ -18,3 +22,130 @@ def dd_environment():
 @pytest.fixture
 def instance():
     return {'host': f'http://{HOST}', 'port': 8222}
+
+
+class FakeMonitor(object):
+    """
+    NATS monitoring endpoints for a server with the connections of `cids` and two routes.
+
+    Every request waits `latency` seconds. The connections opened by the
+    check and the highest number of requests handled at the same time are
+    counted.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.cids = [1, 2]
+        self.msgs = 10
+        self.connections = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        if path == '/':
+            return {}
+        if path == '/varz':
+            return {
+                'server_id': 'fake',
+                'connections': len(self.cids),
+                'subscriptions': len(self.cids),
+                'slow_consumers': 0,
+                'remotes': 2,
+                'routes': 2,
+                'in_msgs': self.msgs,
+                'out_msgs': self.msgs,
+                'in_bytes': self.msgs * 10,
+                'out_bytes': self.msgs * 10,
+                'mem': 1000,
+            }
+        if path == '/connz':
+            return {
+                'num_connections': len(self.cids),
+                'total': len(self.cids),
+                'connections': [
+                    {
+                        'cid': cid,
+                        'ip': '10.0.0.1',
+                        'name': f'client-{cid}',
+                        'lang': 'go',
+                        'version': '1.0',
+                        'pending_bytes': 0,
+                        'in_msgs': self.msgs,
+                        'out_msgs': self.msgs,
+                        'subscriptions': 1,
+                        'in_bytes': self.msgs * 10,
+                        'out_bytes': self.msgs * 10,
+                    }
+                    for cid in self.cids
+                ],
+            }
+        if path == '/routez':
+            return {
+                'num_routes': 2,
+                'routes': [
+                    {
+                        'rid': rid,
+                        'remote_id': f'remote-{rid}',
+                        'ip': f'10.0.1.{rid}',
+                        'pending_size': 0,
+                        'in_msgs': self.msgs,
+                        'out_msgs': self.msgs,
+                        'subscriptions': 1,
+                        'in_bytes': self.msgs * 10,
+                        'out_bytes': self.msgs * 10,
+                    }
+                    for rid in (1, 2)
+                ],
+            }
+        return None
+
+    def serve(self):
+        monitor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with monitor._lock:
+                    monitor.connections += 1
+                super(Handler, self).setup()
+
+            def do_GET(self):
+                with monitor._lock:
+                    monitor._in_flight += 1
+                    monitor.max_in_flight = max(monitor.max_in_flight, monitor._in_flight)
+                try:
+                    if monitor.latency:
+                        time.sleep(monitor.latency)
+                    document = monitor.get(self.path)
+                finally:
+                    with monitor._lock:
+                        monitor._in_flight -= 1
+                body = json.dumps(document).encode('utf-8')
+                self.send_response(200 if document is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('localhost', 0), Handler)
+        server.daemon_threads = True
+        return server
+
+
+@pytest.fixture
+def fake_monitor():
+    monitor = FakeMonitor()
+    server = monitor.serve()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monitor.instance = {'host': 'http://localhost', 'port': server.server_address[1], 'server_name': 'fake'}
+    try:
+        yield monitor
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -2,10 +2,15 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+import tracemalloc
+
 import pytest
 
+from datadog_checks.base import ConfigurationError
 from datadog_checks.dev.docker import get_container_ip
 from datadog_checks.gnatsd import GnatsdCheck
+from datadog_checks.gnatsd.counters import CounterStore
+from datadog_checks.gnatsd.gnatsd import GnatsdCheckInvocation, GnatsdConfig
 
 CHECK_NAME = 'gnatsd'
 
@@ -124,3 +129,141 @@ def test_deltas(aggregator, instance):
     aggregator.reset()
     c.check(instance)
     aggregator.assert_metric('gnatsd.connz.connections.foo-sub.out_msgs', metric_type=aggregator.COUNT, value=0)
+
+
+def test_fake_monitor(aggregator, fake_monitor):
+    instance = fake_monitor.instance
+    c = GnatsdCheck(CHECK_NAME, {}, [instance])
+    c.check(instance)
+
+    tags = ['server_name:fake']
+    aggregator.assert_service_check('gnatsd.can_connect', status=GnatsdCheck.OK, count=1)
+    aggregator.assert_metric('gnatsd.varz.in_msgs', value=10, tags=tags + ['gnatsd-server_id:fake'])
+    aggregator.assert_metric('gnatsd.connz.connections.client-1.in_msgs', value=10)
+    aggregator.assert_metric('gnatsd.routez.routes.10_0_1_2.out_msgs', value=10)
+    # 6 varz and connz counters, 4 counters for each of the 2 connections and 2 routes
+    aggregator.assert_metric('gnatsd.counters.size', value=22, tags=tags)
+
+    aggregator.reset()
+    fake_monitor.msgs = 15
+    c.check(instance)
+    c.cancel()
+    aggregator.assert_metric('gnatsd.varz.in_msgs', value=5)
+    aggregator.assert_metric('gnatsd.connz.connections.client-2.out_msgs', value=5)
+    aggregator.assert_metric('gnatsd.routez.routes.10_0_1_1.in_bytes', value=50)
+    # The keep-alive connection of the status check is reused by the endpoints
+    assert fake_monitor.connections <= len(GnatsdCheckInvocation.METRICS)
+
+
+def test_concurrent_endpoints(aggregator, fake_monitor):
+    fake_monitor.latency = 0.1
+    instance = fake_monitor.instance
+    c = GnatsdCheck(CHECK_NAME, {}, [instance])
+    c.check(instance)
+    c.cancel()
+
+    assert fake_monitor.max_in_flight == len(GnatsdCheckInvocation.METRICS)
+    aggregator.assert_metric('gnatsd.routez.num_routes', value=2)
+
+
+def test_closed_connections_expire(aggregator, fake_monitor):
+    instance = dict(fake_monitor.instance, counter_ttl=60)
+    c = GnatsdCheck(CHECK_NAME, {}, [instance])
+    now = [0]
+    c.counts.clock = lambda: now[0]
+    c.check(instance)
+
+    fake_monitor.cids = [2, 3]
+    for _ in range(5):
+        aggregator.reset()
+        now[0] += 15
+        c.check(instance)
+    c.cancel()
+
+    assert 'connz.connections.client-1.in_msgs.1' not in c.counts
+    assert 'connz.connections.client-3.in_msgs.3' in c.counts
+    aggregator.assert_metric('gnatsd.counters.size', value=22)
+    aggregator.assert_metric('gnatsd.counters.expired', value=4)
+    aggregator.assert_metric('gnatsd.counters.evicted', value=0)
+
+
+def test_max_counters(aggregator, fake_monitor):
+    instance = dict(fake_monitor.instance, max_counters=20)
+    c = GnatsdCheck(CHECK_NAME, {}, [instance])
+    c.check(instance)
+    c.cancel()
+
+    aggregator.assert_metric('gnatsd.counters.size', value=20)
+    aggregator.assert_metric('gnatsd.counters.evicted', value=2)
+
+
+@pytest.mark.parametrize('option, value', [('max_counters', 0), ('max_counters', 'many'), ('counter_ttl', -1)])
+def test_invalid_counter_options(option, value):
+    instance = {'host': 'http://localhost', 'port': 8222, option: value}
+    with pytest.raises(ConfigurationError):
+        GnatsdCheck(CHECK_NAME, {}, [instance])
+
+
+def test_counter_store():
+    now = [0]
+    counts = CounterStore(3, 10, clock=lambda: now[0])
+    assert counts.delta('a', 5) == 5
+    assert counts.delta('a', 8) == 3
+    counts.delta('b', 1)
+    now[0] = 5
+    counts.delta('c', 1)
+    # Updating a counter makes it the most recently used one
+    counts.delta('a', 8)
+    counts.delta('d', 1)
+    assert 'b' not in counts
+    assert counts.pop_stats() == (0, 1)
+
+    now[0] = 14
+    counts.expire()
+    assert 'c' in counts and 'a' in counts and 'd' in counts
+    now[0] = 15.5
+    counts.expire()
+    assert len(counts) == 0
+    assert counts.pop_stats() == (3, 0)
+    assert counts.pop_stats() == (0, 0)
+
+
+def test_connection_churn_memory():
+    # 100k connections, opened 100 per 10s run, each one seen on 2 consecutive runs
+    connections = 100000
+    per_run = 100
+
+    def churn(delta, expire=None):
+        for run in range(connections // per_run + 1):
+            for cid in range(max(run - 1, 0) * per_run, min(run + 1, connections // per_run) * per_run):
+                delta(f'connz.connections.client-{cid}.in_msgs.{cid}', run)
+            if expire is not None:
+                expire()
+            now[0] += 10
+
+    def traced(run):
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    now = [0]
+    counts = CounterStore(GnatsdConfig.DEFAULT_MAX_COUNTERS, GnatsdConfig.DEFAULT_COUNTER_TTL, clock=lambda: now[0])
+    bounded_current, bounded_peak = traced(lambda: churn(counts.delta, counts.expire))
+
+    # What the check kept before, a dict that is never pruned
+    unbounded = {}
+
+    def delta(count_id, value):
+        previous = unbounded.get(count_id, 0)
+        unbounded[count_id] = value
+        return value - previous
+
+    unbounded_current, _ = traced(lambda: churn(delta))
+
+    # The ttl of 600s keeps the counters of the last 60 runs
+    assert len(counts) <= 61 * per_run
+    assert len(unbounded) == connections
+    assert bounded_peak < unbounded_current / 5
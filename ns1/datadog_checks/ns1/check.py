@@ -1,5 +1,9 @@
+import hashlib
 import json
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
 from requests import codes
 from requests.exceptions import ConnectionError, HTTPError, InvalidURL, Timeout
@@ -7,13 +11,49 @@ from requests.exceptions import ConnectionError, HTTPError, InvalidURL, Timeout
 from datadog_checks.base import AgentCheck, ConfigurationError
 
 from .ns1_url_utils import Ns1Url
+from .rate_limiter import RATELIMIT_LIMIT_HEADER, RATELIMIT_PERIOD_HEADER, TokenBucket
+
+# Requests are issued by priority, account wide metrics first. When the
+# rate limit budget is short, per record counts are spread across runs.
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+CRITICAL_METRICS = {
+    "qps",
+    "usage",
+    "billing",
+    "leases",
+    "peak_lps",
+    "pulsar.decisions",
+    "pulsar.decisions.insufficient",
+    "pulsar.routemap.hit",
+    "pulsar.routemap.miss",
+}
+
+
+def latest_point(graph):
+    # graphs are lists of [timestamp, value], return the newest one or None
+    # when empty. Ties keep the first point like a stable descending sort.
+    return max(graph, key=itemgetter(0), default=None)
+
+
+def get_priority(metric_name, metric_type):
+    if metric_name in CRITICAL_METRICS:
+        return PRIORITY_CRITICAL
+    if metric_name.endswith(".record") and metric_type == "count":
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
 
 
 class Ns1Check(AgentCheck):
     NS1_CACHE_KEY = "ns1.cache.key"
+    NS1_URL_PLAN_CACHE_KEY = "ns1.url_plan"
     NS1_SERVICE_CHECK = "ns1.can_connect"
     LOG_MSG_PREFIX = "NS1 API"
     MAX_RETRIES_ATTEMPTS_DEFAULT = 5
+    MAX_WORKERS_DEFAULT = 4
+    DISCOVERY_TTL_DEFAULT = 3600
 
     def __init__(self, name, init_config, instances):
         super(Ns1Check, self).__init__(name, init_config, instances)
@@ -32,7 +72,14 @@ class Ns1Check(AgentCheck):
         if not self.max_retry_attempts:
             self.max_retry_attempts = self.MAX_RETRIES_ATTEMPTS_DEFAULT
 
+        self.max_workers = self.instance.get("max_workers", self.MAX_WORKERS_DEFAULT)
+        if not isinstance(self.max_workers, int) or self.max_workers < 1:
+            raise ConfigurationError('max_workers must be a positive integer')
+
         self.headers = {"X-NSONE-Key": self.api_key}
+        self.rate_limiter = TokenBucket()
+        # position of the next per record request to issue when they don't all fit in the budget
+        self.low_priority_offset = 0
 
         self.metrics = self.instance.get("metrics")
         if not self.metrics or len(self.metrics) == 0:
@@ -42,9 +89,15 @@ class Ns1Check(AgentCheck):
         if self.networks and len(self.networks) == 0:
             raise ConfigurationError('Invalid networks config!')
 
+        self.discovery_ttl = self.instance.get("discovery_ttl", self.DISCOVERY_TTL_DEFAULT)
+        if not isinstance(self.discovery_ttl, (int, float)) or self.discovery_ttl < 0:
+            raise ConfigurationError('discovery_ttl must be a non-negative number of seconds')
+
         self.query_params = self.instance.get("query_params")
         self.ns1 = Ns1Url(self.api_endpoint, self)
         self.pulsar_apps = {}
+        self.url_plan = None
+        self.config_hash = self.get_config_hash()
 
     def check(self, instance):
         self.log.info('Startup')
@@ -52,38 +105,124 @@ class Ns1Check(AgentCheck):
         # get counters from previous run
         self.get_usage_count()
 
-        # create URLs to query API for all configured metrics
-        checkUrl = self.create_url(self.metrics, self.query_params, self.networks)
-
-        for k, v in checkUrl.items():
-            try:
-                url, name, tags, metric_type = v
-                # Query API to get metrics
-                res = self.get_stats(url)
-                msg = '{prefix} Query URL: {url}'.format(prefix=self.LOG_MSG_PREFIX, url=url)
-                self.log.info(msg)
-                msg = '{prefix} result: {result}'.format(prefix=self.LOG_MSG_PREFIX, result=json.dumps(res))
-                self.log.info(msg)
-                if res:
-                    # extract metric from API result.
-                    val, status = self.extract_metric(k, res)
-                    # send metric to datadog if extraction was successful
-                    if status:
-                        self.send_metrics(name, val, tags, metric_type)
-            except Exception:
-                raise
+        # get URLs to query API for all configured metrics
+        checkUrl = self.get_url_plan()
+
+        for k, v, res in self.fetch_all(self.schedule(checkUrl)):
+            url, name, tags, metric_type = v
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug('%s Query URL: %s', self.LOG_MSG_PREFIX, url)
+                self.log.debug('%s result: %s', self.LOG_MSG_PREFIX, json.dumps(res))
+            if res:
+                # extract metric from API result.
+                val, status = self.extract_metric(k, res)
+                # send metric to datadog if extraction was successful
+                if status:
+                    self.send_metrics(name, val, tags, metric_type)
         # save counters for next run
         self.set_usage_count()
         msg = f'NS1 metrics check run for NS1 API endpoint {self.api_endpoint} was successful'
-        self.service_check(self.NS1_SERVICE_CHECK, AgentCheck.OK, message=msg)
+        self.log.info(msg)
+        # service checks only carry a message when they are not OK
+        self.service_check(self.NS1_SERVICE_CHECK, AgentCheck.OK)
+
+    def get_config_hash(self):
+        # the URL plan only depends on these options, a change invalidates the cached plan
+        config = {
+            "api_endpoint": self.api_endpoint,
+            "api_key": self.api_key,
+            "metrics": self.metrics,
+            "networks": self.networks,
+            "query_params": self.query_params,
+        }
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get_url_plan(self):
+        # Discovering zone records, networks, scope groups and pulsar apps takes
+        # many API calls, the resulting URLs are kept in the persistent cache
+        # and rebuilt once discovery_ttl expired or the configuration changed.
+        now = time.time()
+        plan = self.url_plan if self.url_plan is not None else self.read_url_plan()
+        if plan is None or plan["config_hash"] != self.config_hash or now >= plan["expires"]:
+            self.log.debug("%s building URL plan", self.LOG_MSG_PREFIX)
+            checkUrl = self.create_url(self.metrics, self.query_params, self.networks)
+            plan = {
+                "config_hash": self.config_hash,
+                "expires": now + self.discovery_ttl,
+                "urls": checkUrl,
+                "pulsar_apps": self.pulsar_apps,
+            }
+            self.write_persistent_cache(self.NS1_URL_PLAN_CACHE_KEY, json.dumps(plan))
+        else:
+            self.pulsar_apps = plan["pulsar_apps"]
+        self.url_plan = plan
+        return plan["urls"]
+
+    def read_url_plan(self):
+        cachedata = self.read_persistent_cache(self.NS1_URL_PLAN_CACHE_KEY)
+        if not cachedata:
+            return None
+        try:
+            plan = json.loads(cachedata)
+        except ValueError:
+            return None
+        if not isinstance(plan, dict) or not {"config_hash", "expires", "urls", "pulsar_apps"} <= set(plan):
+            return None
+        return plan
+
+    def schedule(self, checkUrl):
+        # order the URLs by priority, per record counts that don't fit
+        # in the remaining budget are deferred to the next runs
+        urls = sorted(checkUrl.items(), key=lambda item: get_priority(item[1][1], item[1][3]))
+        low = [item for item in urls if get_priority(item[1][1], item[1][3]) == PRIORITY_LOW]
+        budget = self.rate_limiter.available()
+        if budget is None or budget >= len(urls) or not low:
+            return urls
+
+        scheduled = urls[: len(urls) - len(low)]
+        spare = min(max(budget - len(scheduled), 0), len(low))
+        start = self.low_priority_offset % len(low)
+        scheduled.extend((low + low)[start : start + spare])
+        self.low_priority_offset = (start + spare) % len(low)
+        self.log.debug(
+            "%s rate limit budget is %d requests, deferring %d of %d per record requests",
+            self.LOG_MSG_PREFIX,
+            budget,
+            len(low) - spare,
+            len(low),
+        )
+        return scheduled
+
+    def fetch_all(self, urls):
+        # query the API concurrently, results are yielded in order so
+        # metrics are still extracted and submitted from the check thread
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(k, v, executor.submit(self._request, v[0])) for k, v in urls]
+            for k, v, future in futures:
+                try:
+                    res = future.result()
+                except Exception as e:
+                    for _, _, pending in futures:
+                        pending.cancel()
+                    self._report_request_error(v[0], e)
+                    raise
+                yield k, v, res
+
+    @property
+    def pulsar_apps(self):
+        return self._pulsar_apps
+
+    @pulsar_apps.setter
+    def pulsar_apps(self, pulsar_apps):
+        # index job id -> job name once per discovery, the first app listing a job wins
+        self._pulsar_apps = pulsar_apps
+        self.pulsar_job_names = {}
+        for _, v in pulsar_apps.items():
+            for job in v[1]:
+                self.pulsar_job_names.setdefault(job["jobid"], job["name"])
 
     def get_pulsar_job_name_from_id(self, pulsar_job_id):
-        for _, v in self.pulsar_apps.items():
-            for job in v[1]:
-                jobid = job["jobid"]
-                if jobid == pulsar_job_id:
-                    return job["name"]
-        return ""
+        return self.pulsar_job_names.get(pulsar_job_id, "")
 
     def create_url(self, metrics, query_params, networks):
         # create dictionary with metrics name and url to check for all configured metrics in conf.yaml file
@@ -121,10 +260,9 @@ class Ns1Check(AgentCheck):
     def get_networks(self, networks):
         url = "{apiendpoint}/v1/networks".format(apiendpoint=self.api_endpoint)
         res = self.get_stats(url)
-        msg = 'Get networks API Query URL: {url}'.format(url=url)
-        self.log.info(msg)
-        msg = 'Get Networks API result: {result}'.format(result=json.dumps(res))
-        self.log.info(msg)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('Get networks API Query URL: %s', url)
+            self.log.debug('Get Networks API result: %s', json.dumps(res))
 
         nets = {}
         for net in res:
@@ -211,13 +349,12 @@ class Ns1Check(AgentCheck):
 
             for element in graphs:
                 graph = element["graph"]
-                # sort graph array
                 # find last timestamp that is >= last time stamp saved in file
-                res = sorted(graph, key=lambda x: x[0], reverse=True)
-                if res and len(res) > 0:
+                point = latest_point(graph)
+                if point is not None:
 
-                    curr_timestamp = res[0][0]
-                    curr_count = res[0][1]
+                    curr_timestamp = point[0]
+                    curr_count = point[1]
 
                     jobtags = element["tags"]
                     jobid = jobtags["jobid"]
@@ -258,18 +395,17 @@ class Ns1Check(AgentCheck):
             index = 0
             for element in graphs:
                 graph = element["graph"]
-                # sort graph array
                 # find last timestamp that is >= last time stamp saved in file
-                res = sorted(graph, key=lambda x: x[0], reverse=True)
-                if res and len(res) > 0:
+                point = latest_point(graph)
+                if point is not None:
                     if index == 0:
-                        curr_timestamp = res[0][0]
+                        curr_timestamp = point[0]
                         index = -1
-                    if curr_timestamp != res[0][0] and curr_timestamp < res[0][0]:
-                        curr_timestamp = res[0][0]
-                        curr_count = res[0][1]
+                    if curr_timestamp != point[0] and curr_timestamp < point[0]:
+                        curr_timestamp = point[0]
+                        curr_count = point[1]
                     else:
-                        curr_count = curr_count + res[0][1]
+                        curr_count = curr_count + point[1]
 
             # find this metric in usage count
             if key in self.usage_count:
@@ -304,8 +440,7 @@ class Ns1Check(AgentCheck):
 
             graph = jsonResult["graph"]
             data = graph[geo][asn]
-            res = sorted(data, key=lambda x: x[0], reverse=True)
-            response_time = res[0][1]
+            response_time = latest_point(data)[1]
             return response_time, True
         except Exception:
             return None, False
@@ -315,16 +450,15 @@ class Ns1Check(AgentCheck):
             graphs = jsonResult["graphs"]
             for element in graphs:
                 graph = element["graph"]
-                res = sorted(graph, key=lambda x: x[0], reverse=True)
-                return (res[0][1], True) if res and len(res) > 0 else (None, False)
+                point = latest_point(graph)
+                return (point[1], True) if point is not None else (None, False)
         except Exception:
             return None, False
 
     def extract_peak_lps(self, jsonResult):
         try:
             graph = jsonResult[0]["graph"]
-            res = sorted(graph, key=lambda x: x[0], reverse=True)
-            curr_lps = res[0][1]
+            curr_lps = latest_point(graph)[1]
             return curr_lps, True
 
         except Exception:
@@ -337,11 +471,11 @@ class Ns1Check(AgentCheck):
             # usage api will return array of dictionaries, we want to get 'graph' object
             # which in turn is list of lists, each element being [timestamp, query_count]
             # so, get last query count from result.
-            # Sort by timestamp descending order to make sure we get latest
-            res = sorted(graph, key=lambda x: x[0], reverse=True)
+            # Pick the highest timestamp to make sure we get latest
+            point = latest_point(graph)
 
-            curr_timestamp = res[0][0]
-            curr_count = res[0][1]
+            curr_timestamp = point[0]
+            curr_count = point[1]
             # find this metric in usage count
             if key in self.usage_count:
                 prev_timestamp = self.usage_count[key][0]
@@ -381,86 +515,65 @@ class Ns1Check(AgentCheck):
             return None, False
 
     def get_stats(self, url):
+        try:
+            return self._request(url)
+        except Exception as e:
+            self._report_request_error(url, e)
+            raise
+
+    def _request(self, url):
         # Perform HTTP Requests with our HTTP wrapper.
         # More info at https://datadoghq.dev/integrations-core/base/http/
+        # Every request takes a token from the rate limit bucket, a 429
+        # drains it so the retry waits for the NS1 bucket to refill.
 
         retry = 0
         while True:
-            try:
-                response = self.http.get(url, extra_headers=self.headers, timeout=60)
-                response.raise_for_status()
-                return response.json()
-            except Timeout as e:
-                self.service_check(
-                    self.NS1_SERVICE_CHECK,
-                    AgentCheck.CRITICAL,
-                    message=f"Request timeout: {url}, {e}",
-                )
-                raise
-
-            except HTTPError as e:
-                if response.status_code == codes.too_many_requests:
-                    if retry >= self.max_retry_attempts:
-                        # max retries attempt reached, giving up.
-                        self.service_check(
-                            self.NS1_SERVICE_CHECK,
-                            AgentCheck.CRITICAL,
-                            message=f"Max retries reached: {self.max_retry_attempts}, giving up!",
-                        )
-                        raise
-
-                    else:
-                        # read rate limit headers and caculate the sleep time
-                        ratelimit_period = response.headers['X-RateLimit-Period']
-                        if ratelimit_period is None or ratelimit_period == 0:
-                            ratelimit_period = 300
-
-                        ratelimit_limit = response.headers['X-RateLimit-Limit']
-                        if ratelimit_limit is None or ratelimit_limit == 0:
-                            ratelimit_limit = 100
-
-                        next_request_available_in_seconds = int(ratelimit_period) / int(ratelimit_limit)
-                        msg = f"Rate limit reached, X-RateLimit-Period: {ratelimit_period}, X-RateLimit-Limit: {ratelimit_limit}, sleeping: {next_request_available_in_seconds}"
-                        self.log.warning(msg)
-
-                        retry += 1
-                        time.sleep(next_request_available_in_seconds)
-                        continue
-
-                # Not 429 - notify the error and raise the expection
-                self.service_check(
-                    self.NS1_SERVICE_CHECK,
-                    AgentCheck.CRITICAL,
-                    message=f"Request failed: {url}, {e}",
+            self.rate_limiter.acquire()
+            response = self.http.get(url, extra_headers=self.headers, timeout=60, persist=True)
+            self.rate_limiter.update(response.headers)
+            if response.status_code == codes.too_many_requests:
+                # The headers may be missing or report tokens the server refused, wait for a refill anyway
+                self.rate_limiter.drain()
+            if response.status_code == codes.too_many_requests and retry < self.max_retry_attempts:
+                self.log.warning(
+                    "Rate limit reached, X-RateLimit-Period: %s, X-RateLimit-Limit: %s, retry %d of %d",
+                    response.headers.get(RATELIMIT_PERIOD_HEADER),
+                    response.headers.get(RATELIMIT_LIMIT_HEADER),
+                    retry + 1,
+                    self.max_retry_attempts,
                 )
-                raise
-
-            except (InvalidURL, ConnectionError) as e:
-                self.service_check(
-                    self.NS1_SERVICE_CHECK,
-                    AgentCheck.CRITICAL,
-                    message=f"Request failed: {url}, {e}",
-                )
-                raise
-
-            except ValueError as e:
-                self.service_check(self.NS1_SERVICE_CHECK, AgentCheck.CRITICAL, message=str(e))
-                raise
-
-            except Exception:
-                self.service_check(
-                    self.NS1_SERVICE_CHECK, AgentCheck.CRITICAL, message="Error getting stats from NS1 DNS"
-                )
-                raise
+                retry += 1
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _report_request_error(self, url, e):
+        if isinstance(e, Timeout):
+            message = f"Request timeout: {url}, {e}"
+        elif isinstance(e, HTTPError) and e.response is not None and e.response.status_code == codes.too_many_requests:
+            # max retries attempt reached, giving up.
+            message = f"Max retries reached: {self.max_retry_attempts}, giving up!"
+        elif isinstance(e, (HTTPError, InvalidURL, ConnectionError)):
+            message = f"Request failed: {url}, {e}"
+        elif isinstance(e, ValueError):
+            message = str(e)
+        else:
+            message = "Error getting stats from NS1 DNS"
+        self.service_check(self.NS1_SERVICE_CHECK, AgentCheck.CRITICAL, message=message)
 
     def remove_prefix(self, text, prefix):
         return text[len(prefix) :] if text.startswith(prefix) else text
 
     def send_metrics(self, metric_name, metric_value, tags, metric_type):
-        msg = '{prefix} Metric: {name}, Value: {value}, Tag: {tag}, Type: {type}'.format(
-            prefix=self.LOG_MSG_PREFIX, name=metric_name, value=metric_value, tag=tags, type=metric_type
+        self.log.debug(
+            '%s Metric: %s, Value: %s, Tag: %s, Type: %s',
+            self.LOG_MSG_PREFIX,
+            metric_name,
+            metric_value,
+            tags,
+            metric_type,
         )
-        self.log.info(msg)
         if metric_name == "billing":
             for k, v in metric_value.items():
                 # {"usage": 1234, "limit": 500000}
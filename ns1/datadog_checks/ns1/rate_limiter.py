@@ -0,0 +1,109 @@
+import threading
+import time
+
+# NS1 rate limits every API key with a leaky bucket, every response
+# reports its state in the X-RateLimit-Limit, X-RateLimit-Remaining
+# and X-RateLimit-Period headers.
+RATELIMIT_LIMIT_HEADER = "X-RateLimit-Limit"
+RATELIMIT_REMAINING_HEADER = "X-RateLimit-Remaining"
+RATELIMIT_PERIOD_HEADER = "X-RateLimit-Period"
+
+DEFAULT_RATELIMIT_LIMIT = 100
+DEFAULT_RATELIMIT_PERIOD = 300
+
+
+def _header_int(headers, name):
+    try:
+        value = int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class TokenBucket(object):
+    """
+    Client side copy of the NS1 rate limit bucket.
+
+    The bucket holds `limit` tokens and refills `limit` tokens per
+    `period` seconds. Until a response taught it the actual budget
+    the bucket doesn't limit anything. `time_func` and `sleep_func`
+    can be replaced to test without waiting.
+    """
+
+    def __init__(self, time_func=time.monotonic, sleep_func=time.sleep):
+        self._time = time_func
+        self._sleep = sleep_func
+        self._lock = threading.Lock()
+
+        self.limit = None
+        self.period = None
+        self._tokens = 0.0
+        self._updated = 0.0
+
+    @property
+    def known(self):
+        return self.limit is not None
+
+    @property
+    def rate(self):
+        return float(self.limit) / self.period
+
+    def _refill(self, now):
+        self._tokens = min(float(self.limit), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        """Return the number of requests that can be issued right now, None while the budget is unknown."""
+        with self._lock:
+            if not self.known:
+                return None
+            self._refill(self._time())
+            return int(self._tokens)
+
+    def acquire(self):
+        """Take a token, waiting for the bucket to refill when it is empty."""
+        while True:
+            with self._lock:
+                if not self.known:
+                    return
+                now = self._time()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def drain(self):
+        """
+        Empty the bucket after a rate limited response, so the next request waits for a token
+        to refill. The default budget is assumed when no response reported the actual one.
+        """
+        with self._lock:
+            now = self._time()
+            if not self.known:
+                self.limit = DEFAULT_RATELIMIT_LIMIT
+                self.period = DEFAULT_RATELIMIT_PERIOD
+            self._tokens = 0.0
+            self._updated = now
+
+    def update(self, headers):
+        """Learn the budget from the rate limit headers of a response."""
+        limit = _header_int(headers, RATELIMIT_LIMIT_HEADER)
+        remaining = _header_int(headers, RATELIMIT_REMAINING_HEADER)
+        period = _header_int(headers, RATELIMIT_PERIOD_HEADER)
+        if remaining is None:
+            return
+
+        with self._lock:
+            now = self._time()
+            if self.known:
+                self._refill(now)
+            else:
+                self._tokens = float(remaining)
+                self._updated = now
+            self.limit = limit or self.limit or DEFAULT_RATELIMIT_LIMIT
+            self.period = period or self.period or DEFAULT_RATELIMIT_PERIOD
+            # Requests still in flight were already taken from the local
+            # bucket but not from the reported one, keep the lowest.
+            self._tokens = min(self._tokens, float(remaining), float(self.limit))
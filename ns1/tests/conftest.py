@@ -1,4 +1,7 @@
 import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
@@ -190,3 +193,99 @@ def instance_1():
 @pytest.fixture
 def instance_ddi():
     return json.loads(CONFIG_DDI)
+
+
+def make_instance(url, zones=1, records=1, **options):
+    """Build an instance querying qps and usage for `zones` zones of `records` records each."""
+    zone_list = [
+        {"zone{}.com".format(z): [{"www{}.zone{}.com".format(r, z): "A"} for r in range(records)]} for z in range(zones)
+    ]
+    instance = {
+        "api_endpoint": url,
+        "api_key": "testkey",
+        "metrics": {"qps": zone_list, "usage": zone_list, "account": [{"billing": None}]},
+    }
+    instance.update(options)
+    return instance
+
+
+def stats_response(path):
+    if path.startswith("/v1/stats/qps"):
+        return {"qps": 12.5}
+    if path.startswith("/v1/stats/usage"):
+        return [{"graph": [[1600000000, 100], [1600003600, 200]]}]
+    if path == "/v1/account/billataglance":
+        return {"totals": {"queries": 1000}, "any": {"query_credit": 500000}}
+    return None
+
+
+@pytest.fixture
+def ns1_api_server():
+    """
+    Start a local fake NS1 API rate limited like the real one, yields a factory
+    taking the bucket limit and period and a per-request latency.
+    """
+    servers = []
+
+    def start(limit=100, period=1, latency=0.0):
+        lock = threading.Lock()
+        bucket = {"tokens": float(limit), "updated": time.monotonic()}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                with lock:
+                    now = time.monotonic()
+                    bucket["tokens"] = min(limit, bucket["tokens"] + (now - bucket["updated"]) * limit / period)
+                    bucket["updated"] = now
+                    allowed = bucket["tokens"] >= 1
+                    if allowed:
+                        bucket["tokens"] -= 1
+                        server.paths.append(path)
+                    else:
+                        server.throttled += 1
+                    remaining = int(bucket["tokens"])
+
+                if not allowed:
+                    self._send(429, {"message": "rate limit exceeded"}, remaining)
+                    return
+                if latency:
+                    time.sleep(latency)
+                body = stats_response(path)
+                if body is None:
+                    self._send(404, {"message": "not found"}, remaining)
+                    return
+                self._send(200, body, remaining)
+
+            def _send(self, status, body, remaining):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-RateLimit-By', 'customer')
+                self.send_header('X-RateLimit-Limit', str(limit))
+                self.send_header('X-RateLimit-Remaining', str(remaining))
+                self.send_header('X-RateLimit-Period', str(period))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        server.paths = []
+        server.throttled = 0
+        server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from datadog_checks.ns1 import Ns1Check
+from datadog_checks.ns1.check import latest_point
+
+from .conftest import make_instance
+
+LATENCY = 0.02
+
+
+@pytest.mark.parametrize('max_workers', [1, 8], ids=['sequential', 'concurrent'])
+@pytest.mark.parametrize('limit', [50, 1000], ids=['short_budget', 'large_budget'])
+def test_run(benchmark, datadog_agent, ns1_api_server, max_workers, limit):
+    server = ns1_api_server(limit=limit, period=1, latency=LATENCY)
+    instance = make_instance(server.url, zones=3, records=10, max_workers=max_workers)
+    check = Ns1Check('ns1', {}, [instance])
+
+    benchmark.pedantic(check.check, args=(instance,), rounds=3, warmup_rounds=1)
+    benchmark.extra_info['requests'] = len(server.paths)
+    benchmark.extra_info['throttled'] = server.throttled
+
+
+GRAPH_POINTS = 100000
+PULSAR_JOBS = 50
+
+
+def make_graph(points, seed=0):
+    rng = random.Random(seed)
+    graph = [[1600000000 + 60 * i, i] for i in range(points)]
+    rng.shuffle(graph)
+    return graph
+
+
+@pytest.mark.parametrize('method', ['sorted', 'linear'])
+def test_latest_point(benchmark, method):
+    graph = make_graph(GRAPH_POINTS)
+    if method == 'sorted':
+        result = benchmark(lambda: sorted(graph, key=lambda x: x[0], reverse=True)[0])
+    else:
+        result = benchmark(latest_point, graph)
+    assert result == [1600000000 + 60 * (GRAPH_POINTS - 1), GRAPH_POINTS - 1]
+
+
+def test_extract_usage_count(benchmark, datadog_agent, instance):
+    check = Ns1Check('ns1', {}, [instance])
+    result = [{"graph": make_graph(GRAPH_POINTS)}]
+
+    value, status = benchmark(check.extract_metric, "usage.zone0.com", result)
+    assert status
+
+
+def test_extract_pulsar_decisions(benchmark, datadog_agent, instance):
+    check = Ns1Check('ns1', {}, [instance])
+    result = {
+        "graphs": [
+            {"graph": make_graph(GRAPH_POINTS // PULSAR_JOBS, seed=job), "tags": {"jobid": "job{}".format(job)}}
+            for job in range(PULSAR_JOBS)
+        ]
+    }
+    check.pulsar_apps = {
+        "app": ["app", [{"jobid": "job{}".format(job), "name": "Job {}".format(job)} for job in range(PULSAR_JOBS)]]
+    }
+
+    def process():
+        value, status = check.extract_metric("pulsar.decisions", result)
+        check.send_metrics("pulsar.decisions", value, [""], "count")
+
+    benchmark(process)
@@ -1,11 +1,16 @@
 import json
 import logging
+from unittest import mock
 
 import pytest
 from requests.exceptions import HTTPError
 
-from datadog_checks.base import ConfigurationError
+from datadog_checks.base import AgentCheck, ConfigurationError
 from datadog_checks.ns1 import Ns1Check
+from datadog_checks.ns1.check import latest_point
+from datadog_checks.ns1.rate_limiter import TokenBucket
+
+from .conftest import make_instance
 
 
 def test_empty_instance(aggregator, instance_empty):
@@ -97,6 +102,22 @@ def test_set_max_retries(aggregator, instance_ddi, requests_mock, caplog):
             assert 'Rate limit reached' in log_list[i]
 
 
+def test_429_without_ratelimit_headers_backs_off(aggregator, instance_ddi, requests_mock):
+    instance_ddi["max_retry_attempts"] = 2
+    check = Ns1Check('ns1', {}, [instance_ddi])
+    sleeps = []
+    check.rate_limiter = TokenBucket(time_func=lambda: sum(sleeps), sleep_func=sleeps.append)
+
+    url = "{apiendpoint}/v1/zones/dloc1.com".format(apiendpoint=check.api_endpoint)
+    requests_mock.register_uri('GET', url, status_code=429, reason="Too many requests")
+    with pytest.raises(HTTPError):
+        check.get_stats(url)
+
+    # every retry waits for a token of the default budget
+    assert requests_mock.call_count == 3
+    assert sleeps == [3.0, 3.0]
+
+
 def test_url_gen_ddi(aggregator, instance_ddi, requests_mock):
     check = Ns1Check('ns1', {}, [instance_ddi])
     aggregator.assert_all_metrics_covered()
@@ -852,7 +873,7 @@ def test_extractPulsarAvailabilityPercent(aggregator, instance_1):
     assert status
 
 
-def test_read_prev_usage_count(aggregator, instance_1):
+def test_read_prev_usage_count(aggregator, datadog_agent, instance_1):
     check = Ns1Check('ns1', {}, [instance_1])
     check.usage_count_path = "./log"
     check.usage_count_fname = 'ns1_usage_count.txt'
@@ -864,3 +885,155 @@ def test_remove_prefix(aggregator, instance_1):
     check = Ns1Check('ns1', {}, [instance_1])
     assert check.remove_prefix("prefix_text", "prefix_") == "text"
     assert check.remove_prefix("text", "noprefix_") == "text"
+
+
+@pytest.mark.parametrize('max_workers', [0, -1, "4"])
+def test_invalid_max_workers(aggregator, instance, max_workers):
+    with pytest.raises(ConfigurationError):
+        Ns1Check('ns1', {}, [dict(instance, max_workers=max_workers)])
+
+
+def test_check_concurrent_requests(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server(limit=1000)
+    instance = make_instance(server.url, zones=2, records=3, max_workers=8)
+    check = Ns1Check('ns1', {}, [instance])
+    check.check(instance)
+
+    # account, zone and record urls for both qps and usage, plus billing
+    assert len(server.paths) == 2 * (1 + 2 + 2 * 3) + 1
+    assert server.throttled == 0
+    aggregator.assert_metric('ns1.qps', value=12.5, count=1)
+    aggregator.assert_metric('ns1.qps.record', value=12.5, count=6)
+    assert len(aggregator.metrics('ns1.usage.record')) == 6
+    aggregator.assert_metric('ns1.billing', value=500000, tags=['billing:limit'])
+    aggregator.assert_service_check(check.NS1_SERVICE_CHECK, AgentCheck.OK)
+
+
+def test_check_waits_for_rate_limit(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server(limit=10, period=1)
+    instance = make_instance(server.url, zones=1, records=5, max_workers=8)
+    check = Ns1Check('ns1', {}, [instance])
+    check.check(instance)
+
+    assert len(set(server.paths)) == 2 * (1 + 1 + 5) + 1
+    assert check.rate_limiter.limit == 10
+    assert len(aggregator.metrics('ns1.usage.record')) == 5
+    aggregator.assert_service_check(check.NS1_SERVICE_CHECK, AgentCheck.OK)
+
+
+def test_check_request_error(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server()
+    instance = make_instance(server.url)
+    instance["metrics"]["ddi"] = None
+    check = Ns1Check('ns1', {}, [instance])
+    with pytest.raises(HTTPError):
+        check.check(instance)
+
+    aggregator.assert_service_check(check.NS1_SERVICE_CHECK, AgentCheck.CRITICAL)
+
+
+def test_schedule_priorities(aggregator):
+    instance = make_instance("https://my.nsone.net", zones=1, records=2)
+    check = Ns1Check('ns1', {}, [instance])
+    checkUrl = check.create_url(check.metrics, check.query_params, check.networks)
+
+    # budget is unknown until the first response
+    scheduled = [name for _, (_, name, _, _) in check.schedule(checkUrl)]
+    assert len(scheduled) == len(checkUrl)
+    assert scheduled[:3] == ["qps", "usage", "billing"]
+    assert scheduled[-2:] == ["usage.record", "usage.record"]
+
+
+def test_schedule_spreads_low_priority_requests(aggregator):
+    instance = make_instance("https://my.nsone.net", zones=1, records=3)
+    check = Ns1Check('ns1', {}, [instance])
+    checkUrl = check.create_url(check.metrics, check.query_params, check.networks)
+    low = [k for k, v in checkUrl.items() if v[1] == "usage.record"]
+    others = len(checkUrl) - len(low)
+
+    # enough budget for the other urls and one per record usage query per run
+    check.rate_limiter.update(
+        {'X-RateLimit-Limit': '1000', 'X-RateLimit-Remaining': str(others + 1), 'X-RateLimit-Period': '1000000'}
+    )
+    runs = [[k for k, _ in check.schedule(checkUrl)] for _ in range(len(low))]
+    for keys in runs:
+        assert len(keys) == others + 1
+    assert [keys[-1] for keys in runs] == low
+
+    # without budget left, critical and normal urls are still queried
+    check.rate_limiter.update(
+        {'X-RateLimit-Limit': '1000', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Period': '1000000'}
+    )
+    assert len(check.schedule(checkUrl)) == others
+
+
+def test_url_plan_cached(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server()
+    instance = make_instance(server.url, zones=1, records=2)
+    check = Ns1Check('ns1', {}, [instance])
+    with mock.patch.object(check, 'create_url', wraps=check.create_url) as create_url:
+        check.check(instance)
+        check.check(instance)
+    assert create_url.call_count == 1
+
+    # a restarted check reads the plan from the persistent cache
+    check = Ns1Check('ns1', {}, [instance])
+    with mock.patch.object(check, 'create_url', wraps=check.create_url) as create_url:
+        check.check(instance)
+    assert create_url.call_count == 0
+    assert len(check.url_plan["urls"]) == 2 * (1 + 1 + 2) + 1
+
+
+def test_url_plan_rebuilt_on_expiry(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server()
+    instance = make_instance(server.url, discovery_ttl=60)
+    check = Ns1Check('ns1', {}, [instance])
+    check.check(instance)
+
+    check.url_plan["expires"] = 0
+    with mock.patch.object(check, 'create_url', wraps=check.create_url) as create_url:
+        check.check(instance)
+    assert create_url.call_count == 1
+    assert check.url_plan["expires"] > 0
+
+
+def test_url_plan_rebuilt_on_config_change(aggregator, datadog_agent, ns1_api_server):
+    server = ns1_api_server()
+    instance = make_instance(server.url, zones=1, records=1)
+    Ns1Check('ns1', {}, [instance]).check(instance)
+
+    instance = make_instance(server.url, zones=1, records=3)
+    check = Ns1Check('ns1', {}, [instance])
+    with mock.patch.object(check, 'create_url', wraps=check.create_url) as create_url:
+        check.check(instance)
+    assert create_url.call_count == 1
+    assert len(check.url_plan["urls"]) == 2 * (1 + 1 + 3) + 1
+
+
+def test_url_plan_keeps_pulsar_apps(aggregator, datadog_agent, instance):
+    check = Ns1Check('ns1', {}, [instance])
+    pulsar_apps = {"1xy4sn3": ["app", [{"jobid": "1xtvhvx", "name": "job"}]]}
+    plan = {"config_hash": check.config_hash, "expires": 2**40, "urls": {}, "pulsar_apps": pulsar_apps}
+    check.write_persistent_cache(check.NS1_URL_PLAN_CACHE_KEY, json.dumps(plan))
+
+    check = Ns1Check('ns1', {}, [instance])
+    assert check.get_url_plan() == {}
+    assert check.get_pulsar_job_name_from_id("1xtvhvx") == "job"
+
+
+@pytest.mark.parametrize('discovery_ttl', [-1, "1h"])
+def test_invalid_discovery_ttl(aggregator, instance, discovery_ttl):
+    with pytest.raises(ConfigurationError, match='non-negative'):
+        Ns1Check('ns1', {}, [dict(instance, discovery_ttl=discovery_ttl)])
+
+
+def test_zero_discovery_ttl(aggregator, instance):
+    check = Ns1Check('ns1', {}, [dict(instance, discovery_ttl=0)])
+    assert check.discovery_ttl == 0
+
+
+def test_latest_point():
+    assert latest_point([]) is None
+    assert latest_point([[3, 30], [1, 10], [2, 20]]) == [3, 30]
+    # like the previous descending sort, the first of equal timestamps wins
+    assert latest_point([[1, 10], [2, 20], [2, 21]]) == [2, 20]
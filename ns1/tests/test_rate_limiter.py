@@ -0,0 +1,101 @@
+from datadog_checks.ns1.rate_limiter import TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def ratelimit_headers(limit, remaining, period):
+    return {
+        'X-RateLimit-Limit': str(limit),
+        'X-RateLimit-Remaining': str(remaining),
+        'X-RateLimit-Period': str(period),
+    }
+
+
+def make_bucket():
+    clock = FakeClock()
+    return TokenBucket(time_func=clock.time, sleep_func=clock.sleep), clock
+
+
+def test_unknown_budget_does_not_limit():
+    bucket, clock = make_bucket()
+    assert bucket.available() is None
+    for _ in range(1000):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_learns_budget_from_headers():
+    bucket, _ = make_bucket()
+    bucket.update(ratelimit_headers(100, 10, 10))
+    assert bucket.limit == 100
+    assert bucket.period == 10
+    assert bucket.available() == 10
+
+
+def test_ignores_responses_without_headers():
+    bucket, _ = make_bucket()
+    bucket.update({})
+    assert bucket.available() is None
+
+
+def test_acquire_waits_for_refill():
+    bucket, clock = make_bucket()
+    bucket.update(ratelimit_headers(10, 1, 10))
+    bucket.acquire()
+    assert clock.sleeps == []
+
+    # 1 token per second
+    bucket.acquire()
+    assert clock.sleeps == [1.0]
+
+
+def test_refill_is_capped_by_limit():
+    bucket, clock = make_bucket()
+    bucket.update(ratelimit_headers(10, 0, 10))
+    clock.now += 1000
+    assert bucket.available() == 10
+
+
+def test_keeps_lowest_remaining():
+    bucket, _ = make_bucket()
+    bucket.update(ratelimit_headers(100, 50, 100))
+    for _ in range(10):
+        bucket.acquire()
+    # a response sent before the last requests reached the server
+    bucket.update(ratelimit_headers(100, 45, 100))
+    assert bucket.available() == 40
+
+    bucket.update(ratelimit_headers(100, 0, 100))
+    assert bucket.available() == 0
+
+
+def test_drain_waits_for_default_refill():
+    bucket, clock = make_bucket()
+    bucket.drain()
+    assert bucket.available() == 0
+
+    # 100 tokens per 300 seconds by default
+    bucket.acquire()
+    assert clock.sleeps == [3.0]
+
+
+def test_drain_keeps_known_budget():
+    bucket, clock = make_bucket()
+    bucket.update(ratelimit_headers(10, 5, 10))
+    bucket.drain()
+    assert bucket.limit == 10
+    assert bucket.available() == 0
+
+    bucket.acquire()
+    assert clock.sleeps == [1.0]
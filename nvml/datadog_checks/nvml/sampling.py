@@ -0,0 +1,219 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import namedtuple
+
+import pynvml
+
+# Errors meaning that a query will never work on a device, for the lifetime of the NVML session
+UNSUPPORTED_ERRORS = frozenset((pynvml.NVML_ERROR_NOT_SUPPORTED, pynvml.NVML_ERROR_FUNCTION_NOT_FOUND))
+# Errors meaning that the NVML session must be initialized again
+SESSION_ERRORS = frozenset(
+    (pynvml.NVML_ERROR_UNINITIALIZED, pynvml.NVML_ERROR_DRIVER_NOT_LOADED, pynvml.NVML_ERROR_GPU_IS_LOST)
+)
+
+Device = namedtuple('Device', ['index', 'handle', 'uuid', 'queries'])
+DeviceSamples = namedtuple('DeviceSamples', ['index', 'uuid', 'samples'])
+
+
+# Every query reads one NVML structure of a device and returns its samples,
+# as (submission method, metric name, value, extra tags).
+# The metric names match
+# https://github.com/NVIDIA/gpu-monitoring-tools/blob/master/exporters/prometheus-dcgm/dcgm-exporter/dcgm-exporter # noqa: E501
+# Documented at https://docs.nvidia.com/deploy/nvml-api/group__nvmlDeviceQueries.html # noqa: E501
+
+
+def query_util_rate(nvml, handle):
+    # Each sample period may be between 1 second and 1/6 second, depending on the product being queried
+    util = nvml.nvmlDeviceGetUtilizationRates(handle)
+    return [('gauge', 'gpu_utilization', util.gpu, ()), ('gauge', 'mem_copy_utilization', util.memory, ())]
+
+
+def query_mem_info(nvml, handle):
+    # See https://docs.nvidia.com/deploy/nvml-api/structnvmlMemory__t.html#structnvmlMemory__t
+    mem_info = nvml.nvmlDeviceGetMemoryInfo(handle)
+    return [
+        ('gauge', 'fb_free', mem_info.free, ()),
+        ('gauge', 'fb_used', mem_info.used, ()),
+        ('gauge', 'fb_total', mem_info.total, ()),
+    ]
+
+
+def query_power(nvml, handle):
+    return [('gauge', 'power_usage', nvml.nvmlDeviceGetPowerUsage(handle), ())]
+
+
+def query_total_energy_consumption(nvml, handle):
+    return [('monotonic_count', 'total_energy_consumption', nvml.nvmlDeviceGetTotalEnergyConsumption(handle), ())]
+
+
+def query_enc_utilization(nvml, handle):
+    return [('gauge', 'enc_utilization', nvml.nvmlDeviceGetEncoderUtilization(handle)[0], ())]
+
+
+def query_dec_utilization(nvml, handle):
+    return [('gauge', 'dec_utilization', nvml.nvmlDeviceGetDecoderUtilization(handle)[0], ())]
+
+
+def query_pci_through(nvml, handle):
+    tx_bytes = nvml.nvmlDeviceGetPcieThroughput(handle, pynvml.NVML_PCIE_UTIL_TX_BYTES)
+    rx_bytes = nvml.nvmlDeviceGetPcieThroughput(handle, pynvml.NVML_PCIE_UTIL_RX_BYTES)
+    return [
+        ('monotonic_count', 'pcie_tx_throughput', tx_bytes, ()),
+        ('monotonic_count', 'pcie_rx_throughput', rx_bytes, ()),
+    ]
+
+
+def query_temperature(nvml, handle):
+    return [('gauge', 'temperature', nvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU), ())]
+
+
+def query_fan_speed(nvml, handle):
+    return [('gauge', 'fan_speed', nvml.nvmlDeviceGetFanSpeed(handle), ())]
+
+
+def query_compute_running_processes(nvml, handle):
+    return [
+        ('gauge', 'compute_running_process', process.usedGpuMemory, (f"pid:{process.pid}",))
+        for process in nvml.nvmlDeviceGetComputeRunningProcesses(handle)
+    ]
+
+
+QUERIES = (
+    ('util_rate', query_util_rate),
+    ('mem_info', query_mem_info),
+    ('power', query_power),
+    ('total_energy_consumption', query_total_energy_consumption),
+    ('enc_utilization', query_enc_utilization),
+    ('dec_utilization', query_dec_utilization),
+    ('pci_through', query_pci_through),
+    ('temperature', query_temperature),
+    ('fan_speed', query_fan_speed),
+    ('compute_running_processes', query_compute_running_processes),
+)
+
+
+class NvmlSession(object):
+    """
+    Long-lived NVML session sampling every device.
+
+    NVML is initialized once and the devices are probed on the first run:
+    their handle and UUID are cached along with the queries they support.
+    A query failing with NOT_SUPPORTED is never run again on that device,
+    other errors are only logged once per query. A device whose handle or
+    UUID can't be read is skipped until the devices are probed again.
+
+    The session is revalidated on every run by counting the devices. It is
+    initialized again when NVML reports it is gone, and the devices are
+    probed again when their count changed.
+    """
+
+    def __init__(self, nvml, log):
+        self.nvml = nvml
+        self.log = log
+        self.device_count = None
+        self.devices = None
+        self._initialized = False
+        self._logged_errors = set()
+
+    def open(self):
+        self.nvml.nvmlInit()
+        self._initialized = True
+
+    def close(self):
+        self.devices = None
+        if self._initialized:
+            self._initialized = False
+            try:
+                self.nvml.nvmlShutdown()
+            except pynvml.NVMLError as e:
+                self.log.debug("Unable to shut NVML down: %s", e)
+
+    def _probe(self, device_count):
+        devices = []
+        for index in range(device_count):
+            try:
+                handle = self.nvml.nvmlDeviceGetHandleByIndex(index)
+                uuid = self.nvml.nvmlDeviceGetUUID(handle)
+            except pynvml.NVMLError as e:
+                self._log_error("device_handle", e)
+                continue
+            queries = []
+            for name, query in QUERIES:
+                try:
+                    query(self.nvml, handle)
+                except pynvml.NVMLError as e:
+                    if e.value in UNSUPPORTED_ERRORS:
+                        self.log.debug("NVML function %s is not supported by GPU %s: %s", name, index, e)
+                        continue
+                queries.append((name, query))
+            devices.append(Device(index, handle, uuid, queries))
+        return devices
+
+    def _count_devices(self):
+        try:
+            return self.nvml.nvmlDeviceGetCount()
+        except pynvml.NVMLError as e:
+            if e.value not in SESSION_ERRORS:
+                self._log_error("device_count", e)
+                return None
+            self.log.info("NVML session lost, initializing it again: %s", e)
+        self.close()
+        self.open()
+        try:
+            return self.nvml.nvmlDeviceGetCount()
+        except pynvml.NVMLError as e:
+            self._log_error("device_count", e)
+            return None
+
+    def _revalidate(self):
+        """Return whether the devices can be sampled, after probing them again when needed."""
+        if not self._initialized:
+            self.open()
+        device_count = self._count_devices()
+        if device_count is None:
+            return False
+        if self.devices is not None and device_count != self.device_count:
+            self.log.info("GPU count changed from %s to %s, probing them again", self.device_count, device_count)
+            self.devices = None
+        if self.devices is None:
+            self.device_count = device_count
+            self.devices = self._probe(device_count)
+        return True
+
+    def sample(self):
+        """
+        Return the samples of every device, in a single pass over their supported queries,
+        or None when the devices can't be counted.
+        """
+        if not self._revalidate():
+            return None
+
+        results = []
+        session_lost = False
+        for device in self.devices:
+            samples = []
+            # Unsupported queries are removed from the device while iterating
+            for name, query in tuple(device.queries):
+                try:
+                    samples.extend(query(self.nvml, device.handle))
+                except pynvml.NVMLError as e:
+                    session_lost |= e.value in SESSION_ERRORS
+                    self._handle_error(device, name, e)
+            results.append(DeviceSamples(device.index, device.uuid, samples))
+        if session_lost:
+            # The session is initialized again on the next run
+            self.close()
+        return results
+
+    def _handle_error(self, device, name, error):
+        if error.value in UNSUPPORTED_ERRORS:
+            self.log.debug("NVML function %s is not supported by GPU %s: %s", name, device.index, error)
+            device.queries[:] = [query for query in device.queries if query[0] != name]
+            return
+        self._log_error(name, error)
+
+    def _log_error(self, name, error):
+        if name not in self._logged_errors:
+            self._logged_errors.add(name)
+            self.log.warning("Unable to execute NVML function: %s: %s", name, error)
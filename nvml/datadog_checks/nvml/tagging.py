@@ -0,0 +1,153 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+
+import os
+import threading
+
+import grpc
+
+from datadog_checks.base.utils.tagging import tagger
+
+from .api_pb2 import ListPodResourcesRequest
+from .api_pb2_grpc import PodResourcesListerStub
+
+GPU_RESOURCE_NAME = "nvidia.com/gpu"
+POD_LOG_DIR = "/var/log/pods"
+# Pod log directories are named <namespace>_<pod name>_<pod uid>
+POD_UID_LENGTH = 36
+
+REFRESH_INTERVAL = 10
+MAX_BACKOFF = 300
+LIST_TIMEOUT = 10
+
+
+class PodLogDirectory(object):
+    """
+    Index of the pod log directories, from (namespace, pod name) to pod uid.
+
+    The directory is only listed again when its modification time changed,
+    which happens whenever a pod directory is created or removed.
+    """
+
+    def __init__(self, path=POD_LOG_DIR):
+        self.path = path
+        self._mtime = None
+        self._pod_uids = {}
+
+    def get_pod_uid(self, namespace, pod_name):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            self._pod_uids = self._list()
+            self._mtime = mtime
+        return self._pod_uids.get((namespace, pod_name))
+
+    def _list(self):
+        pod_uids = {}
+        for d in os.listdir(self.path):
+            if len(d) <= POD_UID_LENGTH + 1 or d[-POD_UID_LENGTH - 1] != "_":
+                continue
+            # Neither namespaces nor pod names can contain underscores
+            namespace, _, pod_name = d[: -POD_UID_LENGTH - 1].partition("_")
+            if pod_name:
+                pod_uids.setdefault((namespace, pod_name), d[-POD_UID_LENGTH:])
+        return pod_uids
+
+
+class PodTagger(object):
+    """
+    Maps GPU UUIDs to the tags of the k8s pods they are assigned to.
+
+    A background thread lists the pod resources of the kubelet over a single
+    long-lived gRPC channel, gRPC reconnects it on its own when the kubelet
+    restarts. Failed refreshes are retried with an exponential backoff. Each
+    refresh builds a new device index that replaces the previous one as a
+    whole, readers never wait on the refresh.
+    """
+
+    def __init__(self, socket_path, log, pod_log_dir=POD_LOG_DIR, interval=REFRESH_INTERVAL, max_backoff=MAX_BACKOFF):
+        self.socket_path = socket_path
+        self.log = log
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.pod_log_directory = PodLogDirectory(pod_log_dir)
+
+        # GPU UUID -> tags, only ever replaced and never updated in place
+        self._device_tags = {}
+        self._channel = None
+        self._stub = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def get_tags(self, device_id):
+        # Note: device ID may come in as bytes, but we get strings from grpc
+        if isinstance(device_id, bytes):
+            device_id = device_id.decode("utf-8")
+        return list(self._device_tags.get(device_id, ()))
+
+    def start(self, name):
+        self._thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+            self._stub = None
+
+    def run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as ex:
+                delay = min(delay * 2, self.max_backoff)
+                self.log.warning("Unable to refresh k8s pod tags, retrying in %s seconds: %s", delay, ex)
+            else:
+                delay = self.interval
+            self._stop.wait(delay)
+        self.log.info("No longer refreshing k8s pod tags")
+
+    def _get_stub(self):
+        if self._stub is None:
+            self._channel = grpc.insecure_channel(
+                f"unix://{self.socket_path}",
+                options=[
+                    ("grpc.initial_reconnect_backoff_ms", int(self.interval * 1000)),
+                    ("grpc.max_reconnect_backoff_ms", int(self.max_backoff * 1000)),
+                ],
+            )
+            self._stub = PodResourcesListerStub(self._channel)
+        return self._stub
+
+    def refresh(self):
+        response = self._get_stub().List(ListPodResourcesRequest(), timeout=LIST_TIMEOUT)
+        device_tags = {}
+        for pod_res in response.pod_resources:
+            pod_tags = None
+            for container in pod_res.containers:
+                for device in container.devices:
+                    if device.resource_name != GPU_RESOURCE_NAME:
+                        continue
+                    if pod_tags is None:
+                        pod_tags = self.get_pod_tags(pod_res.namespace, pod_res.name)
+                    # These are the tag names that datadog seems to use
+                    tags = (
+                        f"pod_name:{pod_res.name}",
+                        f"kube_namespace:{pod_res.namespace}",
+                        f"kube_container_name:{container.name}",
+                    ) + pod_tags
+                    for device_id in device.device_ids:
+                        device_tags[device_id] = tags
+        self._device_tags = device_tags
+
+    def get_pod_tags(self, namespace, pod_name):
+        try:
+            pod_uid = self.pod_log_directory.get_pod_uid(namespace, pod_name)
+            if pod_uid is None:
+                return ()
+            return tuple(tagger.get_tags(f"kubernetes_pod_uid://{pod_uid}", tagger.LOW))
+        except Exception:
+            self.log.error("Could not get tags for %s pod %s", namespace, pod_name)
+            return ()
@@ -0,0 +1,77 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+
+import pynvml
+
+Process = namedtuple('Process', ['pid', 'usedGpuMemory'])
+
+
+class FakeNvml(object):
+    """
+    pynvml replacement for `device_count` GPUs, counting the NVML calls.
+
+    Functions listed in `unsupported` fail with NOT_SUPPORTED, `errors` maps
+    function names to the error code they fail with.
+    """
+
+    def __init__(self, device_count=1, unsupported=(), errors=None):
+        self.device_count = device_count
+        self.unsupported = set(unsupported)
+        self.errors = errors or {}
+        self.calls = Counter()
+
+    def _call(self, name, value):
+        self.calls[name] += 1
+        if name in self.unsupported:
+            raise pynvml.NVMLError(pynvml.NVML_ERROR_NOT_SUPPORTED)
+        if name in self.errors:
+            raise pynvml.NVMLError(self.errors[name])
+        return value
+
+    def nvmlInit(self):
+        return self._call('nvmlInit', None)
+
+    def nvmlShutdown(self):
+        return self._call('nvmlShutdown', None)
+
+    def nvmlDeviceGetCount(self):
+        return self._call('nvmlDeviceGetCount', self.device_count)
+
+    def nvmlDeviceGetHandleByIndex(self, i):
+        return self._call('nvmlDeviceGetHandleByIndex', i)
+
+    def nvmlDeviceGetUUID(self, h):
+        return self._call('nvmlDeviceGetUUID', f"GPU-{h}")
+
+    def nvmlDeviceGetUtilizationRates(self, h):
+        return self._call('nvmlDeviceGetUtilizationRates', SimpleNamespace(gpu=2, memory=3))
+
+    def nvmlDeviceGetMemoryInfo(self, h):
+        return self._call('nvmlDeviceGetMemoryInfo', SimpleNamespace(free=40, used=50, total=90))
+
+    def nvmlDeviceGetPowerUsage(self, h):
+        return self._call('nvmlDeviceGetPowerUsage', 12)
+
+    def nvmlDeviceGetTotalEnergyConsumption(self, h):
+        return self._call('nvmlDeviceGetTotalEnergyConsumption', 8)
+
+    def nvmlDeviceGetEncoderUtilization(self, h):
+        return self._call('nvmlDeviceGetEncoderUtilization', (9, 0))
+
+    def nvmlDeviceGetDecoderUtilization(self, h):
+        return self._call('nvmlDeviceGetDecoderUtilization', (10, 0))
+
+    def nvmlDeviceGetPcieThroughput(self, h, counter):
+        return self._call('nvmlDeviceGetPcieThroughput', 11)
+
+    def nvmlDeviceGetTemperature(self, h, sensor):
+        return self._call('nvmlDeviceGetTemperature', 13)
+
+    def nvmlDeviceGetFanSpeed(self, h):
+        return self._call('nvmlDeviceGetFanSpeed', 14)
+
+    def nvmlDeviceGetComputeRunningProcesses(self, h):
+        return self._call('nvmlDeviceGetComputeRunningProcesses', [Process(pid=1, usedGpuMemory=11)])
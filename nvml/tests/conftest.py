@@ -1,8 +1,14 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+from concurrent import futures
+
+import grpc
 import pytest
 
+from datadog_checks.nvml.api_pb2 import ContainerDevices, ContainerResources, ListPodResourcesResponse, PodResources
+from datadog_checks.nvml.api_pb2_grpc import PodResourcesListerServicer, add_PodResourcesListerServicer_to_server
+
 
 @pytest.fixture(scope='session')
 def dd_environment():
@@ -12,3 +18,55 @@ def dd_environment():
 @pytest.fixture
 def instance():
     return {}
+
+
+class FakePodResourcesLister(PodResourcesListerServicer):
+    """Kubelet pod-resources service answering with `pods`, a list of (namespace, name, container, device ids)."""
+
+    def __init__(self):
+        self.pods = []
+        self.calls = 0
+
+    def List(self, request, context):
+        self.calls += 1
+        return ListPodResourcesResponse(
+            pod_resources=[
+                PodResources(
+                    name=name,
+                    namespace=namespace,
+                    containers=[
+                        ContainerResources(
+                            name=container,
+                            devices=[ContainerDevices(resource_name="nvidia.com/gpu", device_ids=device_ids)],
+                        )
+                    ],
+                )
+                for namespace, name, container, device_ids in self.pods
+            ]
+        )
+
+
+@pytest.fixture
+def pod_resources_server(tmp_path):
+    """Starts fake kubelet pod-resources servers on a unix socket, they can be stopped and started again."""
+    socket_path = str(tmp_path / "kubelet.sock")
+    servicer = FakePodResourcesLister()
+    servers = []
+
+    def start():
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        add_PodResourcesListerServicer_to_server(servicer, server)
+        server.add_insecure_port(f"unix://{socket_path}")
+        server.start()
+        servers.append(server)
+
+    def stop():
+        servers.pop().stop(None).wait()
+
+    start()
+    servicer.socket_path = socket_path
+    servicer.start = start
+    servicer.stop = stop
+    yield servicer
+    while servers:
+        stop()
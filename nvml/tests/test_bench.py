@@ -0,0 +1,40 @@
+# (C) Datadog, Inc. 2020-present
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import mock
+import pytest
+
+from datadog_checks.nvml import NvmlCheck
+
+from .common import FakeNvml
+
+# Data center GPUs have no fan, nor video encoder and decoder
+DATA_CENTER_UNSUPPORTED = [
+    'nvmlDeviceGetFanSpeed',
+    'nvmlDeviceGetEncoderUtilization',
+    'nvmlDeviceGetDecoderUtilization',
+]
+
+
+@pytest.mark.parametrize('unsupported', [[], DATA_CENTER_UNSUPPORTED], ids=['all_supported', 'data_center'])
+def test_run(benchmark, aggregator, instance, unsupported):
+    nvml = FakeNvml(device_count=8, unsupported=unsupported)
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        check.check(instance)
+        nvml.calls.clear()
+
+        runs = []
+
+        def run():
+            runs.append(None)
+            check.check(instance)
+
+        # Only one round runs with --benchmark-disable
+        benchmark.pedantic(run, rounds=100)
+
+    calls_per_run = sum(nvml.calls.values()) / len(runs)
+    # Initializing and shutting NVML down, and getting the handle and UUID of every GPU
+    # used to add 18 calls per run on 8 GPUs, on top of the unsupported calls failing every time
+    assert calls_per_run == 1 + 8 * (11 - len(unsupported))
+    assert nvml.calls['nvmlInit'] == 0
@@ -1,13 +1,20 @@
 # (C) Datadog, Inc. 2020-present
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import os
+import time
 from collections import namedtuple
 from types import SimpleNamespace
 
+import grpc
 import mock
+import pynvml
 import pytest
 
 from datadog_checks.nvml import NvmlCheck
+from datadog_checks.nvml.tagging import PodLogDirectory, PodTagger
+
+from .common import FakeNvml
 
 
 class MockNvml:
@@ -104,3 +111,222 @@ def test_check(aggregator, instance):
     aggregator.assert_metric('nvml.compute_running_process', tags=expected_tags + ["pid:1"], count=1)
 
     aggregator.assert_all_metrics_covered()
+
+
+POD_UID = "0b9f5f4a-0d5c-4e3a-9f2e-8a9c3b7d6e51"
+
+
+@pytest.fixture
+def pod_log_dir(tmp_path):
+    path = tmp_path / "pods"
+    path.mkdir()
+    (path / f"default_trainer_{POD_UID}").mkdir()
+    (path / "kube-system_dns_1234").mkdir()
+    return path
+
+
+@pytest.mark.unit
+def test_pod_tagger_keeps_one_channel(pod_resources_server, pod_log_dir):
+    pod_resources_server.pods = [("default", "trainer", "cuda", ["GPU-1", "GPU-2"]), ("default", "idle", "cuda", [])]
+    tagger = PodTagger(pod_resources_server.socket_path, mock.Mock(), pod_log_dir=str(pod_log_dir))
+
+    insecure_channel = mock.patch("datadog_checks.nvml.tagging.grpc.insecure_channel", wraps=grpc.insecure_channel)
+    pod_tags = mock.patch("datadog_checks.nvml.tagging.tagger.get_tags", return_value=["pod_phase:running"])
+    with insecure_channel as channel, pod_tags as get_tags:
+        tagger.refresh()
+        tagger.refresh()
+
+    assert channel.call_count == 1
+    assert pod_resources_server.calls == 2
+    get_tags.assert_called_with(f"kubernetes_pod_uid://{POD_UID}", mock.ANY)
+    expected_tags = ["pod_name:trainer", "kube_namespace:default", "kube_container_name:cuda", "pod_phase:running"]
+    assert tagger.get_tags("GPU-1") == expected_tags
+    assert tagger.get_tags(b"GPU-2") == expected_tags
+    assert tagger.get_tags("GPU-3") == []
+    tagger.stop()
+
+
+@pytest.mark.unit
+def test_pod_tagger_reconnects(pod_resources_server, pod_log_dir):
+    pod_resources_server.pods = [("default", "trainer", "cuda", ["GPU-1"])]
+    tagger = PodTagger(pod_resources_server.socket_path, mock.Mock(), pod_log_dir=str(pod_log_dir), interval=0.1)
+    tagger.refresh()
+    snapshot = tagger._device_tags
+
+    # The last known tags are kept while the kubelet is unreachable
+    pod_resources_server.stop()
+    with pytest.raises(grpc.RpcError):
+        tagger.refresh()
+    assert tagger._device_tags is snapshot
+
+    pod_resources_server.pods = [("default", "trainer", "cuda", ["GPU-2"])]
+    pod_resources_server.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            tagger.refresh()
+            break
+        except grpc.RpcError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+    assert tagger.get_tags("GPU-1") == []
+    assert tagger.get_tags("GPU-2")[0] == "pod_name:trainer"
+    tagger.stop()
+
+
+@pytest.mark.unit
+def test_pod_tagger_backoff():
+    tagger = PodTagger("/nonexistent.sock", mock.Mock(), interval=10, max_backoff=60)
+    results = [Exception("unavailable")] * 4 + [None, Exception("unavailable")]
+    delays = []
+
+    def wait(delay):
+        delays.append(delay)
+        if len(delays) == len(results):
+            tagger._stop.set()
+
+    with mock.patch.object(tagger, "refresh", side_effect=results), mock.patch.object(tagger._stop, "wait", wait):
+        tagger.run()
+
+    assert delays == [20, 40, 60, 60, 10, 20]
+
+
+@pytest.mark.unit
+def test_pod_log_directory_is_listed_on_change(pod_log_dir):
+    directory = PodLogDirectory(str(pod_log_dir))
+
+    with mock.patch("datadog_checks.nvml.tagging.os.listdir", wraps=os.listdir) as listdir:
+        assert directory.get_pod_uid("default", "trainer") == POD_UID
+        assert directory.get_pod_uid("default", "unknown") is None
+        assert directory.get_pod_uid("kube-system", "dns") is None
+        assert listdir.call_count == 1
+
+        uid = "7c1e2d3f-4a5b-6c7d-8e9f-0a1b2c3d4e5f"
+        (pod_log_dir / f"default_unknown_{uid}").mkdir()
+        os.utime(str(pod_log_dir), ns=(0, os.stat(str(pod_log_dir)).st_mtime_ns + 1))
+        assert directory.get_pod_uid("default", "unknown") == uid
+        assert listdir.call_count == 2
+
+
+@pytest.mark.unit
+def test_nvml_is_initialized_once(aggregator, instance):
+    nvml = FakeNvml(device_count=2)
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        nvml.calls.clear()
+        check.check(instance)
+        check.check(instance)
+
+    assert nvml.calls['nvmlInit'] == 0
+    assert nvml.calls['nvmlShutdown'] == 0
+    # probed on the first run only
+    assert nvml.calls['nvmlDeviceGetHandleByIndex'] == 2
+    assert nvml.calls['nvmlDeviceGetCount'] == 2
+    aggregator.assert_metric('nvml.temperature', tags=["gpu:1"], count=2)
+
+    check.cancel()
+    assert nvml.calls['nvmlShutdown'] == 1
+
+
+@pytest.mark.unit
+def test_unsupported_queries_are_skipped(aggregator, instance):
+    nvml = FakeNvml(device_count=2, unsupported=['nvmlDeviceGetFanSpeed'])
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        check.check(instance)
+        # probed once per device
+        assert nvml.calls['nvmlDeviceGetFanSpeed'] == 2
+
+        # a query only failing after the probe is dropped as well
+        nvml.unsupported.add('nvmlDeviceGetPowerUsage')
+        check.check(instance)
+        check.check(instance)
+
+    assert nvml.calls['nvmlDeviceGetFanSpeed'] == 2
+    # probe, first run and first failure on both devices
+    assert nvml.calls['nvmlDeviceGetPowerUsage'] == 6
+    aggregator.assert_metric('nvml.fan_speed', count=0)
+    aggregator.assert_metric('nvml.power_usage', count=2)
+    aggregator.assert_metric('nvml.temperature', tags=["gpu:0"], count=3)
+
+
+@pytest.mark.unit
+def test_transient_errors_are_retried(aggregator, instance):
+    nvml = FakeNvml(errors={'nvmlDeviceGetTemperature': pynvml.NVML_ERROR_TIMEOUT})
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        check.check(instance)
+        aggregator.assert_metric('nvml.temperature', count=0)
+        aggregator.assert_metric('nvml.fan_speed', count=1)
+
+        del nvml.errors['nvmlDeviceGetTemperature']
+        check.check(instance)
+    aggregator.assert_metric('nvml.temperature', count=1)
+
+
+@pytest.mark.unit
+def test_session_is_revalidated(aggregator, instance):
+    nvml = FakeNvml(device_count=1)
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        check.check(instance)
+
+        # a GPU was added
+        nvml.device_count = 2
+        check.check(instance)
+        aggregator.assert_metric('nvml.device_count', value=2)
+        aggregator.assert_metric('nvml.temperature', tags=["gpu:1"], count=1)
+        assert nvml.calls['nvmlInit'] == 1
+
+        # the driver was reloaded
+        nvml.errors['nvmlDeviceGetCount'] = pynvml.NVML_ERROR_UNINITIALIZED
+        with mock.patch.object(nvml, 'nvmlInit', side_effect=lambda: nvml.errors.clear()):
+            check.check(instance)
+        assert nvml.calls['nvmlShutdown'] == 1
+        aggregator.assert_metric('nvml.temperature', tags=["gpu:1"], count=2)
+
+        # a lost GPU makes the session initialize again on the next run
+        nvml.errors['nvmlDeviceGetTemperature'] = pynvml.NVML_ERROR_GPU_IS_LOST
+        check.check(instance)
+        del nvml.errors['nvmlDeviceGetTemperature']
+        check.check(instance)
+    assert nvml.calls['nvmlShutdown'] == 2
+    assert nvml.calls['nvmlInit'] == 2
+    aggregator.assert_metric('nvml.temperature', tags=["gpu:1"], count=3)
+
+
+@pytest.mark.unit
+def test_probe_errors_are_logged(aggregator, instance, caplog):
+    nvml = FakeNvml(device_count=2, errors={'nvmlDeviceGetUUID': pynvml.NVML_ERROR_UNKNOWN})
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        assert check.should_run
+        check.check(instance)
+        check.check(instance)
+        assert caplog.text.count("Unable to execute NVML function: device_handle") == 1
+        aggregator.assert_metric('nvml.device_count', value=2, count=2)
+        aggregator.assert_metric('nvml.temperature', count=0)
+
+        # the devices are probed again once their count changed
+        del nvml.errors['nvmlDeviceGetUUID']
+        nvml.device_count = 1
+        check.check(instance)
+        aggregator.assert_metric('nvml.temperature', tags=["gpu:0"], count=1)
+
+
+@pytest.mark.unit
+def test_device_count_errors_are_logged(aggregator, instance, caplog):
+    nvml = FakeNvml(errors={'nvmlDeviceGetCount': pynvml.NVML_ERROR_UNKNOWN})
+    with mock.patch('datadog_checks.nvml.NvmlCheck.N', nvml):
+        check = NvmlCheck('nvml', {}, [instance])
+        check.check(instance)
+        check.check(instance)
+        assert caplog.text.count("Unable to execute NVML function: device_count") == 1
+        aggregator.assert_metric('nvml.device_count', count=0)
+
+        del nvml.errors['nvmlDeviceGetCount']
+        check.check(instance)
+    aggregator.assert_metric('nvml.device_count', value=1, count=1)
+    aggregator.assert_metric('nvml.temperature', tags=["gpu:0"], count=1)
@@ -3,7 +3,7 @@ from collections import defaultdict
 
 import redis
 
-from datadog_checks.base import AgentCheck, ConfigurationError
+from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'redis_sentinel'
 
@@ -12,6 +12,8 @@ class RedisSentinelCheck(AgentCheck):
     def __init__(self, name, init_config, instances=None):
         super(RedisSentinelCheck, self).__init__(name, init_config, instances)
         self._masters = defaultdict(lambda: "")
+        # (host, port, password) -> client, whose connection pool is reused across runs
+        self._clients = {}
 
     def _load_config(self, instance):
         host = instance.get('sentinel_host')
@@ -27,25 +29,77 @@ class RedisSentinelCheck(AgentCheck):
 
         return host, port, passwd
 
+    def _get_client(self, host, port, password):
+        key = (host, port, password)
+        if key not in self._clients:
+            self._clients[key] = redis.StrictRedis(host=host, port=port, password=password, db=0)
+        return self._clients[key]
+
     def check(self, instance):
 
         host, port, password = self._load_config(instance)
 
-        redis_conn = redis.StrictRedis(host=host, port=port, password=password, db=0)
+        redis_conn = self._get_client(host, port, password)
+
+        if is_affirmative(instance.get('use_pipeline', True)):
+            masters_stats = self._get_masters_stats_pipelined(redis_conn, instance['masters'])
+        else:
+            masters_stats = self._get_masters_stats(redis_conn, instance['masters'])
 
-        for master_name in instance['masters']:
+        for master_name, stats in masters_stats:
             base_tags = [f'redis_name:{master_name}'] + instance.get('tags', [])
             try:
-                self._process_instance_master(redis_conn, master_name, base_tags)
+                self._process_instance_master(master_name, stats, base_tags)
             except Exception as e:
                 self.warning("Error collecting metrics for master %s: %s", master_name, e)
 
-    def _process_instance_master(self, redis_conn, master_name, base_tags):
-        master_tags = self._process_master_stats(redis_conn, master_name, base_tags)
-        self._process_slaves_stats(redis_conn, master_name, base_tags, master_tags)
-        self._process_sentinels_stats(redis_conn, master_name, base_tags, master_tags)
+    def _get_masters_stats(self, redis_conn, master_names):
+        """
+        Yield every master name with an iterator over its master, slaves and sentinels
+        stats. Each command takes a round trip, run when its stats are needed.
+        """
+        for master_name in master_names:
+            yield master_name, self._iter_master_stats(redis_conn, master_name)
 
-    def _process_sentinels_stats(self, redis_conn, master_name, base_tags, master_tags):
+    def _iter_master_stats(self, redis_conn, master_name):
+        yield redis_conn.sentinel_master(master_name)
+        yield redis_conn.sentinel_slaves(master_name)
+        yield redis_conn.sentinel_sentinels(master_name)
+
+    def _get_masters_stats_pipelined(self, redis_conn, master_names):
+        """
+        Same as `_get_masters_stats`, but the commands of every master are sent in a
+        single pipeline: the stats of all masters take one round trip.
+        """
+        pipe = redis_conn.pipeline(transaction=False)
+        for master_name in master_names:
+            pipe.sentinel_master(master_name)
+            pipe.sentinel_slaves(master_name)
+            pipe.sentinel_sentinels(master_name)
+
+        try:
+            # The error of a command is returned in place of its result
+            results = pipe.execute(raise_on_error=False)
+        except Exception as e:
+            self.warning("Error collecting metrics for masters %s: %s", ', '.join(master_names), e)
+            return
+
+        for position, master_name in enumerate(master_names):
+            yield master_name, self._iter_results(results[position * 3 : position * 3 + 3])
+
+    @staticmethod
+    def _iter_results(results):
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            yield result
+
+    def _process_instance_master(self, master_name, stats, base_tags):
+        master_tags = self._process_master_stats(next(stats), master_name, base_tags)
+        self._process_slaves_stats(next(stats), base_tags, master_tags)
+        self._process_sentinels_stats(next(stats), base_tags, master_tags)
+
+    def _process_sentinels_stats(self, sentinels_stats, base_tags, master_tags):
         """
         [{
             'down-after-milliseconds': 5000,
@@ -71,7 +125,6 @@ class RedisSentinelCheck(AgentCheck):
             'voted-leader-epoch': 0,
         }]
         """
-        sentinels_stats = redis_conn.sentinel_sentinels(master_name)
         # sentinel_stats returns stats for other sentinels only
         # so increment once for current sentinel
         self.increment('redis.sentinel.ok_sentinels', tags=master_tags)
@@ -94,7 +147,7 @@ class RedisSentinelCheck(AgentCheck):
             if ok_reply is not None and sent is not None:
                 self.gauge('redis.sentinel.last_ok_ping_latency', reply - ok_reply, sentinel_tags)
 
-    def _process_slaves_stats(self, redis_conn, master_name, base_tags, master_tags):
+    def _process_slaves_stats(self, slaves_stats, base_tags, master_tags):
         """
         [{
             'down-after-milliseconds': 5000,
@@ -125,7 +178,6 @@ class RedisSentinelCheck(AgentCheck):
             'slave-repl-offset': 12345678,
         }]
         """
-        slaves_stats = redis_conn.sentinel_slaves(master_name)
         slaves_odown = 0
         slaves_sdown = 0
 
@@ -159,7 +211,7 @@ class RedisSentinelCheck(AgentCheck):
         self.gauge('redis.sentinel.odown_slaves', slaves_odown, tags=master_tags)
         self.gauge('redis.sentinel.sdown_slaves', slaves_sdown, tags=master_tags)
 
-    def _process_master_stats(self, redis_conn, master_name, base_tags):
+    def _process_master_stats(self, stats, master_name, base_tags):
         """
         {
             'config-epoch': 94,
@@ -190,7 +242,6 @@ class RedisSentinelCheck(AgentCheck):
             'runid': '123456789abcdef',
         }
         """
-        stats = redis_conn.sentinel_master(master_name)
         master_tags = [f"master_ip:{stats['ip']}"] + base_tags
 
         pending = stats.get('link-pending-commands', stats.get('pending-commands'))
@@ -1,4 +1,6 @@
 import os
+import socketserver
+import threading
 
 import pytest
 
@@ -18,3 +20,112 @@ def dd_environment():
 @pytest.fixture
 def instance():
     return {'sentinel_host': HOST, 'sentinel_port': 26379, 'masters': ['mymaster']}
+
+
+class FakeSentinel(socketserver.ThreadingTCPServer):
+    """
+    Sentinel speaking just enough RESP to answer SENTINEL MASTER, SLAVES and SENTINELS.
+
+    `masters` maps master names to their (master, slaves, sentinels) states. Every batch
+    of commands read at once counts as a round trip.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeSentinelHandler)
+        self.masters = {}
+        self.connections = 0
+        self.round_trips = 0
+        self.commands = []
+
+
+class FakeSentinelHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        buffer = b''
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            buffer += data
+            commands, buffer = parse_commands(buffer)
+            if commands:
+                self.server.round_trips += 1
+                self.server.commands.extend(commands)
+                self.request.sendall(b''.join(self.answer(command) for command in commands))
+
+    def answer(self, command):
+        if command[0].upper() == 'AUTH':
+            return b'+OK\r\n'
+        subcommand, master_name = command[1].upper(), command[2]
+        if master_name not in self.server.masters:
+            return b'-ERR No such master with that name\r\n'
+        master, slaves, sentinels = self.server.masters[master_name]
+        if subcommand == 'MASTER':
+            return encode_state(master)
+        states = slaves if subcommand == 'SLAVES' else sentinels
+        return b'*%d\r\n' % len(states) + b''.join(encode_state(state) for state in states)
+
+
+def parse_commands(buffer):
+    """Parse the complete commands of the buffer, return them with the rest of the buffer."""
+    commands = []
+    while True:
+        lines = buffer.split(b'\r\n')
+        if len(lines) < 2:
+            return commands, buffer
+        count = int(lines[0][1:])
+        if len(lines) < 2 + count * 2:
+            return commands, buffer
+        commands.append([line.decode() for line in lines[2 : 2 + count * 2 : 2]])
+        buffer = b'\r\n'.join(lines[1 + count * 2 :])
+
+
+def encode_state(state):
+    items = [str(item).encode() for pair in state.items() for item in pair]
+    return b'*%d\r\n' % len(items) + b''.join(b'$%d\r\n%s\r\n' % (len(item), item) for item in items)
+
+
+def make_master_state(master_name, ip='10.0.0.1', slaves=1, sentinels=1):
+    """The (master, slaves, sentinels) states of a healthy master."""
+    master = {
+        'name': master_name,
+        'ip': ip,
+        'port': 6379,
+        'flags': 'master',
+        'pending-commands': 0,
+        'num-slaves': slaves,
+        'num-other-sentinels': sentinels,
+    }
+    slaves = [
+        {'name': f'10.0.1.{i}:6379', 'ip': f'10.0.1.{i}', 'flags': 'slave', 'master-link-status': 'ok'}
+        for i in range(slaves)
+    ]
+    sentinels = [
+        {'name': f'10.0.2.{i}:26379', 'ip': f'10.0.2.{i}', 'flags': 'sentinel', 'link-pending-commands': 0}
+        for i in range(sentinels)
+    ]
+    return master, slaves, sentinels
+
+
+@pytest.fixture
+def fake_sentinel():
+    server = FakeSentinel()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_sentinel_instance(fake_sentinel):
+    def make_instance(masters, **options):
+        fake_sentinel.masters = {name: make_master_state(name) for name in masters}
+        instance = {'sentinel_host': '127.0.0.1', 'sentinel_port': fake_sentinel.server_address[1], 'masters': masters}
+        instance.update(options)
+        return instance
+
+    return make_instance
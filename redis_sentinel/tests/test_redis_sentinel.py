@@ -88,8 +88,64 @@ def test_down_slaves(aggregator, instance):
 
     sentinel_slaves = [{'is_odown': True, 'is_sdown': False} for _ in range(5)]
     sentinel_slaves.extend({'is_odown': False, 'is_sdown': True} for _ in range(7))
-    with mock.patch('redis.StrictRedis.sentinel_slaves', return_value=sentinel_slaves):
+    callbacks = {'SENTINEL SLAVES': lambda response, **options: sentinel_slaves}
+    with mock.patch.dict('redis.StrictRedis.RESPONSE_CALLBACKS', callbacks):
         check.check(instance)
 
         aggregator.assert_metric('redis.sentinel.odown_slaves', 5)
         aggregator.assert_metric('redis.sentinel.sdown_slaves', 7)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('use_pipeline', [True, False])
+def test_connection_is_reused(aggregator, fake_sentinel, fake_sentinel_instance, use_pipeline):
+    instance = fake_sentinel_instance(['master-a', 'master-b'], use_pipeline=use_pipeline)
+    check = RedisSentinelCheck(CHECK_NAME, {}, [instance])
+    check.check(instance)
+    check.check(instance)
+
+    assert fake_sentinel.connections == 1
+    for master_name in ('master-a', 'master-b'):
+        tags = [f'redis_name:{master_name}', 'master_ip:10.0.0.1']
+        aggregator.assert_metric('redis.sentinel.known_slaves', value=1, tags=tags, count=2)
+        aggregator.assert_service_check('redis.sentinel.master_is_down', status=check.OK, tags=tags, count=2)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('use_pipeline, round_trips', [(True, 1), (False, 30)])
+def test_pipelined_round_trips(aggregator, fake_sentinel, fake_sentinel_instance, use_pipeline, round_trips):
+    masters = [f'master-{i}' for i in range(10)]
+    instance = fake_sentinel_instance(masters, use_pipeline=use_pipeline)
+    check = RedisSentinelCheck(CHECK_NAME, {}, [instance])
+    check.check(instance)
+
+    assert fake_sentinel.round_trips == round_trips
+    assert len(fake_sentinel.commands) == 30
+    for master_name in masters:
+        aggregator.assert_metric('redis.sentinel.ok_slaves', tags=[f'redis_name:{master_name}', 'master_ip:10.0.0.1'])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('use_pipeline', [True, False])
+def test_unknown_master(aggregator, fake_sentinel, fake_sentinel_instance, use_pipeline):
+    instance = fake_sentinel_instance(['master-a', 'master-b'], use_pipeline=use_pipeline)
+    del fake_sentinel.masters['master-a']
+    check = RedisSentinelCheck(CHECK_NAME, {}, [instance])
+    check.check(instance)
+
+    assert [w for w in check.warnings if 'master' in w] == [
+        'Error collecting metrics for master master-a: No such master with that name'
+    ]
+    aggregator.assert_metric('redis.sentinel.known_slaves', count=0, tags=['redis_name:master-a', 'master_ip:10.0.0.1'])
+    aggregator.assert_metric('redis.sentinel.known_slaves', count=1, tags=['redis_name:master-b', 'master_ip:10.0.0.1'])
+
+
+@pytest.mark.unit
+def test_pipeline_connection_error(aggregator):
+    instance = {'sentinel_host': '127.0.0.1', 'sentinel_port': 1, 'masters': ['master-a', 'master-b']}
+    check = RedisSentinelCheck(CHECK_NAME, {}, [instance])
+    check.check(instance)
+
+    assert len(check.warnings) == 1
+    assert 'master-a, master-b' in check.warnings[0]
+    aggregator.assert_all_metrics_covered()
@@ -1,14 +1,69 @@
 import sys
-from datetime import datetime, timedelta
-
-import requests  # SKIP_HTTP_VALIDATION
-from requests.auth import HTTPBasicAuth
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 from datadog_checks.base import AgentCheck, ConfigurationError
 from datadog_checks.base.errors import CheckException
 
+from .events import TIMESTAMP_FORMAT, EventCursor
+
 EVENT_TYPE = SOURCE_TYPE_NAME = 'redisenterprise'
 
+# Stats of bdbs/stats/last sent as is
+BDB_GAUGES = frozenset(
+    [
+        'avg_latency',
+        'avg_latency_max',
+        'avg_other_latency',
+        'avg_read_latency',
+        'avg_write_latency',
+        'conns',
+        'egress_bytes',
+        'evicted_objects',
+        'expired_objects',
+        'fork_cpu_system',
+        'ingress_bytes',
+        'listener_acc_latency',
+        'main_thread_cpu_system',
+        'main_thread_cpu_system_max',
+        'memory_limit',
+        'no_of_keys',
+        'other_req',
+        'read_hits',
+        'read_misses',
+        'read_req',
+        'shard_cpu_system',
+        'shard_cpu_system_max',
+        'total_req',
+        'total_req_max',
+        'used_memory',
+        'write_hits',
+        'write_misses',
+        'write_req',
+        'bigstore_objs_ram',
+        'bigstore_objs_flash',
+        'bigstore_io_reads',
+        'bigstore_io_writes',
+        'bigstore_throughput',
+        'big_write_ram',
+        'big_write_flash',
+        'big_del_ram',
+        'big_del_flash',
+    ]
+)
+
+# Stats of bdbs/<uid>/peer_stats -> metric name
+CRDT_STATS = {
+    "egress_bytes": "crdt_egress_bytes",
+    "egress_bytes_decompressed": "crdt_egress_bytes_decompressed",
+    "ingress_bytes": "crdt_ingress_bytes",
+    "ingress_bytes_decompressed": "crdt_ingress_bytes_decompressed",
+    "local_ingress_lag_time": "crdt_local_lag",
+    "pending_local_writes_max": "crdt_pending_max",
+    "pending_local_writes_min": "crdt_pending_min",
+}
+
 
 class RedisenterpriseCheck(AgentCheck):
     """RedisenterpriseCheck attempts to connect to the cluster and ensure the node is the master node"""
@@ -20,10 +75,42 @@ class RedisenterpriseCheck(AgentCheck):
         'tls_ignore_warning': {'name': 'tls_ignore_warning', 'default': True},
     }
 
+    DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+    DEFAULT_EVENT_LIMIT = 100
+    MAX_EVENT_LIMIT = 1000
+    DEFAULT_EVENT_WINDOW = 3600
+    # Without a saved cursor, start two minutes ago so that the events of a failover are collected
+    EVENT_LOOKBACK = 120
+    EVENT_CURSOR_CACHE_KEY = 'event_cursor'
+
     def __init__(self, name, init_config, instances):
         super(RedisenterpriseCheck, self).__init__(name, init_config, instances)
-        # Set this to two minutes ago which may cause duplicates but we need to get everything in the case of failover
-        self.last_event_timestamp_seen = datetime.utcnow() - timedelta(0, 120)
+
+        self.event_limit = self.instance.get('event_limit', self.DEFAULT_EVENT_LIMIT)
+        if not isinstance(self.event_limit, int) or self.event_limit < 1:
+            raise ConfigurationError('Configuration Error: event_limit must be a positive integer')
+        if self.event_limit > self.MAX_EVENT_LIMIT:
+            self.log.warning(
+                'event_limit of %s is higher than the maximum of %s, using the maximum',
+                self.event_limit,
+                self.MAX_EVENT_LIMIT,
+            )
+            self.event_limit = self.MAX_EVENT_LIMIT
+
+        event_window = self.instance.get('event_window', self.DEFAULT_EVENT_WINDOW)
+        if not isinstance(event_window, int) or event_window < 1:
+            raise ConfigurationError('Configuration Error: event_window must be a positive integer')
+        # The cursor is restored from the persistent cache on the first run
+        self.event_cursor = EventCursor(event_window, self.EVENT_LOOKBACK)
+
+        self.max_concurrent_requests = self.instance.get(
+            'max_concurrent_requests', self.DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+        if not isinstance(self.max_concurrent_requests, int) or self.max_concurrent_requests < 1:
+            raise ConfigurationError('Configuration Error: max_concurrent_requests must be a positive integer')
+        # The API requests of a run share a pool of threads and the keep-alive connections of self.http
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def _timestamp(self, date):
         """Allows us to return an epoch time stamp if we use python2 or python3"""
@@ -37,11 +124,8 @@ class RedisenterpriseCheck(AgentCheck):
         host = self.instance.get('host')
         timeout = self.instance.get('timeout')
         port = self.instance.get('port', 9443)
-        username = self.instance.get('username')
-        password = self.instance.get('password')
-        event_limit = self.instance.get('event_limit', 100)
         is_mock = self.instance.get('is_mock', False)
-        service_check_tags = self.instance.get('tags', [])
+        service_check_tags = list(self.instance.get('tags', []))
 
         if not host:
             raise ConfigurationError(
@@ -51,29 +135,50 @@ class RedisenterpriseCheck(AgentCheck):
         try:
 
             # check everything if we are the cluster master
-            if self._check_not_follower(host, port, username, password, timeout, is_mock):
+            if self._check_not_follower(host, port, timeout, is_mock):
+
+                # only ask for the events after the cursor, the CRDT stats share its start time
+                stime = self._get_event_start()
+
+                # the endpoints don't depend on each other, fetch them all at once
+                responses = self._fetch_all(
+                    {
+                        'cluster': ('cluster', None),
+                        'license': ('license', None),
+                        'nodes': ('nodes', None),
+                        'bdbs': ('bdbs', None),
+                        'bdb_stats': ('bdbs/stats/last', None),
+                        'events': ('logs', self._get_events_params(stime)),
+                        'version': ('bootstrap', None),
+                    }
+                )
 
                 # add the cluster FQDN to the tags
-                fqdn = self._get_fqdn(host, port, service_check_tags)
+                fqdn = self._get_fqdn(responses['cluster'])
                 service_check_tags.append(f'redis_cluster:{fqdn}')
 
+                # grab the DBD ID to name mapping, and start fetching the stats of the bdbs with crdt
+                bdb_dict = self._get_bdb_dict(responses['bdbs'])
+                crdt_params = self._get_crdt_params(stime)
+                crdt_responses = self._fetch_all(
+                    {bdb: (f'bdbs/{bdb}/peer_stats', crdt_params) for bdb, v in bdb_dict.items() if v['crdt']}
+                )
+
                 # collect the license data
-                self._get_license(host, port, service_check_tags)
+                self._get_license(responses['license'], service_check_tags)
 
                 # collect the node data
-                self._get_nodes(host, port, service_check_tags)
+                self._get_nodes(responses['nodes'], service_check_tags)
 
-                # grab the DBD ID to name mapping
-                bdb_dict = self._get_bdb_dict(host, port, service_check_tags)
-                self._get_bdb_stats(host, port, bdb_dict, service_check_tags)
+                self._get_bdb_stats(responses['bdb_stats'], bdb_dict, service_check_tags)
                 self._shard_usage(bdb_dict, service_check_tags, host)
 
-                # collect the events from the API - we set the timeout higher here
-                self._get_events(host, port, username, password, bdb_dict, service_check_tags, event_limit)
+                # collect the events from the API
+                self._get_events(responses['events'], host, service_check_tags)
 
                 # if there are bdbs with crdt collect those stats
-                for j in [k for k, v in bdb_dict.items() if v['crdt']]:
-                    self._get_crdt_stats(host, port, j, bdb_dict, service_check_tags)
+                for bdb, response in crdt_responses.items():
+                    self._get_crdt_stats(response, bdb, bdb_dict, service_check_tags)
 
                 # update the timestamp if everything else passes
                 self.last_timestamp_seen = datetime.utcnow()
@@ -81,7 +186,7 @@ class RedisenterpriseCheck(AgentCheck):
                 # Only run the service check if we are master
                 self.service_check(
                     'redisenterprise.running',
-                    self._get_version(host, port, service_check_tags),
+                    self._get_version(responses['version']),
                     tags=service_check_tags,
                 )
 
@@ -93,52 +198,74 @@ class RedisenterpriseCheck(AgentCheck):
                 self.service_check('redisenterprise.running', self.CRITICAL, message=str(e), tags=service_check_tags)
                 raise CheckException(e)
 
-    def _check_not_follower(self, host, port, username, password, timeout, is_mock):
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests)
+            return self._executor
+
+    def cancel(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _fetch_all(self, requests):
+        """
+        Start fetching every (endpoint, params) of `requests`, at most `max_concurrent_requests`
+        at a time, and return the futures of their JSON responses under the same keys.
+        """
+        executor = self.get_executor()
+        return {
+            key: executor.submit(self._api_fetch_json, endpoint, None, params=params)
+            for key, (endpoint, params) in requests.items()
+        }
+
+    def _check_not_follower(self, host, port, timeout, is_mock):
         """The RedisEnterprise returns a 307 if a node is a cluster follower (not leader)"""
         if is_mock:
             return False
 
-        # We are using requests specifically because we do not want to follow redirects
-        r = requests.get(
+        # We do not want to follow redirects
+        r = self.http.get(
             f'https://{host}:{port}/v1/cluster',
-            auth=HTTPBasicAuth(username, password),
-            headers={'Content-Type': 'application/json'},
+            extra_headers={'Content-Type': 'application/json'},
             allow_redirects=False,
-            verify=False,
+            persist=True,
         )
 
         return r.status_code != 307
 
     def _api_fetch_json(self, endpoint, service_check_tags, params=None):
+        """Get a Python dictionary back from a Redis Enterprise endpoint"""
         host = self.instance.get('host')
-        port = self.instance.get('port')
-        """ Get a Python dictionary back from a Redis Enterprise endpoint """
+        port = self.instance.get('port', 9443)
         headers_sent = {'Content-Type': 'application/json'}
         url = f'https://{host}:{port}/v1/{endpoint}'
-        r = self.http.get(url, extra_headers=headers_sent, params=params)
+        r = self.http.get(url, extra_headers=headers_sent, params=params, persist=True)
         if r.status_code != 200:
             msg = "unexpected status of {0} when fetching stats, response: {1}"
             msg = msg.format(r.status_code, r.text)
             r.raise_for_status()
         return r.json()
 
-    def _get_fqdn(self, host, port, service_check_tags):
+    def _get_fqdn(self, response):
         """Get the cluster FQDN back from the endpoints"""
         try:
-            info = self._api_fetch_json("cluster", service_check_tags)
+            info = response.result()
             return fqdn if (fqdn := info.get('name')) else "unknown"
         except Exception:
             return "unknown"
 
-    def _get_version(self, host, port, service_check_tags):
-        info = self._api_fetch_json("bootstrap", service_check_tags)
+    def _get_version(self, response):
+        info = response.result()
         if version := info.get('local_node_info').get('software_version'):
             return self.OK
         return self.CRITICAL
 
-    def _get_bdb_dict(self, host, port, service_check_tags):
+    def _get_bdb_dict(self, response):
         bdb_dict = {}
-        bdbs = self._api_fetch_json("bdbs", service_check_tags)
+        bdbs = response.result()
         for i in bdbs:
 
             # collect the number of shards and multiply by 2 if replicated
@@ -160,22 +287,29 @@ class RedisenterpriseCheck(AgentCheck):
             }
         return bdb_dict
 
-    def _get_events(self, host, port, username, password, bdb_dict, service_check_tags, event_limit):
-        """Scrape the LOG endpoint and put all log entries into Datadog events"""
-
-        p = {
-            "stime": self.last_event_timestamp_seen.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "order": "desc",
-            "limit": event_limit,
+    def _get_event_start(self):
+        now = datetime.utcnow()
+        if self.event_cursor.timestamp is None:
+            self.event_cursor.restore(self.read_persistent_cache(self.EVENT_CURSOR_CACHE_KEY), now)
+        return self.event_cursor.start(now, self.event_limit)
+
+    def _get_events_params(self, stime):
+        return {
+            "stime": stime.strftime(TIMESTAMP_FORMAT),
+            "order": "asc",
+            "limit": self.event_limit,
         }
 
-        evnts = self._api_fetch_json("logs", service_check_tags, params=p)
+    def _get_events(self, response, host, service_check_tags):
+        """Scrape the LOG endpoint and put the log entries after the cursor into Datadog events"""
+
+        evnts = self.event_cursor.advance(response.result())
 
         for evnt in evnts:
             msg = {k: v for k, v in evnt.items() if k not in ['time', 'severity']}
             self.event(
                 {
-                    "timestamp": self._timestamp(datetime.strptime(evnt['time'], "%Y-%m-%dT%H:%M:%SZ")),
+                    "timestamp": self._timestamp(datetime.strptime(evnt['time'], TIMESTAMP_FORMAT)),
                     "event_type": EVENT_TYPE,
                     "msg_title": evnt['type'],
                     "msg_text": ", ".join(["=".join([key, str(val)]) for key, val in msg.items()]),
@@ -186,89 +320,35 @@ class RedisenterpriseCheck(AgentCheck):
                 }
             )
 
-            # Be sure to add 1 second to the last event so we don't pick it up again
-            ts = datetime.strptime(evnt['time'], "%Y-%m-%dT%H:%M:%SZ")
-            if ts > self.last_event_timestamp_seen:
-                self.last_event_timestamp_seen = ts + timedelta(0, 1)
-
-    def _get_crdt_stats(self, host, port, bdb, bdb_dict, service_check_tags):
-        """Collect CRDT stats from the BDB endpoint"""
-        crdt_stats = {
-            "egress_bytes": "crdt_egress_bytes",
-            "egress_bytes_decompressed": "crdt_egress_bytes_decompressed",
-            "ingress_bytes": "crdt_ingress_bytes",
-            "ingress_bytes_decompressed": "crdt_ingress_bytes_decompressed",
-            "local_ingress_lag_time": "crdt_local_lag",
-            "pending_local_writes_max": "crdt_pending_max",
-            "pending_local_writes_min": "crdt_pending_min",
-        }
+        if evnts:
+            self.write_persistent_cache(self.EVENT_CURSOR_CACHE_KEY, self.event_cursor.dumps())
 
-        params = {
-            "stime": self.last_event_timestamp_seen.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    def _get_crdt_params(self, stime):
+        return {
+            "stime": stime.strftime(TIMESTAMP_FORMAT),
             "interval": "10sec",
         }
-        peer_stats = self._api_fetch_json(
-            f'bdbs/{bdb}/peer_stats', service_check_tags, params=params
-        )
+
+    def _get_crdt_stats(self, response, bdb, bdb_dict, service_check_tags):
+        """Collect CRDT stats from the BDB endpoint"""
+        peer_stats = response.result()
+        tgs = [f"database:{bdb_dict[int(bdb)]['name']}"] + service_check_tags
         for z in peer_stats['peer_stats']:
-            tgs = [f"database:{bdb_dict[int(bdb)]['name']}"]
-            for k, v in crdt_stats.items():
+            for k, v in CRDT_STATS.items():
                 try:
                     self.gauge(
                         f'redis_enterprise.{v}',
                         z['intervals'][-1][k],
-                        tags=tgs
-                        + [f"crdt_peerid:{z.get('uid')}"]
-                        + service_check_tags,
+                        tags=tgs + [f"crdt_peerid:{z.get('uid')}"],
                     )
                 except Exception as e:
                     self.log.debug(str(e))
 
-    def _get_bdb_stats(self, host, port, bdb_dict, service_check_tags):
+    def _get_bdb_stats(self, response, bdb_dict, service_check_tags):
         """Collect Enterprise database related stats"""
-        gauges = [
-            'avg_latency',
-            'avg_latency_max',
-            'avg_other_latency',
-            'avg_read_latency',
-            'avg_write_latency',
-            'conns',
-            'egress_bytes',
-            'evicted_objects',
-            'expired_objects',
-            'fork_cpu_system',
-            'ingress_bytes',
-            'listener_acc_latency',
-            'main_thread_cpu_system',
-            'main_thread_cpu_system_max',
-            'memory_limit',
-            'no_of_keys',
-            'other_req',
-            'read_hits',
-            'read_misses',
-            'read_req',
-            'shard_cpu_system',
-            'shard_cpu_system_max',
-            'total_req',
-            'total_req_max',
-            'used_memory',
-            'write_hits',
-            'write_misses',
-            'write_req',
-            'bigstore_objs_ram',
-            'bigstore_objs_flash',
-            'bigstore_io_reads',
-            'bigstore_io_writes',
-            'bigstore_throughput',
-            'big_write_ram',
-            'big_write_flash',
-            'big_del_ram',
-            'big_del_flash',
-        ]
-
         # If there are no databases created the following link will 404, so we need to handle this
         try:
-            stats = self._api_fetch_json("bdbs/stats/last", service_check_tags)
+            stats = response.result()
         except Exception as e:
             if e.response.status_code != 404:
                 raise e
@@ -276,21 +356,21 @@ class RedisenterpriseCheck(AgentCheck):
             return 0
         self.gauge('redisenterprise.database_count', len(stats), tags=service_check_tags)
         for i in stats:
-            tgs = [f"database:{bdb_dict[int(i)]['name']}"]
+            tgs = [f"database:{bdb_dict[int(i)]['name']}"] + service_check_tags
             # add the stats only available from the bdb_dict
-            self.gauge('redisenterprise.endpoints', bdb_dict[int(i)]['endpoints'], tags=tgs + service_check_tags)
-            self.gauge('redisenterprise.memory_limit', bdb_dict[int(i)]['limit'], tags=tgs + service_check_tags)
+            self.gauge('redisenterprise.endpoints', bdb_dict[int(i)]['endpoints'], tags=tgs)
+            self.gauge('redisenterprise.memory_limit', bdb_dict[int(i)]['limit'], tags=tgs)
             # derive our own stats from others
             self.gauge(
                 'redisenterprise.used_memory_percent',
                 100 * stats[i]['used_memory'] / bdb_dict[int(i)]['limit'],
-                tags=tgs + service_check_tags,
+                tags=tgs,
             )
             # derive our cache hit rate - be sure not to divide by 0
             if (
                 stats[i]['read_hits'] + stats[i]['read_misses'] + stats[i]['write_hits'] + stats[i]['write_misses']
             ) == 0:
-                self.gauge('redisenterprise.cache_hit_rate', 0.0, tags=tgs + service_check_tags)
+                self.gauge('redisenterprise.cache_hit_rate', 0.0, tags=tgs)
             else:
                 self.gauge(
                     'redisenterprise.cache_hit_rate',
@@ -302,7 +382,7 @@ class RedisenterpriseCheck(AgentCheck):
                         + stats[i]['write_hits']
                         + stats[i]['write_misses']
                     ),
-                    tags=tgs + service_check_tags,
+                    tags=tgs,
                 )
             # derive flash object percentage being sure that the key exists and is not 0
             if 'bigstore_objs_flash' in stats[i].keys():
@@ -312,17 +392,16 @@ class RedisenterpriseCheck(AgentCheck):
                         100
                         * stats[i]['bigstore_objs_ram']
                         / (stats[i]['bigstore_objs_ram'] + stats[i]['bigstore_objs_flash']),
-                        tags=tgs + service_check_tags,
+                        tags=tgs,
                     )
 
-            for j in stats[i].keys():
-                if j in gauges:
-                    self.gauge(f'redisenterprise.{j}', stats[i][j], tags=tgs + service_check_tags)
+            for j in BDB_GAUGES.intersection(stats[i]):
+                self.gauge(f'redisenterprise.{j}', stats[i][j], tags=tgs)
         return 0
 
-    def _get_license(self, host, port, service_check_tags):
+    def _get_license(self, response, service_check_tags):
         """Collect Enterprise License Information"""
-        stats = self._api_fetch_json("license", service_check_tags)
+        stats = response.result()
         expire = datetime.strptime(stats['expiration_date'], "%Y-%m-%dT%H:%M:%SZ")
         now = datetime.now()
         self.gauge('redisenterprise.license_days', (expire - now).days, tags=service_check_tags)
@@ -341,9 +420,9 @@ class RedisenterpriseCheck(AgentCheck):
         used = sum(x['shards_used'] for x in bdb_dict.values())
         self.gauge('redisenterprise.total_shards_used', used, tags=service_check_tags)
 
-    def _get_nodes(self, host, port, service_check_tags):
+    def _get_nodes(self, response, service_check_tags):
         """Collect Enterprise Node Information"""
-        stats = self._api_fetch_json("nodes", service_check_tags)
+        stats = response.result()
         res = {'total_node_cores': 0, 'total_node_memory': 0, 'total_node_count': 0, 'total_active_nodes': 0}
 
         for i in stats:
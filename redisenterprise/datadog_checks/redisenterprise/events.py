@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timedelta
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class EventCursor(object):
+    """
+    Position of the check in the event log of the cluster.
+
+    The log is read in ascending order, one page at a time, starting at the
+    second of the last event submitted. The API only filters events by
+    second, so the cursor also counts the events of that second that were
+    already submitted and skips them on the next page.
+
+    The cursor never goes back further than `window` seconds. It is
+    serialized to the persistent cache of the Agent, so a restarted check
+    neither replays nor misses events. Without a saved cursor, collection
+    starts `lookback` seconds ago.
+    """
+
+    def __init__(self, window, lookback):
+        self.window = window
+        self.lookback = lookback
+        # Second the next page starts at, None until the cursor is restored
+        self.timestamp = None
+        # Number of events of that second that were already submitted
+        self.seen = 0
+
+    def restore(self, data, now):
+        """Restore the cursor serialized by `dumps`, or start a new one if there is none."""
+        try:
+            cursor = json.loads(data)
+            self.timestamp = datetime_from_timestamp(cursor['timestamp'])
+            self.seen = int(cursor['seen'])
+        except (ValueError, TypeError, KeyError):
+            self.timestamp = truncate(now - timedelta(seconds=self.lookback))
+            self.seen = 0
+
+    def dumps(self):
+        return json.dumps({'timestamp': self.timestamp.strftime(TIMESTAMP_FORMAT), 'seen': self.seen})
+
+    def start(self, now, limit):
+        """Return the second the next page of `limit` events starts at."""
+        oldest = truncate(now - timedelta(seconds=self.window))
+        if self.timestamp < oldest:
+            self.timestamp, self.seen = oldest, 0
+        elif self.seen >= limit:
+            # The events of this second don't fit in a page, the next page would never move past them
+            self.timestamp, self.seen = self.timestamp + timedelta(seconds=1), 0
+        return self.timestamp
+
+    def advance(self, events):
+        """
+        Return the events of the page requested from `start` that were not submitted yet,
+        and move the cursor after them. Events must be in ascending order.
+        """
+        timestamps = [datetime_from_timestamp(event['time']) for event in events]
+        skip = 0
+        while skip < self.seen and skip < len(timestamps) and timestamps[skip] == self.timestamp:
+            skip += 1
+
+        if len(timestamps) > skip:
+            last = timestamps[-1]
+            # The page started at the first event of its second, so it holds every event of `last` so far
+            self.seen = timestamps.count(last)
+            self.timestamp = last
+        return events[skip:]
+
+
+def datetime_from_timestamp(timestamp):
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+def truncate(date):
+    return date.replace(microsecond=0)
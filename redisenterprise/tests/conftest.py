@@ -1,5 +1,12 @@
+import bisect
+import datetime
+import json
 import os
+import ssl
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from time import sleep
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 import requests
@@ -91,3 +98,219 @@ def instance():
         'username': BOOTSTRAP['credentials']['username'],
         'password': BOOTSTRAP['credentials']['password'],
     }
+
+
+def make_event(time, event_type, severity='INFO'):
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'severity': severity, 'type': event_type}
+
+
+def write_certificate(directory):
+    """Write a self-signed certificate and its key for the fake cluster, like the one of the bootstrap."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+
+    key_path = str(directory / 'cluster.key')
+    cert_path = str(directory / 'cluster.pem')
+    with open(key_path, 'wb') as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+            )
+        )
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return cert_path, key_path
+
+
+class FakeCluster(object):
+    """
+    HTTPS server answering the RedisEnterprise API endpoints used by the check,
+    for `databases` databases of which the first `crdt` ones are CRDT databases.
+
+    Every request waits `latency` seconds. The requests, the connections and
+    the highest number of requests handled at the same time are counted.
+    The event log holds a single event logged a minute ago by default.
+    """
+
+    def __init__(self, databases=3, crdt=1, latency=0.0, follower=False):
+        self.databases = databases
+        self.crdt = crdt
+        self.latency = latency
+        self.follower = follower
+        self.set_events([make_event(datetime.datetime.utcnow() - datetime.timedelta(seconds=60), 'cluster_ok')])
+        self.requests = []
+        self.connections = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self, path):
+        with self._lock:
+            self.requests.append(path)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+            self.connections = 0
+            self.max_in_flight = 0
+
+    def set_events(self, events):
+        self.event_queries = []
+        self.events = sorted(events, key=lambda event: event['time'])
+        self._event_times = [event['time'] for event in self.events]
+
+    def get_events(self, query):
+        """Filter the event log like the API, timestamps sort like the dates they represent."""
+        self.event_queries.append({k: v[0] for k, v in query.items()})
+        events = self.events
+        if 'stime' in query:
+            events = events[bisect.bisect_left(self._event_times, query['stime'][0]) :]
+        if query.get('order', ['desc'])[0] == 'desc':
+            events = events[::-1]
+        if 'limit' in query:
+            events = events[: int(query['limit'][0])]
+        return events
+
+    def get(self, path, query):
+        """Return the status and the JSON document of an API path."""
+        if path == '/v1/cluster':
+            return (307, None) if self.follower else (200, {'name': 'demo.local'})
+        if path == '/v1/license':
+            return 200, {'expiration_date': '2100-01-01T00:00:00Z', 'expired': False, 'shards_limit': 4}
+        if path == '/v1/nodes':
+            return 200, [
+                {'cores': 4, 'total_memory': 8000000000, 'status': 'active'},
+                {'cores': 4, 'total_memory': 8000000000, 'status': 'down'},
+            ]
+        if path == '/v1/bootstrap':
+            return 200, {'local_node_info': {'software_version': '6.2.4-55'}}
+        if path == '/v1/bdbs':
+            return 200, [
+                {
+                    'uid': uid,
+                    'name': f'db{uid:03}',
+                    'memory_size': 100000000,
+                    'shards_count': 1,
+                    'replication': uid % 2 == 0,
+                    'crdt': uid <= self.crdt,
+                    'endpoints': [{'addr': ['10.0.0.1']}],
+                }
+                for uid in range(1, self.databases + 1)
+            ]
+        if path == '/v1/bdbs/stats/last':
+            if not self.databases:
+                return 404, {'error_code': 'bdb_not_found'}
+            return 200, {
+                str(uid): {
+                    'conns': uid,
+                    'used_memory': 1000000,
+                    'read_hits': 3,
+                    'read_misses': 1,
+                    'write_hits': 0,
+                    'write_misses': 0,
+                    'bigstore_objs_ram': 1,
+                    'bigstore_objs_flash': 1,
+                    'unknown_stat': 1,
+                }
+                for uid in range(1, self.databases + 1)
+            }
+        if path == '/v1/logs':
+            return 200, self.get_events(query)
+        if path.startswith('/v1/bdbs/') and path.endswith('/peer_stats'):
+            return 200, {
+                'peer_stats': [
+                    {'uid': peer, 'intervals': [{'ingress_bytes': 10, 'egress_bytes': 20, 'local_ingress_lag_time': 1}]}
+                    for peer in (1, 2)
+                ]
+            }
+        return 404, {'error_code': 'not_found'}
+
+    def serve(self, cert_path, key_path):
+        cluster = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                cluster._connected()
+                super(Handler, self).setup()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path
+                cluster._enter(path)
+                try:
+                    if cluster.latency:
+                        sleep(cluster.latency)
+                    status, document = cluster.get(path, parse_qs(url.query))
+                finally:
+                    cluster._exit()
+                body = json.dumps(document).encode('utf-8')
+                self.send_response(status)
+                if status == 307:
+                    self.send_header('Location', '/v1/cluster')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        server = ThreadingHTTPServer(('localhost', 0), Handler)
+        server.daemon_threads = True
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        return server
+
+
+@pytest.fixture
+def fake_cluster(tmp_path, datadog_agent):
+    cluster = FakeCluster()
+    server = cluster.serve(*write_certificate(tmp_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    cluster.port = server.server_address[1]
+    try:
+        yield cluster
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fake_cluster_instance(fake_cluster):
+    return {
+        'host': 'localhost',
+        'port': fake_cluster.port,
+        'username': BOOTSTRAP['credentials']['username'],
+        'password': BOOTSTRAP['credentials']['password'],
+        'tags': ['env_name:test'],
+    }
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from itertools import count
+
+import pytest
+
+from datadog_checks.redisenterprise import RedisenterpriseCheck
+
+from .conftest import make_event
+
+DATABASES = 300
+CRDT_DATABASES = 50
+# Round trip time of an API request
+LATENCY = 0.005
+# Events logged between two runs
+NEW_EVENTS = 50
+
+
+@pytest.mark.parametrize('max_concurrent_requests', [1, 8])
+def test_check(benchmark, aggregator, fake_cluster, fake_cluster_instance, max_concurrent_requests):
+    fake_cluster.databases = DATABASES
+    fake_cluster.crdt = CRDT_DATABASES
+    fake_cluster.latency = LATENCY
+    fake_cluster_instance['max_concurrent_requests'] = max_concurrent_requests
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+
+    def run():
+        aggregator.reset()
+        check.check(fake_cluster_instance)
+
+    try:
+        benchmark.pedantic(run, rounds=10, warmup_rounds=1)
+    finally:
+        check.cancel()
+
+    aggregator.assert_metric('redisenterprise.database_count', DATABASES)
+    aggregator.assert_metric('redis_enterprise.crdt_ingress_bytes', count=CRDT_DATABASES * 2)
+
+
+@pytest.mark.parametrize('logged_events', [1000, 100000])
+def test_events(benchmark, aggregator, fake_cluster, fake_cluster_instance, logged_events):
+    # The log already holds `logged_events` events of the last hour, the check only gets the new ones
+    now = datetime.utcnow()
+    events = [
+        make_event(now - timedelta(seconds=3600 * (logged_events - i) / logged_events), 'old')
+        for i in range(logged_events)
+    ]
+    fake_cluster.set_events(events)
+    fake_cluster_instance['event_limit'] = 1000
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    # Catch up with the events of the last two minutes
+    while True:
+        aggregator.reset()
+        check.check(fake_cluster_instance)
+        if not aggregator.events:
+            break
+    ids = count()
+
+    def setup():
+        aggregator.reset()
+        events.extend(make_event(datetime.utcnow(), f'new_{next(ids)}') for _ in range(NEW_EVENTS))
+        fake_cluster.set_events(events)
+
+    try:
+        benchmark.pedantic(check.check, args=(fake_cluster_instance,), setup=setup, rounds=20, warmup_rounds=1)
+    finally:
+        check.cancel()
+
+    # The last round got the events added by its setup, whatever the number of rounds that ran
+    created = next(ids)
+    new_events = [f'new_{i}' for i in range(created - NEW_EVENTS, created)]
+    assert [event['msg_title'] for event in aggregator.events] == new_events
@@ -1,9 +1,15 @@
+import json
+from datetime import datetime, timedelta
 from time import sleep
 
 import pytest
 
+from datadog_checks.base import ConfigurationError
+
 from datadog_checks.redisenterprise import RedisenterpriseCheck
 
+from .conftest import make_event
+
 # from datadog_checks.dev.utils import get_metadata_metrics
 
 
@@ -32,3 +38,190 @@ def test_version(aggregator, instance):
     aggregator.assert_metric('redisenterprise.total_node_count', 1.0)
     aggregator.assert_metric('redisenterprise.total_active_nodes', 1.0)
     assert len(aggregator._events) > 3
+
+
+@pytest.mark.unit
+def test_fake_cluster(aggregator, fake_cluster, fake_cluster_instance):
+    fake_cluster.databases = 5
+    fake_cluster.crdt = 2
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    check.check(fake_cluster_instance)
+    check.cancel()
+
+    tags = ['env_name:test', 'redis_cluster:demo.local']
+    aggregator.assert_service_check('redisenterprise.running', RedisenterpriseCheck.OK, tags=tags)
+    aggregator.assert_service_check('redisenterprise.license_status', RedisenterpriseCheck.OK, tags=tags)
+    aggregator.assert_metric('redisenterprise.database_count', 5, tags=tags)
+    aggregator.assert_metric('redisenterprise.total_shards_used', 7, tags=tags)
+    aggregator.assert_metric('redisenterprise.total_node_count', 2, tags=tags)
+    aggregator.assert_metric('redisenterprise.total_active_nodes', 1, tags=tags)
+    for uid in range(1, 6):
+        db_tags = [f'database:db{uid:03}'] + tags
+        aggregator.assert_metric('redisenterprise.conns', uid, tags=db_tags)
+        aggregator.assert_metric('redisenterprise.cache_hit_rate', 75, tags=db_tags)
+        aggregator.assert_metric('redisenterprise.bigstore_objs_percent', 50, tags=db_tags)
+        aggregator.assert_metric('redisenterprise.used_memory_percent', 1, tags=db_tags)
+    assert 'redisenterprise.unknown_stat' not in aggregator.metric_names
+    for uid in (1, 2):
+        for peer in (1, 2):
+            aggregator.assert_metric(
+                'redis_enterprise.crdt_ingress_bytes', 10, tags=[f'database:db{uid:03}', f'crdt_peerid:{peer}'] + tags
+            )
+    aggregator.assert_metric('redis_enterprise.crdt_ingress_bytes', count=4)
+    assert len(aggregator.events) == 1
+
+    assert sorted(fake_cluster.requests) == sorted(
+        [
+            '/v1/cluster',
+            '/v1/cluster',
+            '/v1/license',
+            '/v1/nodes',
+            '/v1/bdbs',
+            '/v1/bdbs/stats/last',
+            '/v1/logs',
+            '/v1/bootstrap',
+            '/v1/bdbs/1/peer_stats',
+            '/v1/bdbs/2/peer_stats',
+        ]
+    )
+
+
+@pytest.mark.unit
+def test_fake_cluster_no_database(aggregator, fake_cluster, fake_cluster_instance):
+    fake_cluster.databases = 0
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    check.check(fake_cluster_instance)
+    check.cancel()
+
+    aggregator.assert_metric('redisenterprise.database_count', 0)
+    aggregator.assert_service_check('redisenterprise.running', RedisenterpriseCheck.OK)
+
+
+@pytest.mark.unit
+def test_bounded_concurrency(aggregator, fake_cluster, fake_cluster_instance):
+    fake_cluster.databases = 40
+    fake_cluster.crdt = 30
+    fake_cluster.latency = 0.01
+    fake_cluster_instance['max_concurrent_requests'] = 4
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    check.check(fake_cluster_instance)
+    assert 1 < fake_cluster.max_in_flight <= 4
+    assert fake_cluster.connections <= 4
+
+    # The keep-alive connections are reused by the next runs
+    fake_cluster.reset()
+    check.check(fake_cluster_instance)
+    check.cancel()
+    assert len(fake_cluster.requests) == 38
+    assert fake_cluster.connections == 0
+    aggregator.assert_metric('redis_enterprise.crdt_ingress_bytes', count=120)
+
+
+@pytest.mark.unit
+def test_follower(aggregator, fake_cluster, fake_cluster_instance):
+    fake_cluster.follower = True
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    check.check(fake_cluster_instance)
+    check.cancel()
+
+    assert fake_cluster.requests == ['/v1/cluster']
+    assert not aggregator.metric_names
+    assert not aggregator.service_checks('redisenterprise.running')
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('max_concurrent_requests', [0, -1, 'many'])
+def test_invalid_max_concurrent_requests(fake_cluster_instance, max_concurrent_requests):
+    fake_cluster_instance['max_concurrent_requests'] = max_concurrent_requests
+    with pytest.raises(ConfigurationError):
+        RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+
+
+def collect_events(aggregator, check, instance, runs):
+    """Run the check and return the types of the events it submitted, in order."""
+    for _ in range(runs):
+        check.check(instance)
+    events = [event['msg_title'] for event in aggregator.events]
+    aggregator.reset()
+    return events
+
+
+@pytest.mark.unit
+def test_events_cursor_restart(aggregator, fake_cluster, fake_cluster_instance):
+    now = datetime.utcnow()
+    # 3 events per second over the last 100 seconds, the pages end in the middle of a second
+    recent = [make_event(now - timedelta(seconds=100 - i // 3), f'recent_{i:03}') for i in range(300)]
+    backlog = [make_event(now - timedelta(seconds=600), f'backlog_{i}') for i in range(50)]
+    fake_cluster.set_events(backlog + recent)
+    fake_cluster_instance['event_limit'] = 100
+
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    first = collect_events(aggregator, check, fake_cluster_instance, 2)
+    check.cancel()
+    assert len(first) == 199
+
+    # A restarted check resumes from the persistent cache
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    second = collect_events(aggregator, check, fake_cluster_instance, 3)
+    check.cancel()
+
+    assert first + second == [event['type'] for event in recent]
+    assert all(int(query['limit']) == 100 and query['order'] == 'asc' for query in fake_cluster.event_queries)
+
+
+@pytest.mark.unit
+def test_events_window(aggregator, fake_cluster, fake_cluster_instance, datadog_agent):
+    now = datetime.utcnow()
+    fake_cluster.set_events([make_event(now - timedelta(seconds=s), f'event_{s}') for s in (7200, 1200, 300)])
+    fake_cluster_instance['event_window'] = 600
+
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    check.write_persistent_cache(
+        check.EVENT_CURSOR_CACHE_KEY, json.dumps({'timestamp': '2020-01-01T00:00:00Z', 'seen': 0})
+    )
+    assert collect_events(aggregator, check, fake_cluster_instance, 1) == ['event_300']
+    check.cancel()
+    stime = datetime.strptime(fake_cluster.event_queries[0]['stime'], '%Y-%m-%dT%H:%M:%SZ')
+    assert now - timedelta(seconds=601) <= stime <= now - timedelta(seconds=599)
+
+
+@pytest.mark.unit
+def test_events_no_backlog(aggregator, fake_cluster, fake_cluster_instance):
+    now = datetime.utcnow()
+    fake_cluster.set_events([make_event(now - timedelta(seconds=s), f'event_{s}') for s in (3000, 600, 60)])
+
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    assert collect_events(aggregator, check, fake_cluster_instance, 1) == ['event_60']
+    assert collect_events(aggregator, check, fake_cluster_instance, 1) == []
+    check.cancel()
+
+
+@pytest.mark.unit
+def test_events_second_larger_than_page(aggregator, fake_cluster, fake_cluster_instance):
+    now = datetime.utcnow()
+    fake_cluster.set_events(
+        [make_event(now - timedelta(seconds=30), f'event_{i}') for i in range(3)]
+        + [make_event(now - timedelta(seconds=20), 'event_3')]
+    )
+    fake_cluster_instance['event_limit'] = 2
+
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    # The third event of the second can't be reached, the cursor moves past it
+    assert collect_events(aggregator, check, fake_cluster_instance, 3) == ['event_0', 'event_1', 'event_3']
+    check.cancel()
+
+
+@pytest.mark.unit
+def test_event_limit_capped(fake_cluster_instance):
+    fake_cluster_instance['event_limit'] = 100000
+    check = RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
+    assert check.event_limit == RedisenterpriseCheck.MAX_EVENT_LIMIT
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('option', ['event_limit', 'event_window'])
+@pytest.mark.parametrize('value', [0, -1, 'many'])
+def test_invalid_event_options(fake_cluster_instance, option, value):
+    fake_cluster_instance[option] = value
+    with pytest.raises(ConfigurationError):
+        RedisenterpriseCheck('redisenterprise', {}, [fake_cluster_instance])
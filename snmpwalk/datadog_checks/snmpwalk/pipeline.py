@@ -0,0 +1,127 @@
+import re
+import time
+from collections import namedtuple
+
+TagSpec = namedtuple('TagSpec', ['tag', 'column', 'regex', 'additional_tags'])
+MetricSpec = namedtuple('MetricSpec', ['tags', 'symbols'])
+
+
+def convert_integer(value):
+    # enums are reported with their human readable name, e.g. up(1)
+    if value.endswith(')'):
+        value = value[value.rindex('(') + 1 : -1]
+    return int(value)
+
+
+COUNTER_TYPES = frozenset(('Counter32', 'Counter64', 'ZeroBasedCounter64'))
+GAUGE_TYPES = frozenset(('Gauge32', 'Unsigned32', 'CounterBasedGauge64', 'INTEGER', 'Integer32'))
+
+# symbol type -> (submission method, value converter)
+SUBMITTERS = dict.fromkeys(COUNTER_TYPES, ('rate', int))
+SUBMITTERS.update(dict.fromkeys(GAUGE_TYPES, ('gauge', int)))
+SUBMITTERS['INTEGER'] = ('gauge', convert_integer)
+
+
+def render_tag_value(value, typ):
+    if typ == 'INTEGER':
+        # enum/bool etc, use the human readable name
+        return value.split('(')[0]
+    return value
+
+
+class MetricPipeline(object):
+    """
+    The metrics of an instance, compiled once from its configuration.
+
+    Tag regexes are compiled and metric names rendered up front. The
+    tags of every index, the static ones included, are built from the
+    walked tag columns and cached as tuples. The cache is rebuilt at
+    most every `tag_refresh_interval` seconds, or as soon as a value
+    is walked for an index it doesn't know.
+    """
+
+    def __init__(self, namespace, metrics, static_tags, tag_refresh_interval, log, time_func=time.monotonic):
+        self.namespace = namespace
+        self.static_tags = tuple(static_tags)
+        self.tag_refresh_interval = tag_refresh_interval
+        self.log = log
+        self._time = time_func
+
+        self.metrics = [self._compile(metric) for metric in metrics]
+        # metric position -> index -> tags
+        self._index_tags = [None] * len(self.metrics)
+        self._next_refresh = 0
+
+    def _compile(self, metric):
+        tags = []
+        for metric_tag in metric.get('metric_tags', []):
+            if 'column' not in metric_tag:
+                self.log.debug('unsupported metric_tag: %s', metric_tag)
+                continue
+            regex = metric_tag.get('regex')
+            tags.append(
+                TagSpec(
+                    metric_tag['tag'],
+                    metric_tag['column'],
+                    re.compile(regex) if regex is not None else None,
+                    tuple(metric_tag.get('additional_tags', [])),
+                )
+            )
+        symbols = tuple((symbol, f'{self.namespace}.{symbol}') for symbol in metric.get('symbols', []))
+        return MetricSpec(tuple(tags), symbols)
+
+    def get_samples(self, data, types):
+        """
+        Yield the (method, metric name, converter, values, index tags) of every symbol
+        to submit, `values` and `index tags` map the walked indexes to their raw value
+        and their tags.
+        """
+        now = self._time()
+        if now >= self._next_refresh:
+            self._index_tags = [None] * len(self.metrics)
+            self._next_refresh = now + self.tag_refresh_interval
+
+        for position, metric in enumerate(self.metrics):
+            index_tags = self._index_tags[position]
+            for symbol, key in metric.symbols:
+                values = data.get(symbol)
+                if not values:
+                    continue
+                typ = types[symbol]
+                if typ not in SUBMITTERS:
+                    raise Exception(f'unsupported metric symbol type: {typ}')
+                if index_tags is None or not index_tags.keys() >= values.keys():
+                    index_tags = self._index_tags[position] = self._build_index_tags(metric, data, types)
+                method, converter = SUBMITTERS[typ]
+                yield method, key, converter, values, index_tags
+
+    def _build_index_tags(self, metric, data, types):
+        dynamic_tags = {}
+        for spec in metric.tags:
+            column = data.get(spec.column)
+            if not column:
+                continue
+            typ = types[spec.column]
+            for index, value in column.items():
+                if value is None:
+                    # No value for the column, ignore
+                    continue
+                value = render_tag_value(value, typ)
+                if spec.regex is None:
+                    # This is a standard tag, just use the value
+                    dynamic_tags.setdefault(index, []).append(f'{spec.tag}:{value}')
+                    continue
+                # There's a regex for this tag, group(1) becomes the value when it matches
+                match = spec.regex.match(value)
+                if match is not None:
+                    index_tags = dynamic_tags.setdefault(index, [])
+                    index_tags.append(f'{spec.tag}:{match.group(1)}')
+                    index_tags.extend(spec.additional_tags)
+
+        index_tags = {index: self.static_tags + tuple(tags) for index, tags in dynamic_tags.items()}
+        # Indexes without any dynamic tag only get the static ones
+        for symbol, _ in metric.symbols:
+            for index in data.get(symbol, ()):
+                if index not in index_tags:
+                    index_tags[index] = self.static_tags
+        return index_tags
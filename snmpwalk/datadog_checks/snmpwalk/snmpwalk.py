@@ -1,17 +1,49 @@
 import os
 import re
+import subprocess
+import tempfile
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from datadog_checks.base import ConfigurationError
 from datadog_checks.base.checks import NetworkCheck, Status
-from datadog_checks.base.utils.subprocess_output import get_subprocess_output
+
+from .pipeline import COUNTER_TYPES, GAUGE_TYPES, MetricPipeline
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'snmpwalk'
 
+# Tables can be given as a numeric OID, e.g. 1.3.6.1.2.1.2.2
+NUMERIC_OID_RE = re.compile(r'^\.?\d+(\.\d+)*$')
+
 
 class BinaryUnavailable(Exception):
     pass
 
 
+def get_walk_roots(metrics):
+    """
+    Return the roots to walk for the configured tables, in order.
+
+    A table configured for several metrics is walked once, and a table
+    given as a numeric OID is not walked when another configured OID
+    contains it.
+    """
+    roots = []
+    for metric in metrics:
+        table = metric['table']
+        if NUMERIC_OID_RE.match(table):
+            root = '.' + table.lstrip('.')
+        else:
+            root = f"{metric['MIB']}:{table}"
+        if root not in roots:
+            roots.append(root)
+
+    oids = [root for root in roots if root.startswith('.')]
+    return [root for root in roots if not any(root.startswith(oid + '.') for oid in oids)]
+
+
 class SnmpwalkCheck(NetworkCheck):
     """
     This is a work-alike for checks.d/snmp.py that makes use of snmpwalk for
@@ -26,8 +58,10 @@ class SnmpwalkCheck(NetworkCheck):
     DEFAULT_SNMPWALK_PATH = '/usr/bin/snmpwalk'
     DEFAULT_RETRIES = 2
     DEFAULT_TIMEOUT = 1
-    COUNTER_TYPES = frozenset(('Counter32', 'Counter64', 'ZeroBasedCounter64'))
-    GAUGE_TYPES = frozenset(('Gauge32', 'Unsigned32', 'CounterBasedGauge64', 'INTEGER', 'Integer32'))
+    DEFAULT_MAX_WORKERS = 4
+    DEFAULT_TAG_REFRESH_INTERVAL = 0
+    COUNTER_TYPES = COUNTER_TYPES
+    GAUGE_TYPES = GAUGE_TYPES
     SC_NAME = '{}.can_check'.format(SOURCE_TYPE_NAME)
 
     # regex for parsing the output of snmp walk
@@ -41,6 +75,15 @@ class SnmpwalkCheck(NetworkCheck):
 
         self.mib_dirs = init_config.get('mibs_folder')
 
+        # The tables are walked concurrently by a pool kept across runs
+        self.max_workers = init_config.get('max_workers', self.DEFAULT_MAX_WORKERS)
+        if not isinstance(self.max_workers, int) or self.max_workers < 1:
+            raise ConfigurationError('max_workers must be a positive integer')
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # instance name -> MetricPipeline
+        self._pipelines = {}
+
         if instances is not None:
             for instance in instances:
                 # if we don't have a name add one, but mark skip_event so that we
@@ -51,6 +94,9 @@ class SnmpwalkCheck(NetworkCheck):
 
         super(SnmpwalkCheck, self).__init__(name, init_config, instances)
 
+        for instance in instances or ():
+            self.get_pipeline(instance)
+
     def _get_instance_addr(self, instance):
         host = instance.get('host', None)
         ip = instance.get('ip_address', None)
@@ -77,57 +123,48 @@ class SnmpwalkCheck(NetworkCheck):
         retries = int(instance.get('retries', self.DEFAULT_RETRIES))
 
         hostname = instance.get('metric_host', None)
+        walk_stats = instance.get('walk_stats', False)
+
+        cmd = [
+            self.binary,
+            f'-c{community_string}',
+            '-v2c',
+            '-t',
+            str(timeout),
+            '-r',
+            str(retries),
+        ]
+        if self.mib_dirs:
+            cmd.extend(['-M', self.mib_dirs])
+        cmd.append(ip_address)
 
         # Build up our dataset
         data = defaultdict(dict)
         types = {}
-        for metric in metrics:
-            mib = metric['MIB']
-            table = metric['table']
-            cmd = [
-                self.binary,
-                f'-c{community_string}',
-                '-v2c',
-                '-t',
-                str(timeout),
-                '-r',
-                str(retries),
-            ]
-            if self.mib_dirs:
-                cmd.extend(['-M', self.mib_dirs])
-            cmd.extend([ip_address, f'{mib}:{table}'])
-
+        executor = self.get_executor()
+        futures = [(root, executor.submit(self.walk, cmd + [root])) for root in get_walk_roots(metrics)]
+        walks = []
+        for root, future in futures:
             try:
-                output = get_subprocess_output(cmd, self.log)[0]
+                rows, duration = future.result()
             except Exception as e:
+                for _, pending in futures:
+                    pending.cancel()
                 error = "Fail to collect metrics for {0} - {1}".format(instance['name'], e)
                 self.log.warning(error)
                 return [(self.SC_NAME, Status.CRITICAL, error)]
 
-            for line in output.splitlines():
-                if not line:
-                    continue
-                match = self.output_re.match(line)
-                if match is not None:
-                    symbol = match.group('symbol')
-                    index = int(match.group('index'))
-                    value = match.group('value')
-                    typ = match.group('type')
-                    types[symbol] = typ
-                    if typ == 'INTEGER':
-                        try:
-                            value = int(value)
-                        except ValueError:
-                            pass
-                    elif value == '':
-                        value = None
-                    data[symbol][index] = value
-                else:
-                    # TODO: remove this
-                    self.log.warning('Problem parsing output of snmp walk: %s', line)
-
-        # Get any base configured tags and add our primary tag
-        tags = instance.get('tags', []) + [f'snmp_device:{ip_address}']
+            for symbol, index, typ, value in rows:
+                types[symbol] = typ
+                data[symbol][index] = value
+            walks.append((root, len(rows), duration))
+
+        pipeline = self.get_pipeline(instance)
+        if walk_stats:
+            for root, row_count, duration in walks:
+                walk_tags = pipeline.static_tags + (f'walk_root:{root}',)
+                self.gauge(f'{SOURCE_TYPE_NAME}.walk.duration', duration, walk_tags, hostname=hostname)
+                self.gauge(f'{SOURCE_TYPE_NAME}.walk.rows', row_count, walk_tags, hostname=hostname)
 
         # It seems kind of weird, but from what I can tell the snmp check allows
         # you to add symbols to a metric that were retrieved by another metric,
@@ -138,65 +175,84 @@ class SnmpwalkCheck(NetworkCheck):
         # well.
 
         # Time to emit metrics
-        for metric in metrics:
-
-            # Build a list of dynamic tags per-index
-            dynamic_tags = defaultdict(list)
-            for metric_tag in metric.get('metric_tags', []):
-                if 'column' in metric_tag:
-                    tag = metric_tag['tag']
-                    column = metric_tag['column']
-                    regex = metric_tag.get('regex', None)
-                    if regex is not None:
-                        # pre-compile our regex
-                        regex = re.compile(regex)
-                    for i, v in data[column].items():
-                        if v is None:
-                            # No value for the column, ignore
-                            continue
-                        elif types[column] == 'INTEGER':
-                            # enum/bool etc, use the human readable name
-                            v = v.split('(')[0]
-
-                        if regex is not None:
-                            # There's a regex for this tag
-                            match = regex.match(v)
-                            if match is not None:
-                                # It matches so we'll apply it, group(1) becomes
-                                # the value
-                                v = match.group(1)
-                                dynamic_tags[i].append(f'{tag}:{v}')
-                                additional_tags = metric_tag.get('additional_tags', [])
-                                # and we add any additional tags
-                                dynamic_tags[i].extend(additional_tags)
-                        else:
-                            # This is a standard tag, just use the value
-                            dynamic_tags[i].append(f'{tag}:{v}')
-                else:
-                    self.log.debug('unsupported metric_tag: %s', metric_tag)
+        self.submit_metrics(pipeline, data, types, hostname)
+
+        return [(self.SC_NAME, Status.UP, None)]
+
+    def submit_metrics(self, pipeline, data, types, hostname=None):
+        for method, key, converter, values, index_tags in pipeline.get_samples(data, types):
+            submit = getattr(self, method)
+            for i, value in values.items():
+                if value is None:
+                    # skip empty
                     continue
+                submit(key, converter(value), index_tags[i], hostname=hostname)
+
+    def get_pipeline(self, instance):
+        pipeline = self._pipelines.get(instance['name'])
+        if pipeline is None:
+            tag_refresh_interval = instance.get('tag_refresh_interval', self.DEFAULT_TAG_REFRESH_INTERVAL)
+            if not isinstance(tag_refresh_interval, (int, float)) or tag_refresh_interval < 0:
+                raise ConfigurationError('tag_refresh_interval must be a non-negative number of seconds')
+
+            # Get any base configured tags and add our primary tag
+            tags = instance.get('tags', []) + [f'snmp_device:{self._get_instance_addr(instance)}']
+            metrics = instance.get('metrics', [])
+            pipeline = MetricPipeline(SOURCE_TYPE_NAME, metrics, tags, tag_refresh_interval, self.log)
+            self._pipelines[instance['name']] = pipeline
+        return pipeline
+
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
 
-            symbols = metric.get('symbols', [])
-            # For each of the symbols we'll be recording as a metric
-            for symbol in symbols:
-                # For each value for that symbol
-                for i, value in data[symbol].items():
-                    if value is None:
-                        # skip empty
+    def cancel(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def walk(self, cmd):
+        """
+        Run snmpwalk and parse its output line by line as it is produced.
+
+        Returns the parsed (symbol, index, type, value) rows and the
+        duration of the walk in seconds.
+        """
+        start = time.monotonic()
+        rows = []
+        lines = 0
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True)
+            with process.stdout:
+                for line in process.stdout:
+                    line = line.rstrip('\n')
+                    if not line:
                         continue
-                    # metric key
-                    key = f'{SOURCE_TYPE_NAME}.{symbol}'
-                    value = int(value)
-
-                    typ = types[symbol]
-                    if typ in self.COUNTER_TYPES:
-                        self.rate(key, value, tags + dynamic_tags[i], hostname=hostname)
-                    elif typ in self.GAUGE_TYPES:
-                        self.gauge(key, value, tags + dynamic_tags[i], hostname=hostname)
-                    else:
-                        raise Exception(f'unsupported metric symbol type: {typ}')
+                    lines += 1
+                    row = self.parse_line(line)
+                    if row is not None:
+                        rows.append(row)
+            process.wait()
 
-        return [(self.SC_NAME, Status.UP, None)]
+            if not lines:
+                stderr.seek(0)
+                err = stderr.read().decode('utf-8', 'replace').strip()
+                raise Exception(f'snmpwalk returned no output (exit code {process.returncode}): {err}')
+
+        return rows, time.monotonic() - start
+
+    def parse_line(self, line):
+        match = self.output_re.match(line)
+        if match is None:
+            # TODO: remove this
+            self.log.warning('Problem parsing output of snmp walk: %s', line)
+            return None
+
+        # values are converted according to their type when they are submitted
+        return match.group('symbol'), int(match.group('index')), match.group('type'), match.group('value') or None
 
     def report_as_service_check(self, sc_name, status, instance, msg=None):
         sc_tags = ['snmp_device:{0}'.format(instance['name'])]
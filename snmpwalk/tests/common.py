@@ -2,3 +2,36 @@ import os
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 DOCKER_DIR = os.path.join(HERE, 'docker')
+
+IF_TABLE = {
+    'mib': 'IF-MIB',
+    'rows': 4,
+    'columns': [['ifDescr', 'STRING'], ['ifInOctets', 'Counter32'], ['ifOutOctets', 'Counter32']],
+}
+IP_TABLE = {
+    'mib': 'IP-MIB',
+    'rows': 2,
+    'columns': [['ipSystemStatsInReceives', 'Counter64'], ['ipSystemStatsIPVersion', 'INTEGER']],
+}
+FAKE_TABLES = {'IF-MIB:ifTable': IF_TABLE, 'IP-MIB:ipSystemStatsTable': IP_TABLE}
+
+
+def make_fake_tables(table_count, rows, columns=4):
+    """Return `table_count` fake tables with a description column and `columns` counter columns."""
+    tables = {}
+    for t in range(table_count):
+        symbols = [[f'fake{t}Descr', 'STRING']] + [[f'fake{t}Counter{c}', 'Counter64'] for c in range(columns)]
+        tables[f'FAKE-MIB:fake{t}Table'] = {'mib': 'FAKE-MIB', 'rows': rows, 'columns': symbols}
+    return tables
+
+
+def make_fake_metrics(tables):
+    return [
+        {
+            'MIB': table['mib'],
+            'table': root.split(':', 1)[1],
+            'symbols': [symbol for symbol, typ in table['columns'] if typ != 'STRING'],
+            'metric_tags': [{'tag': 'name', 'column': table['columns'][0][0]}],
+        }
+        for root, table in tables.items()
+    ]
@@ -1,4 +1,6 @@
+import json
 import os
+import sys
 
 import pytest
 
@@ -11,3 +13,55 @@ from .common import DOCKER_DIR
 def dd_environment():
     with docker_run(os.path.join(DOCKER_DIR, 'docker-compose.yml')):
         yield {'ip_address': 'localhost', 'port': 161, 'community_string': 'public'}
+
+
+FAKE_SNMPWALK = """#!{python}
+import json
+import sys
+import time
+
+with open({spec!r}) as f:
+    spec = json.load(f)
+with open({calls!r}, 'a') as f:
+    f.write(sys.argv[-1] + '\\n')
+
+time.sleep(spec['latency'])
+table = spec['tables'].get(sys.argv[-1])
+if table is None:
+    sys.stderr.write(sys.argv[-1] + ': Unknown Object Identifier\\n')
+    sys.exit(1)
+
+mib = table['mib']
+out = sys.stdout
+for symbol, typ in table['columns']:
+    for index in range(1, table['rows'] + 1):
+        if typ == 'STRING':
+            value = '{{}}{{}}'.format(symbol, index)
+        elif typ == 'INTEGER':
+            value = 'up({{}})'.format(1 + index % 2)
+        else:
+            value = str(index * 10)
+        out.write('{{}}::{{}}.{{}} = {{}}: {{}}\\n'.format(mib, symbol, index, typ, value))
+"""
+
+
+@pytest.fixture
+def fake_snmpwalk(tmp_path):
+    """
+    Write a fake snmpwalk executable, yields a factory taking the tables it serves and the
+    latency of every walk. Tables map a walk root to its MIB, rows and (symbol, type) columns.
+    The factory returns the path of the executable and a function returning the walked roots.
+    """
+
+    def create(tables, latency=0.0):
+        spec = tmp_path / 'spec.json'
+        calls = tmp_path / 'calls.txt'
+        spec.write_text(json.dumps({'tables': tables, 'latency': latency}))
+        calls.write_text('')
+
+        script = tmp_path / 'snmpwalk'
+        script.write_text(FAKE_SNMPWALK.format(python=sys.executable, spec=str(spec), calls=str(calls)))
+        script.chmod(0o755)
+        return str(script), lambda: calls.read_text().split()
+
+    return create
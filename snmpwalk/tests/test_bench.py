@@ -0,0 +1,131 @@
+import re
+from collections import Counter, defaultdict
+
+import pytest
+
+from datadog_checks.snmpwalk import SnmpwalkCheck
+from datadog_checks.snmpwalk.pipeline import convert_integer
+
+from .common import make_fake_metrics, make_fake_tables
+
+TABLES = 8
+ROWS = 500
+LATENCY = 0.1
+
+
+@pytest.mark.parametrize('max_workers', [1, 8], ids=['sequential', 'concurrent'])
+def test_run(benchmark, aggregator, fake_snmpwalk, max_workers):
+    tables = make_fake_tables(TABLES, rows=ROWS)
+    binary, walked = fake_snmpwalk(tables, latency=LATENCY)
+    instance = {'ip_address': 'localhost', 'name': 'localhost', 'metrics': make_fake_metrics(tables)}
+    check = SnmpwalkCheck('snmpwalk', {'binary': binary, 'max_workers': max_workers}, {})
+
+    def run():
+        aggregator.reset()
+        check.check(instance)
+
+    benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    check.cancel()
+
+    benchmark.extra_info['walks'] = len(walked())
+    aggregator.assert_service_check('snmpwalk.can_check', status=SnmpwalkCheck.OK)
+    assert len(aggregator.metrics('snmpwalk.fake0Counter0')) == ROWS
+
+
+INTERFACES = 20000
+IF_METRICS = [
+    {
+        'MIB': 'IF-MIB',
+        'table': 'ifTable',
+        'symbols': ['ifInOctets', 'ifOutOctets', 'ifOperStatus'],
+        'metric_tags': [
+            {'tag': 'interface', 'column': 'ifDescr'},
+            {'tag': 'port', 'column': 'ifDescr', 'regex': r'eth(\d+)', 'additional_tags': ['kind:ethernet']},
+        ],
+    }
+]
+
+
+@pytest.fixture(scope='module')
+def walk_lines():
+    """snmpwalk output of an ifTable with 100k rows."""
+    lines = []
+    for column, typ, render in (
+        ('ifDescr', 'STRING', lambda i: f'eth{i}'),
+        ('ifInOctets', 'Counter64', lambda i: str(i * 1000)),
+        ('ifOutOctets', 'Counter64', lambda i: str(i * 2000)),
+        ('ifOperStatus', 'INTEGER', lambda i: f'up({1 + i % 2})'),
+        ('ifSpeed', 'Gauge32', lambda i: '1000000000'),
+    ):
+        lines.extend(f'IF-MIB::{column}.{i} = {typ}: {render(i)}' for i in range(1, INTERFACES + 1))
+    assert len(lines) == 100000
+    return lines
+
+
+def parse(check, lines):
+    data = defaultdict(dict)
+    types = {}
+    for line in lines:
+        symbol, index, typ, value = check.parse_line(line)
+        types[symbol] = typ
+        data[symbol][index] = value
+    return data, types
+
+
+def legacy_submit(check, metrics, data, types, tags):
+    # Tag building and submission as done before the metric pipeline
+    for metric in metrics:
+        dynamic_tags = defaultdict(list)
+        for metric_tag in metric.get('metric_tags', []):
+            tag = metric_tag['tag']
+            column = metric_tag['column']
+            regex = metric_tag.get('regex', None)
+            if regex is not None:
+                regex = re.compile(regex)
+            for i, v in data[column].items():
+                if v is None:
+                    continue
+                elif types[column] == 'INTEGER':
+                    v = v.split('(')[0]
+                if regex is not None:
+                    match = regex.match(v)
+                    if match is not None:
+                        dynamic_tags[i].append(f'{tag}:{match.group(1)}')
+                        dynamic_tags[i].extend(metric_tag.get('additional_tags', []))
+                else:
+                    dynamic_tags[i].append(f'{tag}:{v}')
+        for symbol in metric.get('symbols', []):
+            for i, value in data[symbol].items():
+                if value is None:
+                    continue
+                key = f'snmpwalk.{symbol}'
+                value = convert_integer(value) if types[symbol] == 'INTEGER' else int(value)
+                if types[symbol] in SnmpwalkCheck.COUNTER_TYPES:
+                    check.rate(key, value, tags + dynamic_tags[i])
+                else:
+                    check.gauge(key, value, tags + dynamic_tags[i])
+
+
+def test_parse_walk(benchmark, walk_lines):
+    check = SnmpwalkCheck('snmpwalk', {}, {})
+    data, types = benchmark(parse, check, walk_lines)
+    assert len(data['ifSpeed']) == INTERFACES
+
+
+@pytest.mark.parametrize('method', ['legacy', 'pipeline', 'cached_tags'])
+def test_submit_metrics(benchmark, walk_lines, method):
+    instance = {'ip_address': 'localhost', 'name': 'localhost', 'metrics': IF_METRICS}
+    if method == 'cached_tags':
+        instance['tag_refresh_interval'] = 300
+    check = SnmpwalkCheck('snmpwalk', {}, [instance])
+    data, types = parse(check, walk_lines)
+
+    # Measure the pipeline rather than the aggregator
+    submitted = Counter()
+    check.rate = check.gauge = lambda name, value, tags, hostname=None: submitted.update((name,))
+
+    if method == 'legacy':
+        benchmark(legacy_submit, check, IF_METRICS, data, types, ['snmp_device:localhost'])
+    else:
+        benchmark(check.submit_metrics, check.get_pipeline(instance), data, types)
+    assert set(submitted.values()) == {submitted['snmpwalk.ifInOctets']}
@@ -3,10 +3,17 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 import os
+import time
+from unittest import mock
 
+import pytest
+
+from datadog_checks.base import ConfigurationError
 from datadog_checks.snmpwalk import SnmpwalkCheck
+from datadog_checks.snmpwalk.pipeline import MetricPipeline
+from datadog_checks.snmpwalk.snmpwalk import get_walk_roots
 
-from .common import HERE
+from .common import FAKE_TABLES, HERE, make_fake_metrics, make_fake_tables
 
 RESULTS_TIMEOUT = 10
 
@@ -74,3 +81,181 @@ def test_unavailable_binary(caplog):
     check.check(instance)
 
     assert 'Cannot find executable: /path/to/nonexistent/snmpwalk' in caplog.text
+
+
+def make_instance(metrics, **options):
+    instance = {'ip_address': 'localhost', 'port': 161, 'name': 'localhost', 'metrics': metrics}
+    instance.update(options)
+    return instance
+
+
+def test_get_walk_roots():
+    metrics = [
+        {'MIB': 'IF-MIB', 'table': 'ifTable'},
+        {'MIB': 'IF-MIB', 'table': 'ifTable'},
+        {'MIB': 'IF-MIB', 'table': 'ifXTable'},
+        {'MIB': 'IF-MIB', 'table': '1.3.6.1.2.1.2.2'},
+        {'MIB': 'IF-MIB', 'table': '.1.3.6.1.2.1.2'},
+        {'MIB': 'IF-MIB', 'table': '1.3.6.1.2.1.25'},
+    ]
+    assert get_walk_roots(metrics) == ['IF-MIB:ifTable', 'IF-MIB:ifXTable', '.1.3.6.1.2.1.2', '.1.3.6.1.2.1.25']
+
+
+def test_invalid_max_workers():
+    with pytest.raises(ConfigurationError):
+        SnmpwalkCheck(CHECK_NAME, {'max_workers': 0}, {})
+
+
+def test_walk(aggregator, fake_snmpwalk):
+    binary, walked = fake_snmpwalk(FAKE_TABLES)
+    metrics = [
+        {
+            'MIB': 'IF-MIB',
+            'table': 'ifTable',
+            'symbols': ['ifInOctets'],
+            'metric_tags': [{'tag': 'interface', 'column': 'ifDescr'}],
+        },
+        {'MIB': 'IF-MIB', 'table': 'ifTable', 'symbols': ['ifOutOctets']},
+        {
+            'MIB': 'IP-MIB',
+            'table': 'ipSystemStatsTable',
+            'symbols': ['ipSystemStatsInReceives'],
+            'metric_tags': [{'tag': 'ipversion', 'column': 'ipSystemStatsIPVersion'}],
+        },
+    ]
+    instance = make_instance(metrics, tags=['site:test'])
+    check = SnmpwalkCheck(CHECK_NAME, {'binary': binary}, {})
+    check.check(instance)
+    check.check(instance)
+
+    # The shared table is walked once per run
+    assert sorted(walked()) == ['IF-MIB:ifTable'] * 2 + ['IP-MIB:ipSystemStatsTable'] * 2
+    base_tags = ['site:test', 'snmp_device:localhost:161']
+    for index in range(1, 5):
+        aggregator.assert_metric('snmpwalk.ifInOctets', tags=base_tags + [f'interface:ifDescr{index}'], count=2)
+        aggregator.assert_metric('snmpwalk.ifOutOctets', tags=base_tags, at_least=1)
+    aggregator.assert_metric('snmpwalk.ipSystemStatsInReceives', tags=base_tags + ['ipversion:up'], count=4)
+    aggregator.assert_service_check('snmpwalk.can_check', status=SnmpwalkCheck.OK, count=2)
+    aggregator.assert_all_metrics_covered()
+
+
+def test_walk_stats(aggregator, fake_snmpwalk):
+    binary, _ = fake_snmpwalk(FAKE_TABLES)
+    metrics = [{'MIB': 'IF-MIB', 'table': 'ifTable', 'symbols': ['ifInOctets']}]
+    instance = make_instance(metrics, walk_stats=True)
+    check = SnmpwalkCheck(CHECK_NAME, {'binary': binary}, {})
+    check.check(instance)
+
+    tags = ['snmp_device:localhost:161', 'walk_root:IF-MIB:ifTable']
+    aggregator.assert_metric('snmpwalk.walk.duration', tags=tags, count=1)
+    aggregator.assert_metric('snmpwalk.walk.rows', value=12, tags=tags, count=1)
+
+
+def test_walk_failure(aggregator, fake_snmpwalk):
+    binary, _ = fake_snmpwalk(FAKE_TABLES)
+    metrics = [
+        {'MIB': 'IF-MIB', 'table': 'ifTable', 'symbols': ['ifInOctets']},
+        {'MIB': 'IF-MIB', 'table': 'ifXTable', 'symbols': ['ifHCInOctets']},
+    ]
+    instance = make_instance(metrics)
+    check = SnmpwalkCheck(CHECK_NAME, {'binary': binary}, {})
+    check.check(instance)
+
+    aggregator.assert_service_check('snmpwalk.can_check', status=SnmpwalkCheck.CRITICAL, count=1)
+    (service_check,) = aggregator.service_checks('snmpwalk.can_check')
+    assert 'IF-MIB:ifXTable: Unknown Object Identifier' in service_check.message
+    aggregator.assert_all_metrics_covered()
+
+
+def test_concurrent_walks(aggregator, fake_snmpwalk):
+    tables = make_fake_tables(4, rows=10)
+    binary, _ = fake_snmpwalk(tables, latency=0.5)
+    instance = make_instance(make_fake_metrics(tables))
+    check = SnmpwalkCheck(CHECK_NAME, {'binary': binary, 'max_workers': 4}, {})
+
+    start = time.monotonic()
+    check.check(instance)
+    elapsed = time.monotonic() - start
+    check.cancel()
+
+    assert elapsed < 1.5
+    aggregator.assert_metric('snmpwalk.fake3Counter0', count=10)
+
+
+def make_pipeline(metrics, tag_refresh_interval=0):
+    clock = [0]
+    log = mock.MagicMock()
+    pipeline = MetricPipeline('snmpwalk', metrics, ['site:test'], tag_refresh_interval, log, lambda: clock[0])
+    return pipeline, clock
+
+
+def collect(pipeline, data, types):
+    return {
+        (key, index): (method, converter(value), index_tags[index])
+        for method, key, converter, values, index_tags in pipeline.get_samples(data, types)
+        for index, value in values.items()
+    }
+
+
+def test_pipeline_tags():
+    metrics = [
+        {
+            'symbols': ['ifInOctets', 'ifOperStatus'],
+            'metric_tags': [
+                {'tag': 'interface', 'column': 'ifDescr', 'regex': r'eth(\d+)', 'additional_tags': ['kind:ethernet']},
+                {'tag': 'status', 'column': 'ifOperStatus'},
+                {'tag': 'unsupported', 'index': 1},
+            ],
+        }
+    ]
+    data = {
+        'ifDescr': {1: 'eth0', 2: 'lo'},
+        'ifInOctets': {1: '10', 2: '20'},
+        'ifOperStatus': {1: 'up(1)', 2: 'down(2)'},
+    }
+    types = {'ifDescr': 'STRING', 'ifInOctets': 'Counter64', 'ifOperStatus': 'INTEGER'}
+    pipeline, _ = make_pipeline(metrics)
+
+    assert collect(pipeline, data, types) == {
+        ('snmpwalk.ifInOctets', 1): ('rate', 10, ('site:test', 'interface:0', 'kind:ethernet', 'status:up')),
+        ('snmpwalk.ifInOctets', 2): ('rate', 20, ('site:test', 'status:down')),
+        ('snmpwalk.ifOperStatus', 1): ('gauge', 1, ('site:test', 'interface:0', 'kind:ethernet', 'status:up')),
+        ('snmpwalk.ifOperStatus', 2): ('gauge', 2, ('site:test', 'status:down')),
+    }
+
+
+def test_pipeline_unsupported_type():
+    pipeline, _ = make_pipeline([{'symbols': ['sysUpTime']}])
+    with pytest.raises(Exception, match='unsupported metric symbol type: Timeticks'):
+        collect(pipeline, {'sysUpTime': {0: '(100) 0:00:01.00'}}, {'sysUpTime': 'Timeticks'})
+
+
+def test_pipeline_tag_refresh_interval():
+    metrics = [{'symbols': ['ifInOctets'], 'metric_tags': [{'tag': 'interface', 'column': 'ifDescr'}]}]
+    types = {'ifDescr': 'STRING', 'ifInOctets': 'Counter64'}
+    pipeline, clock = make_pipeline(metrics, tag_refresh_interval=300)
+
+    data = {'ifDescr': {1: 'eth0'}, 'ifInOctets': {1: '10'}}
+    assert collect(pipeline, data, types)['snmpwalk.ifInOctets', 1][2] == ('site:test', 'interface:eth0')
+
+    # Renamed interfaces keep their cached tags until the refresh
+    clock[0] = 100
+    data = {'ifDescr': {1: 'eth1'}, 'ifInOctets': {1: '10'}}
+    assert collect(pipeline, data, types)['snmpwalk.ifInOctets', 1][2] == ('site:test', 'interface:eth0')
+
+    # New indexes are tagged right away
+    clock[0] = 200
+    data = {'ifDescr': {1: 'eth1', 2: 'eth2'}, 'ifInOctets': {1: '10', 2: '20'}}
+    samples = collect(pipeline, data, types)
+    assert samples['snmpwalk.ifInOctets', 1][2] == ('site:test', 'interface:eth1')
+    assert samples['snmpwalk.ifInOctets', 2][2] == ('site:test', 'interface:eth2')
+
+    clock[0] = 600
+    data = {'ifDescr': {1: 'eth3', 2: 'eth2'}, 'ifInOctets': {1: '10', 2: '20'}}
+    assert collect(pipeline, data, types)['snmpwalk.ifInOctets', 1][2] == ('site:test', 'interface:eth3')
+
+
+def test_invalid_tag_refresh_interval():
+    instance = make_instance([], tag_refresh_interval=-1)
+    with pytest.raises(ConfigurationError, match='non-negative'):
+        SnmpwalkCheck(CHECK_NAME, {}, [instance])
@@ -2,6 +2,8 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import requests
 from six import PY3
@@ -15,50 +17,82 @@ if PY3:
 EVENT_TYPE = SOURCE_TYPE_NAME = 'storm'
 
 
-def _g(stat_map, default, func, *components):
-    """Helper method to return value, tag tuple from a stat map get.
+@lru_cache(maxsize=None)
+def _compile_path(default, default_type, func, components):
+    """Compile a stat map lookup into a reusable accessor.
 
-    Note: This safely handles the odd cases where the API can return things like:
-      {
-        "key1": null,
-        "key2": ""
-      }
+    The returned callable safely traverses a stat map for nested objects, e.g. the components
+    `["parent", 1, "mykey"]` return `2` from `{"parent": [{"mykey": 1}, {"mykey": 2}]}`. Missing keys, out of range
+    indexes, `null` and `""` values, and values `func` fails to convert are replaced with the `default` value.
 
-      Where we want `key1`, `key2`, and `key3` (absent) to be replaced with a `default` value.
+    The path is only interpreted once, accessors are cached so the same path always maps to the same callable.
+    `default_type` is part of the cache key so that `0`, `0.0` and `False` defaults do not collide.
 
-    This method will also safely traverse a map for nested objects like:
-      {
-        "parent": [{"mykey": 1}, {"mykey": 2}]
-      }
-      When the `components` are `["parent", 1, "mykey"]` this will return `2`.
-      When the `components` are `["parent", 1, "myotherkey"]` this will return the default value.
-
-
-    :param stat_map: stat map
     :param default: default value
+    :param default_type: type of the default value
     :param func: function to apply after getting the value.
-    :param components: components in order to traverse
-    :return: stat value
+    :param components: tuple of components in order to traverse
+    :return: accessor taking a stat map and returning the stat value
     """
-    value = stat_map
-    for component in components:
-        if isinstance(component, (int, long)):
-            if isinstance(value, (list, tuple)) and len(value) > component:
+    steps = tuple((isinstance(component, (int, long)), component) for component in components)
+
+    def convert(value):
+        if value in (None, ''):
+            return default
+        if func is not None:
+            try:
+                return func(value)
+            except Exception:
+                return default
+        return value
+
+    if len(steps) == 1 and not steps[0][0]:
+        key = components[0]
+
+        def accessor(stat_map):
+            if key in stat_map:
+                return convert(stat_map[key])
+            return default
+
+        return accessor
+
+    def accessor(stat_map):
+        value = stat_map
+        for is_index, component in steps:
+            if is_index:
+                if isinstance(value, (list, tuple)) and len(value) > component:
+                    value = value[component]
+                else:
+                    return default
+            elif component in value:
                 value = value[component]
             else:
                 return default
-        elif component in value:
-            value = value[component]
-        else:
-            return default
-    if value in (None, ''):
-        return default
-    if func is not None:
-        try:
-            return func(value)
-        except Exception:
-            return default
-    return value
+        return convert(value)
+
+    return accessor
+
+
+def _path(default, func, *components):
+    """Return the cached accessor for a path, see `_compile_path`.
+
+    :param default: default value, must be hashable
+    :param func: function to apply after getting the value.
+    :param components: components in order to traverse
+    :return: accessor taking a stat map and returning the stat value
+    """
+    return _compile_path(default, type(default), func, components)
+
+
+def _metric_specs(func, default, metric_names):
+    """Build a metric spec table of (metric name, accessor) for top level keys sharing a conversion.
+
+    :param func: function to apply after getting the value.
+    :param default: default value
+    :param metric_names: metric names, also used as the key to look up
+    :return: tuple of (metric name, accessor)
+    """
+    return tuple((metric_name, _path(default, func, metric_name)) for metric_name in metric_names)
 
 
 def _float(v):
@@ -108,7 +142,7 @@ def _get_length(stat_map, default, *components):
     :return: length of array or default value.
     :rtype: int
     """
-    return _g(stat_map, default, len, *components)
+    return _path(default, len, *components)(stat_map)
 
 
 def _get_long(stat_map, default, *components):
@@ -120,7 +154,7 @@ def _get_long(stat_map, default, *components):
     :return: long of value or default value.
     :rtype: long
     """
-    return _g(stat_map, default, _long, *components)
+    return _path(default, _long, *components)(stat_map)
 
 
 def _get_float(stat_map, default, *components):
@@ -132,7 +166,7 @@ def _get_float(stat_map, default, *components):
     :return: float of value or default value.
     :rtype: float
     """
-    return _g(stat_map, default, _float, *components)
+    return _path(default, _float, *components)(stat_map)
 
 
 def _get_string(stat_map, default, *components):
@@ -144,7 +178,7 @@ def _get_string(stat_map, default, *components):
     :return: str of value or default value.
     :rtype: str
     """
-    return _g(stat_map, default, str, *components)
+    return _path(default, str, *components)(stat_map)
 
 
 def _get_bool(stat_map, default, *components):
@@ -156,7 +190,7 @@ def _get_bool(stat_map, default, *components):
     :return: bool of value or default value.
     :rtype: bool
     """
-    return _g(stat_map, default, _bool, *components)
+    return _path(default, _bool, *components)(stat_map)
 
 
 def _get_list(stat_map, *components):
@@ -167,7 +201,7 @@ def _get_list(stat_map, *components):
     :return: list of component
     :rtype: list
     """
-    val = _g(stat_map, [], None, *components)
+    val = _path(None, None, *components)(stat_map)
     return [] if not val or not isinstance(val, list) else val
 
 
@@ -179,11 +213,124 @@ def _get_dict(stat_map, *components):
     :return: dict of component
     :rtype: dict
     """
-    val = _g(stat_map, {}, None, *components)
+    val = _path(None, None, *components)(stat_map)
 
     return {} if not val or not isinstance(val, dict) else val
 
 
+def _get_debug(v):
+    return 1 if _bool(v) else 0
+
+
+def _component_name(v):
+    return str(v).replace('.', '_').replace(':', '_')
+
+
+# Declarative metric spec tables, paths are compiled once at import time.
+CLUSTER_METRICS = _metric_specs(
+    _long, 0, ['executorsTotal', 'slotsFree', 'slotsTotal', 'slotsUsed', 'supervisors', 'tasksTotal', 'topologies']
+) + _metric_specs(
+    _float, 0.0, ['availCpu', 'availMem', 'cpuAssignedPercentUtil', 'memAssignedPercentUtil', 'totalCpu', 'totalMem']
+)
+
+SUPERVISOR_METRICS = _metric_specs(_long, 0, ['slotsTotal', 'slotsUsed', 'uptimeSeconds']) + _metric_specs(
+    _float, 0, ['totalCpu', 'totalMem', 'usedCpu', 'usedMem']
+)
+
+TOPOLOGY_METRICS = (
+    ('acked', _path(0, _long, 'topologyStats', 0, 'acked')),
+    ('assignedCpu', _path(0.0, _float, 'assignedCpu')),
+    ('assignedMemOffHeap', _path(0, _long, 'assignedMemOffHeap')),
+    ('assignedMemOnHeap', _path(0, _long, 'assignedMemOnHeap')),
+    ('assignedTotalMem', _path(0, _long, 'assignedTotalMem')),
+    ('completeLatency', _path(0.0, _float, 'topologyStats', 0, 'completeLatency')),
+    ('debug', _path(0, _get_debug, 'debug')),
+    ('emitted', _path(0, _long, 'topologyStats', 0, 'emitted')),
+    ('executorsTotal', _path(0, _long, 'executorsTotal')),
+    ('failed', _path(0, _long, 'topologyStats', 0, 'failed')),
+    ('msgTimeout', _path(0, _long, 'msgTimeout')),
+    ('numBolts', _path(0, len, 'bolts')),
+    ('numSpouts', _path(0, len, 'spouts')),
+    ('replicationCount', _path(0, _long, 'replicationCount')),
+    ('requestedCpu', _path(0.0, _float, 'requestedCpu')),
+    ('requestedMemOffHeap', _path(0.0, _float, 'requestedMemOffHeap')),
+    ('requestedMemOnHeap', _path(0.0, _float, 'requestedMemOnHeap')),
+    ('samplingPct', _path(0.0, _float, 'samplingPct')),
+    ('tasksTotal', _path(0, _long, 'tasksTotal')),
+    ('transferred', _path(0, _long, 'topologyStats', 0, 'transferred')),
+    ('uptimeSeconds', _path(0, _long, 'uptimeSeconds')),
+    ('workersTotal', _path(0, _long, 'workersTotal')),
+)
+
+BOLT_METRICS = (
+    _metric_specs(
+        _long,
+        0,
+        [
+            'acked',
+            'emitted',
+            'executed',
+            'executors',
+            'failed',
+            'requestedMemOffHeap',
+            'requestedMemOnHeap',
+            'tasks',
+            'transferred',
+        ],
+    )
+    + _metric_specs(_float, 0, ['capacity', 'executeLatency', 'processLatency', 'requestedCpu'])
+    + _metric_specs(_float, 1e10, ['errorLapsedSecs'])
+)
+
+SPOUT_METRICS = (
+    _metric_specs(
+        _long,
+        0,
+        [
+            'acked',
+            'emitted',
+            'executors',
+            'failed',
+            'requestedMemOffHeap',
+            'requestedMemOnHeap',
+            'tasks',
+            'transferred',
+        ],
+    )
+    + _metric_specs(_float, 0, ['completeLatency', 'requestedCpu'])
+    + _metric_specs(_float, 1e10, ['errorLapsedSecs'])
+)
+
+WORKER_METRICS = (
+    ('assignedCpu', _path(0, _float, 'assignedCpu')),
+    ('assignedMemOffHeap', _path(0, _long, 'assignedMemOffHeap')),
+    ('assignedMemOnHeap', _path(0, _long, 'assignedMemOnHeap')),
+    ('executorsTotal', _path(0, _long, 'executorsTotal')),
+    ('uptimeSeconds', _path(0, _long, 'uptimeSeconds')),
+)
+
+TOPOLOGY_STREAM_METRICS = (
+    'acked',
+    'complete_ms_avg',
+    'emitted',
+    'executed',
+    'executed_ms_avg',
+    'failed',
+    'process_ms_avg',
+    'transferred',
+)
+
+_get_topology_name = _path('unknown', _component_name, 'name')
+_get_bolt_id = _path('unknown', _component_name, 'boltId')
+_get_spout_id = _path('unknown', _component_name, 'spoutId')
+_get_component_id = _path('unknown', _component_name, 'id')
+_get_worker_host = _path('unknown', str, 'host')
+_get_worker_port = _path(0, _long, 'port')
+_get_worker_supervisor_id = _path('unknown', str, 'supervisorId')
+_get_stream_id = _path('unknown', str, 'stream_id')
+_get_stream_value = _path(0.0, _float, 'value')
+
+
 class StormCheck(AgentCheck):
     """
     Apache Storm 1.x.x Topology Execution Stats
@@ -192,6 +339,7 @@ class StormCheck(AgentCheck):
     DEFAULT_STORM_SERVER = 'http://localhost:9005'
     DEFAULT_STORM_ENVIRONMENT = 'dev'
     DEFAULT_STORM_INTERVALS = [60]
+    DEFAULT_MAX_WORKERS = 4
 
     class StormVersion(object):
         @classmethod
@@ -243,7 +391,8 @@ class StormCheck(AgentCheck):
             self.log.debug("Fetching url %s", url)
             if params:
                 self.log.debug("Request params: %s", params)
-            resp = self.http.get(url, params=params)
+            # Reuse the shared session so concurrent topology requests share a per-host connection pool
+            resp = self.http.get(url, params=params, persist=True)
             resp.encoding = 'utf-8'
             data = resp.json()
             # Log response data excluding configuration section
@@ -355,35 +504,12 @@ class StormCheck(AgentCheck):
         tags = [storm_version]
         if storm_version not in self.additional_tags:
             self.additional_tags.append(storm_version)
+            self._tag_contexts.clear()
 
-            # Longs
-        for metric_name in [
-                'executorsTotal',
-                'slotsFree',
-                'slotsTotal',
-                'slotsUsed',
-                'supervisors',
-                'tasksTotal',
-                'topologies',
-            ]:
+        for metric_name, accessor in CLUSTER_METRICS:
             self.report_gauge(
                 f'storm.cluster.{metric_name}',
-                _get_long(cluster_stats, 0, metric_name),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            # Floats
-        for metric_name in [
-                'availCpu',
-                'availMem',
-                'cpuAssignedPercentUtil',
-                'memAssignedPercentUtil',
-                'totalCpu',
-                'totalMem',
-            ]:
-            self.report_gauge(
-                f'storm.cluster.{metric_name}',
-                _get_float(cluster_stats, 0.0, metric_name),
+                accessor(cluster_stats),
                 tags=tags,
                 additional_tags=self.additional_tags,
             )
@@ -443,19 +569,10 @@ class StormCheck(AgentCheck):
                 host = _get_string(ss, 'unknown', 'host')
                 storm_id = _get_string(ss, 'unknown', 'id')
                 tags = [f'stormHost:{host}', f'stormSupervisorId:{storm_id}']
-                # longs
-                for metric_name in ['slotsTotal', 'slotsUsed', 'uptimeSeconds']:
-                    self.report_gauge(
-                        f'storm.supervisor.{metric_name}',
-                        _get_long(ss, 0, metric_name),
-                        tags=tags,
-                        additional_tags=self.additional_tags,
-                    )
-                # floats
-                for metric_name in ['totalCpu', 'totalMem', 'usedCpu', 'usedMem']:
+                for metric_name, accessor in SUPERVISOR_METRICS:
                     self.report_gauge(
                         f'storm.supervisor.{metric_name}',
-                        _get_float(ss, 0, metric_name),
+                        accessor(ss),
                         tags=tags,
                         additional_tags=self.additional_tags,
                     )
@@ -468,280 +585,56 @@ class StormCheck(AgentCheck):
         :param interval: Interval of metrics reported
         :type interval: int
         """
+        if not topology_stats:
+            return
 
-        def _mts(metric_name):
-            return 'storm.topologyStats.last_{}.{}'.format(interval, metric_name)
-
-        if topology_stats:
-            name = _get_string(topology_stats, 'unknown', 'name').replace('.', '_').replace(':', '_')
-            debug_mode = _get_bool(topology_stats, False, 'debug')
-            tags = ['topology:{}'.format(name)]
+        name = _get_topology_name(topology_stats)
+        tags = ('topology:{}'.format(name),)
 
+        prefix = 'storm.topologyStats.last_{}.'.format(interval)
+        for metric_name, accessor in TOPOLOGY_METRICS:
             self.report_histogram(
-                _mts('acked'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'acked'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedCpu'),
-                _get_float(topology_stats, 0.0, 'assignedCpu'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedMemOffHeap'),
-                _get_long(topology_stats, 0, 'assignedMemOffHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedMemOnHeap'),
-                _get_long(topology_stats, 0, 'assignedMemOnHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedTotalMem'),
-                _get_long(topology_stats, 0, 'assignedTotalMem'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('completeLatency'),
-                _get_float(topology_stats, 0.0, 'topologyStats', 0, 'completeLatency'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('debug'), 1 if debug_mode else 0, tags=tags, additional_tags=self.additional_tags
-            )
-            self.report_histogram(
-                _mts('emitted'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'emitted'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('executorsTotal'),
-                _get_long(topology_stats, 0, 'executorsTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('failed'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'failed'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('msgTimeout'),
-                _get_long(topology_stats, 0, 'msgTimeout'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('numBolts'),
-                _get_length(topology_stats, 0, 'bolts'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('numSpouts'),
-                _get_length(topology_stats, 0, 'spouts'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('replicationCount'),
-                _get_long(topology_stats, 0, 'replicationCount'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedCpu'),
-                _get_float(topology_stats, 0.0, 'requestedCpu'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedMemOffHeap'),
-                _get_float(topology_stats, 0.0, 'requestedMemOffHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedMemOnHeap'),
-                _get_float(topology_stats, 0.0, 'requestedMemOnHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('samplingPct'),
-                _get_float(topology_stats, 0.0, 'samplingPct'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('tasksTotal'),
-                _get_long(topology_stats, 0, 'tasksTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('transferred'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'transferred'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('uptimeSeconds'),
-                _get_long(topology_stats, 0, 'uptimeSeconds'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('workersTotal'),
-                _get_long(topology_stats, 0, 'workersTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
+                prefix + metric_name, accessor(topology_stats), tags=tags, additional_tags=self.additional_tags
             )
 
-            # Bolt Stats
-            def _mb(metric_name):
-                return 'storm.bolt.last_{}.{}'.format(interval, metric_name)
-
-            for b in _get_list(topology_stats, 'bolts'):
-                bolt_name = _get_string(b, 'unknown', 'boltId').replace('.', '_').replace(':', '_')
-                bolt_tags = tags + ['bolt:{}'.format(bolt_name)]
-
-                # Longs:
-                for metric_name in [
-                    'acked',
-                    'emitted',
-                    'executed',
-                    'executors',
-                    'failed',
-                    'requestedMemOffHeap',
-                    'requestedMemOnHeap',
-                    'tasks',
-                    'transferred',
-                ]:
-                    self.report_histogram(
-                        _mb(metric_name),
-                        _get_long(b, 0, metric_name),
-                        tags=bolt_tags,
-                        additional_tags=self.additional_tags,
-                    )
-                # Floats
-                for metric_name in ['capacity', 'executeLatency', 'processLatency', 'requestedCpu']:
-                    self.report_histogram(
-                        _mb(metric_name),
-                        _get_float(b, 0, metric_name),
-                        tags=bolt_tags,
-                        additional_tags=self.additional_tags,
-                    )
-
+        # Bolt Stats
+        prefix = 'storm.bolt.last_{}.'.format(interval)
+        for b in _get_list(topology_stats, 'bolts'):
+            bolt_tags = tags + ('bolt:{}'.format(_get_bolt_id(b)),)
+            for metric_name, accessor in BOLT_METRICS:
                 self.report_histogram(
-                    _mb('errorLapsedSecs'),
-                    _get_float(b, 1e10, 'errorLapsedSecs'),
-                    tags=bolt_tags,
-                    additional_tags=self.additional_tags,
+                    prefix + metric_name, accessor(b), tags=bolt_tags, additional_tags=self.additional_tags
                 )
 
-            # Process Spout stats
-            def _ms(metric_name):
-                return 'storm.spout.last_{}.{}'.format(interval, metric_name)
-
-            for s in _get_list(topology_stats, 'spouts'):
-                spout_name = _get_string(s, 'unknown', 'spoutId').replace('.', '_').replace(':', '_')
-                spout_tags = tags + ['spout:{}'.format(spout_name)]
-
-                # Longs:
-                for metric_name in [
-                    'acked',
-                    'emitted',
-                    'executors',
-                    'failed',
-                    'requestedMemOffHeap',
-                    'requestedMemOnHeap',
-                    'tasks',
-                    'transferred',
-                ]:
-                    self.report_histogram(
-                        _ms(metric_name),
-                        _get_long(s, 0, metric_name),
-                        tags=spout_tags,
-                        additional_tags=self.additional_tags,
-                    )
-                # Floats
-                for metric_name in ['completeLatency', 'requestedCpu']:
-                    self.report_histogram(
-                        _ms(metric_name),
-                        _get_float(s, 0, metric_name),
-                        tags=spout_tags,
-                        additional_tags=self.additional_tags,
-                    )
-
+        # Process Spout stats
+        prefix = 'storm.spout.last_{}.'.format(interval)
+        for s in _get_list(topology_stats, 'spouts'):
+            spout_tags = tags + ('spout:{}'.format(_get_spout_id(s)),)
+            for metric_name, accessor in SPOUT_METRICS:
                 self.report_histogram(
-                    _ms('errorLapsedSecs'),
-                    _get_float(s, 1e10, 'errorLapsedSecs'),
-                    tags=spout_tags,
-                    additional_tags=self.additional_tags,
+                    prefix + metric_name, accessor(s), tags=spout_tags, additional_tags=self.additional_tags
                 )
 
-            # Process worker stats
-            def _mw(metric_name):
-                return 'storm.worker.last_{}.{}'.format(interval, metric_name)
-
-            for w in _get_list(topology_stats, 'workers'):
-                worker_stat = {}
-                host = _get_string(w, 'unknown', 'host')
-                port = _get_long(w, 0, 'port')
-                supervisor_id = _get_string(w, 'unknown', 'supervisorId')
-                worker_tags = tags + ['worker:{}:{}'.format(host, port), 'supervisor:{}'.format(supervisor_id)]
-
-                self.report_histogram(
-                    _mw('assignedCpu'),
-                    _get_float(w, 0, 'assignedCpu'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('assignedMemOffHeap'),
-                    _get_long(w, 0, 'assignedMemOffHeap'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('assignedMemOnHeap'),
-                    _get_long(w, 0, 'assignedMemOnHeap'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
+        # Process worker stats
+        prefix = 'storm.worker.last_{}.'.format(interval)
+        for w in _get_list(topology_stats, 'workers'):
+            worker_tags = tags + (
+                'worker:{}:{}'.format(_get_worker_host(w), _get_worker_port(w)),
+                'supervisor:{}'.format(_get_worker_supervisor_id(w)),
+            )
+            for metric_name, accessor in WORKER_METRICS:
                 self.report_histogram(
-                    _mw('executorsTotal'),
-                    _get_long(w, 0, 'executorsTotal'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
+                    prefix + metric_name, accessor(w), tags=worker_tags, additional_tags=self.additional_tags
                 )
+
+            for cn, cv in _get_dict(w, 'componentNumTasks').items():
                 self.report_histogram(
-                    _mw('uptimeSeconds'),
-                    _get_long(w, 0, 'uptimeSeconds'),
-                    tags=worker_tags,
+                    prefix + 'componentNumTasks',
+                    _long(cv or 0),
+                    tags=worker_tags + ('component:{}'.format(cn),),
                     additional_tags=self.additional_tags,
                 )
 
-                worker_stat[_mw('componentNumTasks')] = []
-                for cn, cv in _get_dict(w, 'componentNumTasks').items():
-                    worker_component_tags = worker_tags + ['component:{}'.format(cn)]
-                    self.report_histogram(
-                        _mw('componentNumTasks'),
-                        _long(cv or 0),
-                        tags=worker_component_tags,
-                        additional_tags=self.additional_tags,
-                    )
-
     def process_topology_metrics(self, topology_name, topology_stats, interval):
         """Process Topology Metrics Stats Response
 
@@ -755,38 +648,26 @@ class StormCheck(AgentCheck):
         if not topology_stats:
             return
         name = topology_name.replace('.', '_').replace(':', '_')
-        tags = [f'topology:{name}']
+        tags = (f'topology:{name}',)
         for k in ('bolts', 'spouts'):
             for s in _get_list(topology_stats, k):
-                k_name = _get_string(s, 'unknown', 'id').replace('.', '_').replace(':', '_')
-                k_tags = tags + [f'{k}:{k_name}']
-                for sc in [
-                        'acked',
-                        'complete_ms_avg',
-                        'emitted',
-                        'executed',
-                        'executed_ms_avg',
-                        'failed',
-                        'process_ms_avg',
-                        'transferred',
-                    ]:
+                k_tags = tags + (f'{k}:{_get_component_id(s)}',)
+                for sc in TOPOLOGY_STREAM_METRICS:
+                    # will make stats like these two examples
+                    # storm.topologyStats.metrics.spouts.last_60.emitted
+                    # storm.topologyStatus.metrics.bolts.last_60.acked
+                    metric_name = f'storm.topologyStats.metrics.{k}.last_{interval}.{sc}'
                     for ks in _get_list(s, sc):
-                        stream_id = _get_string(ks, 'unknown', 'stream_id')
-                        ks_tags = k_tags + [f'stream:{stream_id}']
+                        ks_tags = k_tags + (f'stream:{_get_stream_id(ks)}',)
                         if component_id := ks.get('component_id'):
-                            ks_tags.append(f'component:{component_id}')
-
-                        component_value = _get_float(ks, 0.0, 'value')
-                        if component_value is not None:
-                                # will make stats like these two examples
-                                # storm.topologyStats.metrics.spouts.last_60.emitted
-                                # storm.topologyStatus.metrics.bolts.last_60.acked
-                            self.report_histogram(
-                                f'storm.topologyStats.metrics.{k}.last_{interval}.{sc}',
-                                component_value,
-                                tags=ks_tags,
-                                additional_tags=self.additional_tags,
-                            )
+                            ks_tags += (f'component:{component_id}',)
+
+                        self.report_histogram(
+                            metric_name,
+                            _get_stream_value(ks),
+                            tags=ks_tags,
+                            additional_tags=self.additional_tags,
+                        )
 
     def report_gauge(self, metric, value, tags, additional_tags):
         """Report the Gauge Metric.
@@ -797,10 +678,7 @@ class StormCheck(AgentCheck):
         :param additional_tags:
         :return:
         """
-        all_tags = set(tags)
-        all_tags.add(f'stormEnvironment:{self.environment_name}')
-        all_tags.update(additional_tags)
-        self.gauge(metric, value=value, tags=all_tags)
+        self.gauge(metric, value=value, tags=self.get_tag_context(tags, additional_tags))
 
     def report_histogram(self, metric, value, tags, additional_tags):
         """Report the Histogram Metric.
@@ -811,10 +689,29 @@ class StormCheck(AgentCheck):
         :param additional_tags:
         :return:
         """
-        all_tags = set(tags)
-        all_tags.add(f'stormEnvironment:{self.environment_name}')
-        all_tags.update(additional_tags)
-        self.histogram(metric, value=value, tags=all_tags)
+        self.histogram(metric, value=value, tags=self.get_tag_context(tags, additional_tags))
+
+    def get_tag_context(self, tags, additional_tags):
+        """Get the interned submission tags for a metric context.
+
+        The context is identified by its own tags, e.g. (topology, component), and the additional tags. The full tag
+        tuple including the environment is built once per run and reused for every metric of that context.
+
+        :param tags: context tags
+        :type tags: tuple|list
+        :param additional_tags: additional tags
+        :type additional_tags: list
+        :return: submission tags
+        :rtype: tuple
+        """
+        key = (tags if isinstance(tags, tuple) else tuple(tags), tuple(additional_tags))
+        all_tags = self._tag_contexts.get(key)
+        if all_tags is None:
+            all_tags = set(key[0])
+            all_tags.add(f'stormEnvironment:{self.environment_name}')
+            all_tags.update(additional_tags)
+            all_tags = self._tag_contexts[key] = tuple(all_tags)
+        return all_tags
 
     def update_from_config(self, instance):
         """Update Configuration tunables from instance configuration.
@@ -828,6 +725,8 @@ class StormCheck(AgentCheck):
         )
         self.additional_tags = []
         self.additional_tags.extend(instance.get('tags', []))
+        # Tag contexts only live for a single run since they embed the environment and additional tags
+        self._tag_contexts = {}
         self.excluded_topologies = []
         self.excluded_topologies.extend(instance.get('excluded', []))
         self.intervals = []
@@ -837,6 +736,12 @@ class StormCheck(AgentCheck):
             raise AssertionError("Expected intervals to be a list of integers with at least 1 value")
         self.intervals.extend(intervals)
 
+        self.max_workers = int(
+            instance.get('max_workers', self.init_config.get('max_workers', StormCheck.DEFAULT_MAX_WORKERS))
+        )
+        if self.max_workers < 1:
+            raise AssertionError("Expected max_workers to be a positive integer")
+
     def check(self, instance):
         """Perform the agent check.
 
@@ -868,40 +773,65 @@ class StormCheck(AgentCheck):
 
         # Topology Stats
         summary = self.get_storm_topology_summary()
+        topologies = []
         for topology in _get_list(summary, 'topologies'):
             topology_id = topology.get('id')
             if topology_id in (None, ''):
                 self.log.warning("Ignoring topology without id.")
                 continue
             topology_name = _get_string(topology, 'unknown', 'name')
-            topology_status = None
             if topology_name not in self.excluded_topologies:
-                for interval in self.intervals:
-                    try:
-                        stats = self.get_topology_info(topology_id=topology_id, interval=interval)
-                        self.process_topology_stats(topology_stats=stats, interval=interval)
-                        metric_stats = self.get_topology_metrics(
-                            topology_id=topology_id, interval=interval, storm_version=storm_version
-                        )
-                        self.process_topology_metrics(topology_name, metric_stats, interval=interval)
-
-                        # only report this once.
-                        if topology_status is None:
-                            topology_status = _get_string(stats, 'unknown', 'status').upper()
-                            check_status = AgentCheck.CRITICAL if topology_status != 'ACTIVE' else AgentCheck.OK
-                            topology_message = f'{topology_name} topology status marked as: {topology_status}'
-                            self.service_check(
-                                f'topology_check.{topology_name}',
-                                status=check_status,
-                                message=topology_message
-                                if check_status != AgentCheck.OK
-                                else "",
-                                tags=[f'stormEnvironment:{self.environment_name}']
-                                + self.additional_tags,
-                            )
-                    except Exception:  # noqa
-                        self.log.exception(
-                            "unable to collect topology stats for topology_id:%s, topology_name:%s",
-                            topology_id,
-                            topology_name,
+                topologies.append((topology_id, topology_name))
+
+        # Fetch the info and metrics of every topology/interval pair concurrently, results are processed in
+        # submission order. Either request can fail without dropping what the other one returned.
+        reported_topologies = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                (
+                    topology_id,
+                    topology_name,
+                    interval,
+                    executor.submit(self.get_topology_info, topology_id=topology_id, interval=interval),
+                    executor.submit(
+                        self.get_topology_metrics,
+                        topology_id=topology_id,
+                        interval=interval,
+                        storm_version=storm_version,
+                    ),
+                )
+                for topology_id, topology_name in topologies
+                for interval in self.intervals
+            ]
+            for topology_id, topology_name, interval, stats_future, metrics_future in futures:
+                try:
+                    stats = stats_future.result()
+                    self.process_topology_stats(topology_stats=stats, interval=interval)
+
+                    # only report this once.
+                    if topology_id not in reported_topologies:
+                        reported_topologies.add(topology_id)
+                        topology_status = _get_string(stats, 'unknown', 'status').upper()
+                        check_status = AgentCheck.CRITICAL if topology_status != 'ACTIVE' else AgentCheck.OK
+                        topology_message = f'{topology_name} topology status marked as: {topology_status}'
+                        self.service_check(
+                            f'topology_check.{topology_name}',
+                            status=check_status,
+                            message=topology_message if check_status != AgentCheck.OK else "",
+                            tags=[f'stormEnvironment:{self.environment_name}'] + self.additional_tags,
                         )
+                except Exception:  # noqa
+                    self.log.exception(
+                        "unable to collect topology stats for topology_id:%s, topology_name:%s",
+                        topology_id,
+                        topology_name,
+                    )
+
+                try:
+                    self.process_topology_metrics(topology_name, metrics_future.result(), interval=interval)
+                except Exception:  # noqa
+                    self.log.exception(
+                        "unable to collect topology metrics for topology_id:%s, topology_name:%s",
+                        topology_id,
+                        topology_name,
+                    )
@@ -1,15 +1,29 @@
 # (C) Datadog, Inc. 2010-2016
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+import copy
+import json
 import os
 import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
 from datadog_checks.dev import docker_run, get_here, run_command
 from datadog_checks.dev.conditions import WaitFor
 
-from .common import HOST, INSTANCE
+from .common import (
+    HOST,
+    INSTANCE,
+    TEST_STORM_CLUSTER_SUMMARY,
+    TEST_STORM_NIMBUSES_SUMMARY,
+    TEST_STORM_SUPERVISOR_SUMMARY,
+    TEST_STORM_TOPOLOGY_METRICS_RESP,
+    TEST_STORM_TOPOLOGY_RESP,
+    TEST_STORM_TOPOLOGY_SUMMARY,
+)
 
 
 def wait_for_thrift():
@@ -32,3 +46,66 @@ def dd_environment():
                 compose_file, service_name='topology', log_patterns=['Finished submitting topology: topology']
             ):
                 yield INSTANCE
+
+
+def make_storm_ui_routes(num_topologies):
+    """Build the Storm UI REST responses for a cluster running `num_topologies` copies of the test topology."""
+    routes = {
+        '/api/v1/cluster/summary': TEST_STORM_CLUSTER_SUMMARY,
+        '/api/v1/nimbus/summary': TEST_STORM_NIMBUSES_SUMMARY,
+        '/api/v1/supervisor/summary': TEST_STORM_SUPERVISOR_SUMMARY,
+    }
+    summary = copy.deepcopy(TEST_STORM_TOPOLOGY_SUMMARY)
+    template = summary['topologies'][0]
+    summary['topologies'] = []
+    for i in range(num_topologies):
+        topology_id = f'my_topology_{i}-1-1489183263'
+        topology_name = f'my_topology_{i}'
+        summary['topologies'].append(dict(template, id=topology_id, encodedId=topology_id, name=topology_name))
+        routes[f'/api/v1/topology/{topology_id}'] = dict(TEST_STORM_TOPOLOGY_RESP, id=topology_id, name=topology_name)
+        routes[f'/api/v1/topology/{topology_id}/metrics'] = dict(
+            TEST_STORM_TOPOLOGY_METRICS_RESP, id=topology_id, name=topology_name
+        )
+    routes['/api/v1/topology/summary'] = summary
+    return {path: json.dumps(body).encode('utf-8') for path, body in routes.items()}
+
+
+@pytest.fixture
+def storm_ui_server():
+    """Start a local fake Storm UI, yields a factory taking the number of topologies and a per-request latency."""
+    servers = []
+
+    def start(num_topologies=1, latency=0.0):
+        routes = make_storm_ui_routes(num_topologies)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body = routes.get(self.path.split('?', 1)[0])
+                if latency:
+                    time.sleep(latency)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,134 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import tracemalloc
+
+import pytest
+
+from datadog_checks.storm import StormCheck
+from datadog_checks.storm.storm import (
+    BOLT_METRICS,
+    SPOUT_METRICS,
+    TOPOLOGY_STREAM_METRICS,
+    WORKER_METRICS,
+    _float,
+    _long,
+    _path,
+)
+
+from .common import TEST_STORM_TOPOLOGY_METRICS_RESP, TEST_STORM_TOPOLOGY_RESP
+
+CHECK_NAME = 'storm'
+NUM_TOPOLOGIES = 30
+INTERVALS = [60, 600, 10800]
+LATENCY = 0.005
+
+
+@pytest.mark.parametrize('max_workers', [1, 16], ids=['sequential', 'concurrent'])
+def test_run(benchmark, storm_ui_server, max_workers):
+    server = storm_ui_server(num_topologies=NUM_TOPOLOGIES, latency=LATENCY)
+    instance = {'server': server, 'environment': 'bench', 'intervals': INTERVALS, 'max_workers': max_workers}
+    check = StormCheck(CHECK_NAME, {}, [instance])
+
+    benchmark.pedantic(check.check, args=(instance,), rounds=3, warmup_rounds=1)
+
+
+def _interpreted_path(stat_map, default, func, *components):
+    """The lookup done for every stat before the paths were compiled, kept as the baseline of the benchmark."""
+    value = stat_map
+    for component in components:
+        if isinstance(component, int):
+            if isinstance(value, (list, tuple)) and len(value) > component:
+                value = value[component]
+            else:
+                return default
+        elif component in value:
+            value = value[component]
+        else:
+            return default
+    if value in (None, ''):
+        return default
+    if func is not None:
+        try:
+            return func(value)
+        except Exception:
+            return default
+    return value
+
+
+def _extraction_paths():
+    """Every (stat map, default, func, components) lookup done while processing the recorded topology fixtures."""
+    paths = [
+        (TEST_STORM_TOPOLOGY_RESP, 0, _long, ('topologyStats', 0, name))
+        for name in ('acked', 'emitted', 'failed', 'transferred')
+    ]
+    paths.extend(
+        (TEST_STORM_TOPOLOGY_RESP, 0.0, _float, (name,))
+        for name in ('assignedCpu', 'requestedCpu', 'requestedMemOffHeap', 'requestedMemOnHeap', 'samplingPct')
+    )
+    for key, metrics in (('bolts', BOLT_METRICS), ('spouts', SPOUT_METRICS), ('workers', WORKER_METRICS)):
+        for component in TEST_STORM_TOPOLOGY_RESP.get(key, []):
+            paths.extend((component, 0.0, _float, (name,)) for name, _ in metrics)
+    for key in ('bolts', 'spouts'):
+        for component in TEST_STORM_TOPOLOGY_METRICS_RESP[key]:
+            for name in TOPOLOGY_STREAM_METRICS:
+                for stream in component.get(name, []):
+                    paths.append((stream, 0.0, _float, ('value',)))
+    return paths
+
+
+def test_extract_interpreted(benchmark):
+    paths = _extraction_paths()
+
+    def run():
+        for stat_map, default, func, components in paths:
+            _interpreted_path(stat_map, default, func, *components)
+
+    benchmark(run)
+
+
+def test_extract_compiled(benchmark):
+    paths = [
+        (stat_map, _path(default, func, *components)) for stat_map, default, func, components in _extraction_paths()
+    ]
+
+    def run():
+        for stat_map, accessor in paths:
+            accessor(stat_map)
+
+    benchmark(run)
+
+
+def test_process_topology(benchmark):
+    check = StormCheck(CHECK_NAME, {}, [{}])
+    check.update_from_config({'environment': 'bench'})
+    check.report_histogram = lambda metric, value, tags, additional_tags: None
+
+    def run():
+        check.process_topology_stats(TEST_STORM_TOPOLOGY_RESP, interval=60)
+        check.process_topology_metrics('my_topology', TEST_STORM_TOPOLOGY_METRICS_RESP, interval=60)
+
+    benchmark(run)
+
+
+def test_process_topology_allocations(benchmark):
+    check = StormCheck(CHECK_NAME, {}, [{}])
+    check.update_from_config({'environment': 'bench', 'tags': ['team:storm', 'region:us-east']})
+    check.histogram = lambda metric, value, tags: None
+
+    def run():
+        check.process_topology_stats(TEST_STORM_TOPOLOGY_RESP, interval=60)
+        check.process_topology_metrics('my_topology', TEST_STORM_TOPOLOGY_METRICS_RESP, interval=60)
+
+    # Warm the tag contexts as a real run would after the first topology interval
+    run()
+    tracemalloc.start()
+    try:
+        run()
+        allocated, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['allocated_bytes'] = allocated
+    benchmark.extra_info['peak_bytes'] = peak
+
+    benchmark(run)
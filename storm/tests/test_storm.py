@@ -32,6 +32,7 @@ def test_load_from_config():
     assert check.additional_tags == []
     assert check.excluded_topologies == []
     assert check.intervals == [60]
+    assert check.max_workers == 4
 
 
 def test_get_storm_cluster_summary():
@@ -480,6 +481,99 @@ def test_check(aggregator):
     aggregator.assert_all_metrics_covered()
 
 
+def test_tag_context_reused():
+    check = StormCheck(CHECK_NAME, {}, {})
+    check.update_from_config(dict(STORM_CHECK_CONFIG, tags=['foo:bar']))
+
+    submitted = defaultdict(list)
+
+    def histogram(metric, value, tags):
+        submitted[metric].append(tags)
+
+    check.histogram = histogram
+    check.process_topology_stats(TEST_STORM_TOPOLOGY_RESP, interval=60)
+
+    acked_tags = submitted['storm.bolt.last_60.acked'][0]
+    assert sorted(acked_tags) == ['bolt:Bolt1', 'foo:bar', 'stormEnvironment:test', 'topology:my_topology']
+    assert submitted['storm.bolt.last_60.emitted'][0] is acked_tags
+    assert submitted['storm.bolt.last_60.acked'][1] is not acked_tags
+
+    # The additional tags are part of the context
+    other_tags = check.get_tag_context(('bolt:Bolt1', 'topology:my_topology'), ['baz:qux'])
+    assert sorted(other_tags) == ['baz:qux', 'bolt:Bolt1', 'stormEnvironment:test', 'topology:my_topology']
+
+    # A new run rebuilds the contexts
+    check.update_from_config(STORM_CHECK_CONFIG)
+    assert check.get_tag_context(('bolt:Bolt1', 'topology:my_topology'), []) is not acked_tags
+
+
+def test_check_concurrent_topologies(aggregator, storm_ui_server):
+    server = storm_ui_server(num_topologies=5)
+    instance = {'server': server, 'environment': 'test', 'intervals': [60, 600], 'max_workers': 3}
+    check = StormCheck(CHECK_NAME, {}, [instance])
+
+    check.check(instance)
+
+    for i in range(5):
+        aggregator.assert_service_check(
+            f'topology_check.my_topology_{i}',
+            count=1,
+            status=AgentCheck.OK,
+            tags=['stormEnvironment:test', 'stormVersion:1.2.0'],
+        )
+        for interval in (60, 600):
+            aggregator.assert_metric(
+                f'storm.topologyStats.last_{interval}.acked',
+                count=1,
+                tags=['stormEnvironment:test', 'stormVersion:1.2.0', f'topology:my_topology_{i}'],
+            )
+
+
+def test_check_topology_fetch_error(aggregator, storm_ui_server):
+    server = storm_ui_server(num_topologies=2)
+    instance = {'server': server, 'environment': 'test', 'max_workers': 2}
+    check = StormCheck(CHECK_NAME, {}, [instance])
+
+    original_get = check.get_topology_info
+
+    def get_topology_info(topology_id, interval=60):
+        if topology_id.startswith('my_topology_0'):
+            raise Exception('boom')
+        return original_get(topology_id, interval)
+
+    check.get_topology_info = get_topology_info
+    check.check(instance)
+
+    aggregator.assert_service_check('topology_check.my_topology_0', count=0)
+    aggregator.assert_service_check('topology_check.my_topology_1', count=1, status=AgentCheck.OK)
+
+
+def test_check_topology_metrics_error(aggregator, storm_ui_server):
+    server = storm_ui_server(num_topologies=1)
+    instance = {'server': server, 'environment': 'test', 'max_workers': 2}
+    check = StormCheck(CHECK_NAME, {}, [instance])
+
+    def get_topology_metrics(topology_id, interval=60, storm_version=None):
+        raise Exception('boom')
+
+    check.get_topology_metrics = get_topology_metrics
+    check.check(instance)
+
+    # the topology info is still processed
+    aggregator.assert_service_check('topology_check.my_topology_0', count=1, status=AgentCheck.OK)
+    aggregator.assert_metric(
+        'storm.topologyStats.last_60.acked',
+        count=1,
+        tags=['stormEnvironment:test', 'stormVersion:1.2.0', 'topology:my_topology_0'],
+    )
+
+
+def test_invalid_max_workers():
+    check = StormCheck(CHECK_NAME, {}, {})
+    with pytest.raises(AssertionError):
+        check.update_from_config(dict(STORM_CHECK_CONFIG, max_workers=0))
+
+
 @pytest.mark.integration
 def test_integration_with_ci_cluster(dd_environment, aggregator):
     check = StormCheck(CHECK_NAME, {}, {})
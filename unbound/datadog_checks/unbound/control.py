@@ -0,0 +1,91 @@
+import socket
+import ssl
+
+# Protocol header of unbound-control, every command is sent as `UBCT1 <command>\n`
+# https://github.com/NLnetLabs/unbound/blob/master/smallapp/unbound-control.c
+CONTROL_HEADER = 'UBCT1 '
+DEFAULT_CONTROL_PORT = 8953
+DEFAULT_TIMEOUT = 10
+
+DEFAULT_KEY_FILE = '/etc/unbound/unbound_control.key'
+DEFAULT_CERT_FILE = '/etc/unbound/unbound_control.pem'
+DEFAULT_SERVER_CERT_FILE = '/etc/unbound/unbound_server.pem'
+
+
+class ControlError(Exception):
+    pass
+
+
+def parse_control_interface(interface):
+    """
+    Returns the socket family and address of an unbound control-interface,
+    either the path of a local socket or ip[@port].
+    """
+    if interface.startswith('/'):
+        return socket.AF_UNIX, interface
+
+    host, _, port = interface.partition('@')
+    port = int(port) if port else DEFAULT_CONTROL_PORT
+    family, _, _, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+    return family, address
+
+
+class ControlClient(object):
+    """
+    Client of the unbound remote-control channel, used instead of running
+    unbound-control.
+
+    The address is resolved and the TLS context, with its keys and
+    certificates, is loaded once. Unbound closes the connection after
+    answering a command so every call opens a new one. Local sockets never
+    use TLS, like unbound.
+    """
+
+    def __init__(
+        self,
+        interface,
+        use_cert=True,
+        key_file=DEFAULT_KEY_FILE,
+        cert_file=DEFAULT_CERT_FILE,
+        server_cert_file=DEFAULT_SERVER_CERT_FILE,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.family, self.address = parse_control_interface(interface)
+        self.timeout = timeout
+
+        self.ssl_context = None
+        if use_cert and self.family != socket.AF_UNIX:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # unbound-control only checks that the server certificate is the configured one
+            context.check_hostname = False
+            context.load_verify_locations(server_cert_file)
+            context.load_cert_chain(cert_file, key_file)
+            self.ssl_context = context
+
+    def _connect(self):
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            if self.ssl_context is not None:
+                sock = self.ssl_context.wrap_socket(sock)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def call(self, command):
+        """Send a command and return its output."""
+        with self._connect() as sock:
+            sock.sendall(f'{CONTROL_HEADER}{command}\n'.encode('ascii'))
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+
+        output = b''.join(chunks).decode('utf-8', 'replace')
+        if output.startswith('error'):
+            raise ControlError(output.strip())
+        return output
@@ -0,0 +1,45 @@
+_VALUE = object()
+
+
+class PrefixTrie(object):
+    """
+    Character trie mapping string prefixes to values.
+
+    Looking a string up returns the value of its longest known prefix, in
+    time linear in the length of that prefix whatever the number of
+    prefixes.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_VALUE] = value
+
+    def longest_prefix_value(self, string, default=None):
+        node = self._root
+        value = node.get(_VALUE, default)
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(_VALUE, value)
+        return value
+
+
+def iter_stats(output):
+    """
+    Yield the (name, value) pairs of the `name=value` lines of unbound-control
+    output in a single pass, lines whose value doesn't end with a digit are skipped.
+    """
+    for line in output.splitlines():
+        name, sep, value = line.partition('=')
+        if not sep:
+            continue
+        name = name.strip()
+        value = value.rstrip()
+        if name and value and value[-1].isdigit():
+            yield name, value
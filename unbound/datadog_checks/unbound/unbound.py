@@ -1,18 +1,44 @@
 import os
-import re
 import socket
+from functools import partial
 
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 from datadog_checks.base.utils.subprocess_output import get_subprocess_output
 
+from .control import DEFAULT_CERT_FILE, DEFAULT_KEY_FILE, DEFAULT_SERVER_CERT_FILE, DEFAULT_TIMEOUT, ControlClient
+from .dispatch import PrefixTrie, iter_stats
+
 EVENT_TYPE = 'unbound'
 
+# Stat prefixes whose last segment is sent as a tag, e.g. num.query.type.A
+LAST_SEGMENT_TAGS = (
+    ('num.query.type', 'query_type'),
+    ('num.query.class', 'query_class'),
+    ('num.query.opcode', 'opcode'),
+    ('num.query.flags', 'flag'),
+)
+
 
 class UnboundCheck(AgentCheck):
     # Stats info https://unbound.net/documentation/unbound-control.html
 
     SERVICE_CHECK_NAME = 'unbound.can_get_stats'
 
+    def __init__(self, name, init_config, instances):
+        super(UnboundCheck, self).__init__(name, init_config, instances)
+
+        self.tag_handlers = PrefixTrie()
+        self.tag_handlers.add('thread', self.thread_handler)
+        self.tag_handlers.add('num.answer.rcode', self.answer_rcode_handler)
+        for prefix, tag_name in LAST_SEGMENT_TAGS:
+            self.tag_handlers.add(prefix, partial(self.last_segment_handler, tag_name))
+
+        # unbound-control stat name -> (submission method, metric name, tag)
+        self._stats = {}
+        # (use_sudo, unbound_control) -> command prefix, resolved on first use
+        self._command_prefixes = {}
+        self._control_client = None
+
     def check(self, instance):
 
         use_sudo = is_affirmative(instance.get('use_sudo', False))
@@ -22,26 +48,20 @@ class UnboundCheck(AgentCheck):
         config_file = instance.get('config_file')
         tags = instance.get('tags', [])
 
-        command = []
-        if use_sudo:
-            test_sudo = os.system('setsid sudo -l < /dev/null')
-            if test_sudo != 0:
-                raise Exception('The dd-agent user does not have sudo access')
-            command.append('sudo')
-
-        if not which(unbound_control, use_sudo, self.log):
-            raise ConfigurationError(f'executable not found: {unbound_control}')
-
-        command.extend((unbound_control, stats_command))
-        if host:
-            command.extend(('-s', hostname_to_ip(host)))
-        if config_file:
-            command.extend(('-c', config_file))
-
-        # Call unbound-control in a separate method to facilitate mocking during testing.
-        # Without this, it's difficult to mock the multiple get_subprocess_output calls
-        # independently.
-        ub_out = self.call_unbound_control(command, tags)
+        if is_affirmative(instance.get('use_control_socket', False)):
+            ub_out = self.call_control_socket(instance, stats_command, tags)
+        else:
+            command = list(self.get_command_prefix(use_sudo, unbound_control))
+            command.append(stats_command)
+            if host:
+                command.extend(('-s', hostname_to_ip(host)))
+            if config_file:
+                command.extend(('-c', config_file))
+
+            # Call unbound-control in a separate method to facilitate mocking during testing.
+            # Without this, it's difficult to mock the multiple get_subprocess_output calls
+            # independently.
+            ub_out = self.call_unbound_control(command, tags)
 
         # Example of unbound stats outpout:
         # total.num.queries=12
@@ -50,7 +70,7 @@ class UnboundCheck(AgentCheck):
         # unwanted.queries=3
 
         # [(u'thread0.num.queries', u'12'), (u'thread0.num.queries_ip_ratelimited', u'45')...]
-        data = re.findall(r'(\S+)=(.*\d)', ub_out)
+        data = list(iter_stats(ub_out))
 
         if not data:
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="unable to parse stats", tags=tags)
@@ -58,25 +78,96 @@ class UnboundCheck(AgentCheck):
 
         self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=tags)
 
-        for stat in data:
-            self.log.debug('processing %s', stat)
+        # extra tag -> tags of the metrics with that tag
+        tag_lists = {None: tags}
+        for stat_name, value in data:
+            stat = self._stats.get(stat_name)
+            if stat is None:
+                stat = self._stats[stat_name] = self.get_stat(stat_name)
+
+            submit, metric_name, tag = stat
+            if submit is None:
+                continue
+            all_tags = tag_lists.get(tag)
+            if all_tags is None:
+                all_tags = tag_lists[tag] = tags + [tag]
+            submit(metric_name, float(value), tags=all_tags)
+
+    def get_stat(self, stat_name):
+        """
+        Returns a tuple (submission method, metric name, tag) for a stat of unbound-control,
+        the submission method is None for stats that are not sent.
+        """
+        self.log.debug('processing %s', stat_name)
 
-            # Some metric names from unbound make more sense to record as name + tag in datadog.
-            metric_name, all_tags = self.metric_name_to_tags(stat[0], tags)
+        # Some metric names from unbound make more sense to record as name + tag in datadog.
+        handler = self.tag_handlers.longest_prefix_value(stat_name)
+        if handler is not None:
+            metric_name, tag = handler(stat_name)
+        else:
+            metric_name, tag = stat_name, None
+
+        unbound_metric_name = f'unbound.{metric_name}'
+
+        if 'histogram' in metric_name:  # dont send histogram metrics
+            self.log.debug('not sending histogram: %s', unbound_metric_name)
+            return None, unbound_metric_name, tag
+        elif any(count in metric_name for count in ['num.', 'unwanted', '.count']):
+            self.log.debug('count: %s', unbound_metric_name)
+            return self.count, unbound_metric_name, tag
+        elif 'time.' in metric_name:
+            self.log.debug('gauge (time): %s', unbound_metric_name)
+            return self.gauge, unbound_metric_name, tag
+        else:
+            self.log.debug('gauge: %s', unbound_metric_name)
+            return self.gauge, unbound_metric_name, tag
+
+    def get_command_prefix(self, use_sudo, unbound_control):
+        # The sudo access and the executable are only checked once, failures are checked again on the next run
+        key = (use_sudo, unbound_control)
+        prefix = self._command_prefixes.get(key)
+        if prefix is not None:
+            return prefix
+
+        if use_sudo:
+            test_sudo = os.system('setsid sudo -l < /dev/null')
+            if test_sudo != 0:
+                raise Exception('The dd-agent user does not have sudo access')
+
+        if not which(unbound_control, use_sudo, self.log):
+            raise ConfigurationError(f'executable not found: {unbound_control}')
+
+        prefix = self._command_prefixes[key] = ('sudo', unbound_control) if use_sudo else (unbound_control,)
+        return prefix
+
+    def get_control_client(self, instance):
+        if self._control_client is None:
+            host = instance.get('host')
+            interface = instance.get('control_interface') or (hostname_to_ip(host) if host else '127.0.0.1')
+            self._control_client = ControlClient(
+                interface,
+                use_cert=is_affirmative(instance.get('control_use_cert', True)),
+                key_file=instance.get('control_key_file', DEFAULT_KEY_FILE),
+                cert_file=instance.get('control_cert_file', DEFAULT_CERT_FILE),
+                server_cert_file=instance.get('server_cert_file', DEFAULT_SERVER_CERT_FILE),
+                timeout=instance.get('control_timeout', DEFAULT_TIMEOUT),
+            )
+        return self._control_client
+
+    def call_control_socket(self, instance, stats_command, tags):
+        try:
+            ub_out = self.get_control_client(instance).call(stats_command)
+        except Exception as e:
+            self.service_check(
+                self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="exception collecting stats", tags=tags
+            )
+            raise Exception(f"Unable to get unbound stats: {str(e)}")
 
-            unbound_metric_name = f'unbound.{metric_name}'
+        if not ub_out:
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="no stats", tags=tags)
+            raise Exception(f'no output from the control socket for "{stats_command}"')
 
-            if 'histogram' in metric_name:  # dont send histogram metrics
-                self.log.debug('unbound.%s:%s', unbound_metric_name, stat[1])
-            elif any(count in metric_name for count in ['num.', 'unwanted', '.count']):
-                self.log.debug('count: %s', stat)
-                self.count(unbound_metric_name, stat[1], tags=all_tags)
-            elif 'time.' in metric_name:
-                self.log.debug('gauge (time): %s', stat)
-                self.gauge(unbound_metric_name, float(stat[1]), tags=all_tags)
-            else:
-                self.log.debug('gauge: %s', stat)
-                self.gauge(unbound_metric_name, float(stat[1]), tags=all_tags)
+        return ub_out
 
     def call_unbound_control(self, command, tags):
         try:
@@ -105,108 +196,23 @@ class UnboundCheck(AgentCheck):
 
         return ub_out
 
-    def tag_handler(self, metric_name):
-        TAG_HANDLERS = {
-            'thread': self.thread_handler,
-            'num.query.type': self.query_type_handler,
-            'num.query.class': self.query_class_handler,
-            'num.query.opcode': self.query_opcode_handler,
-            'num.query.flags': self.query_flags_handler,
-            'num.answer.rcode': self.answer_rcode_handler,
-        }
-
-        handlers = [
-            TAG_HANDLERS[prefix]
-            for prefix in TAG_HANDLERS
-            if metric_name.startswith(prefix)
-        ]
-        num_handlers = len(handlers)
-        if num_handlers == 0:
-            return None
-        if num_handlers == 1:
-            return handlers[0]
-        raise Exception(f"more than one handler for '{metric_name}': {handlers}")
-
-    def query_type_handler(self, metric_name, tags):
-        # Split out the query type from the rest of the metric name
-        metric_name_parts = metric_name.rsplit('.', 1)
-        query_type = metric_name_parts[1]
-
-        orig_metric_name = metric_name
-        metric_name = metric_name_parts[0]
-
-        all_tags = tags + [f'query_type:{query_type}']
-        self.log.debug(
-            'translating query type metric %s to %s (query_type: %s)', orig_metric_name, metric_name, query_type
-        )
-        self.log.debug('all_tags: %s', all_tags)
-
-        return metric_name, all_tags
-
-    def query_class_handler(self, metric_name, tags):
-        # Split out the query class from the rest of the metric name
+    def last_segment_handler(self, tag_name, metric_name):
+        # Split out the last segment (e.g. the query type) from the rest of the metric name
         metric_name_parts = metric_name.rsplit('.', 1)
-        query_class = metric_name_parts[1]
-
-        orig_metric_name = metric_name
-        metric_name = metric_name_parts[0]
-
-        all_tags = tags + [f'query_class:{query_class}']
-        self.log.debug(
-            'translating query class metric %s to %s (query_class: %s)', orig_metric_name, metric_name, query_class
-        )
-        self.log.debug('all_tags: %s', all_tags)
-
-        return metric_name, all_tags
-
-    def query_opcode_handler(self, metric_name, tags):
-        # Split out the query opcode from the rest of the metric name
-        metric_name_parts = metric_name.rsplit('.', 1)
-        opcode = metric_name_parts[1]
-
-        orig_metric_name = metric_name
-        metric_name = metric_name_parts[0]
-
-        all_tags = tags + [f'opcode:{opcode}']
-        self.log.debug('translating query opcode metric %s to %s (opcode: %s)', orig_metric_name, metric_name, opcode)
-        self.log.debug('all_tags: %s', all_tags)
+        tag = f'{tag_name}:{metric_name_parts[1]}'
+        self.log.debug('translating %s metric %s to %s (%s)', tag_name, metric_name, metric_name_parts[0], tag)
 
-        return metric_name, all_tags
-
-    def query_flags_handler(self, metric_name, tags):
-        # Split out the query flag from the rest of the metric name
-        metric_name_parts = metric_name.rsplit('.', 1)
-        flag = metric_name_parts[1]
-
-        orig_metric_name = metric_name
-        metric_name = metric_name_parts[0]
-
-        all_tags = tags + [f'flag:{flag}']
-        self.log.debug('translating query flag metric %s to %s (flag: %s)', orig_metric_name, metric_name, flag)
-        self.log.debug('all_tags: %s', all_tags)
-
-        return metric_name, all_tags
-
-    def answer_rcode_handler(self, metric_name, tags):
-        # Split out the rcode from the rest of the metric name
-        metric_name_parts = metric_name.rsplit('.', 1)
-        rcode = metric_name_parts[1]
+        return metric_name_parts[0], tag
 
+    def answer_rcode_handler(self, metric_name):
         # Handle e.g. num.answer.rcode.NOERROR, but leave
         # num.answer.rcode.nodata along since it's special.
-        if rcode == 'nodata':
-            return metric_name, tags
+        if metric_name.endswith('.nodata'):
+            return metric_name, None
 
-        orig_metric_name = metric_name
-        metric_name = metric_name_parts[0]
-
-        all_tags = tags + [f'rcode:{rcode}']
-        self.log.debug('translating num.answer.rcode %s to %s (rcode: %s)', orig_metric_name, metric_name, rcode)
-        self.log.debug('all_tags: %s', all_tags)
-
-        return metric_name, all_tags
+        return self.last_segment_handler('rcode', metric_name)
 
-    def thread_handler(self, metric_name, tags):
+    def thread_handler(self, metric_name):
         # There are separate counters for each thread.  If we don't do any
         # massaging, it's difficult to define the complete set of possible
         # metrics that we might generate.  Instead, remove the thread number
@@ -223,13 +229,10 @@ class UnboundCheck(AgentCheck):
         orig_metric_name = metric_name
         metric_name = f'thread.{metric_name_parts[1]}'
 
-        # Add the thread number as a tag
-        all_tags = tags + [f'thread:{thread_num}']
-
         self.log.debug('translating thread metric %s to %s (thread_num: %s)', orig_metric_name, metric_name, thread_num)
-        self.log.debug('all_tags: %s', all_tags)
 
-        return metric_name, all_tags
+        # Add the thread number as a tag
+        return metric_name, f'thread:{thread_num}'
 
     def metric_name_to_tags(self, metric_name, tags):
         """Returns a tuple (metric_name, all_tags) where all_tags are the tags provided
@@ -238,13 +241,12 @@ class UnboundCheck(AgentCheck):
         # Some metrics from unbound make more sense to handle as name + tag in
         # datadog.  If nothing else, it makes metadata.csv more compact, but
         # also more predictable/future proof, as some metric names are dynamic.
-        handler = self.tag_handler(metric_name)
-        if handler is not None:
-            metric_name, all_tags = handler(metric_name, tags)
-        else:
-            all_tags = tags
+        handler = self.tag_handlers.longest_prefix_value(metric_name)
+        if handler is None:
+            return metric_name, tags
 
-        return metric_name, all_tags
+        metric_name, tag = handler(metric_name)
+        return metric_name, tags + [tag] if tag is not None else tags
 
 
 # From https://stackoverflow.com/a/377028.  Once we can depend on python
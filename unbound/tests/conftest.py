@@ -1,5 +1,9 @@
+import datetime
 import logging
 import os
+import socketserver
+import ssl
+import threading
 
 import mock
 import pytest
@@ -70,3 +74,114 @@ def env_setup(monkeypatch):
     log.debug('env_setup: no_sbin_path: %s', no_sbin_path)
     monkeypatch.setenv('PATH', no_sbin_path)
     log.debug('env_setup: after: PATH: %s', os.environ['PATH'])
+
+
+def write_certificates(directory):
+    """
+    Write the keys and certificates unbound-control-setup would create, the
+    self-signed server certificate signs the control certificate.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    server_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    control_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'unbound')])
+    control_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'unbound-control')])
+
+    def certificate(subject, key):
+        return (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(server_name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.BasicConstraints(ca=subject == server_name, path_length=None), critical=True)
+            .sign(server_key, hashes.SHA256())
+        )
+
+    paths = {}
+    for name, key, cert in (
+        ('unbound_server', server_key, certificate(server_name, server_key)),
+        ('unbound_control', control_key, certificate(control_name, control_key)),
+    ):
+        paths[f'{name}.key'] = str(directory / f'{name}.key')
+        paths[f'{name}.pem'] = str(directory / f'{name}.pem')
+        with open(paths[f'{name}.key'], 'wb') as f:
+            f.write(
+                key.private_bytes(
+                    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+                )
+            )
+        with open(paths[f'{name}.pem'], 'wb') as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return paths
+
+
+@pytest.fixture
+def unbound_control_server(tmp_path):
+    """
+    Start a local fake unbound remote-control server, yields a factory taking the
+    stats output to serve and whether to listen on a local socket or with TLS.
+    """
+    servers = []
+
+    def start(output, unix=False, use_cert=True):
+        ssl_context = None
+        paths = {}
+        if use_cert and not unix:
+            paths = write_certificates(tmp_path)
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(paths['unbound_server.pem'], paths['unbound_server.key'])
+            ssl_context.load_verify_locations(paths['unbound_server.pem'])
+            ssl_context.verify_mode = ssl.CERT_REQUIRED
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.connections += 1
+                line = self.rfile.readline().decode('ascii')
+                if not line.startswith('UBCT1 '):
+                    return
+                command = line[len('UBCT1 ') :].strip()
+                server.commands.append(command)
+                if command in ('stats', 'stats_noreset'):
+                    self.wfile.write(output.encode('utf-8'))
+                else:
+                    self.wfile.write(f"error unknown command '{command}'\n".encode('utf-8'))
+
+        if unix:
+            path = str(tmp_path / 'unbound.ctl')
+            server = socketserver.ThreadingUnixStreamServer(path, Handler)
+            server.interface = path
+        else:
+
+            class TLSServer(socketserver.ThreadingTCPServer):
+                allow_reuse_address = True
+
+                def get_request(self):
+                    sock, address = self.socket.accept()
+                    if ssl_context is not None:
+                        sock = ssl_context.wrap_socket(sock, server_side=True)
+                    return sock, address
+
+            server = TLSServer(('127.0.0.1', 0), Handler)
+            server.interface = '127.0.0.1@{}'.format(server.server_address[1])
+
+        server.daemon_threads = True
+        server.paths = paths
+        server.commands = []
+        server.connections = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
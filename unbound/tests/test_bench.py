@@ -0,0 +1,46 @@
+import os
+import re
+
+import mock
+import pytest
+
+from datadog_checks.dev import get_here
+from datadog_checks.unbound import UnboundCheck
+from datadog_checks.unbound.dispatch import iter_stats
+
+
+def make_stats(threads):
+    """Recorded extended stats output of a server running `threads` threads."""
+    with open(os.path.join(get_here(), 'fixtures', 'stats.extended.1.9.2'), 'r') as f:
+        lines = f.read().splitlines()
+
+    thread_lines = [line[len('thread0') :] for line in lines if line.startswith('thread0.')]
+    other_lines = [line for line in lines if not line.startswith('thread')]
+    stats = [f'thread{thread}{line}' for thread in range(threads) for line in thread_lines]
+    return '\n'.join(stats + other_lines) + '\n'
+
+
+@pytest.mark.parametrize('threads', [4, 256])
+@pytest.mark.parametrize('method', ['findall', 'tokenizer'])
+def test_parse_stats(benchmark, threads, method):
+    output = make_stats(threads)
+    if method == 'findall':
+        data = benchmark(re.findall, r'(\S+)=(.*\d)', output)
+    else:
+        data = benchmark(lambda: list(iter_stats(output)))
+    assert len(data) == 16 * threads + 103
+
+
+@pytest.mark.parametrize('threads', [4, 256])
+def test_check(benchmark, aggregator, mock_which, threads):
+    output = make_stats(threads)
+    check = UnboundCheck('unbound', {}, {})
+    instance = {'tags': ['foo:bar']}
+
+    def run():
+        aggregator.reset()
+        check.check(instance)
+
+    with mock.patch('datadog_checks.unbound.unbound.get_subprocess_output', return_value=(output, '', 0)):
+        benchmark(run)
+    assert len(aggregator.metrics('unbound.thread.num.queries')) == threads
@@ -5,6 +5,7 @@ import pytest
 
 from datadog_checks.base import AgentCheck, ConfigurationError
 from datadog_checks.unbound import UnboundCheck
+from datadog_checks.unbound.dispatch import PrefixTrie, iter_stats
 
 
 def test_nonexistent_unbound_control():
@@ -1794,3 +1795,126 @@ def assert_extended_stats_1_9_2(aggregator, tags):
     aggregator.assert_metric(
         'unbound.num.query.authzone.down', value=0, tags=tags, count=1, hostname=None, metric_type=aggregator.COUNT
     )
+
+
+def test_prefix_trie():
+    trie = PrefixTrie()
+    trie.add('thread', 'thread')
+    trie.add('num.query', 'query')
+    trie.add('num.query.type', 'type')
+
+    assert trie.longest_prefix_value('thread12.num.queries') == 'thread'
+    assert trie.longest_prefix_value('num.query.type.A') == 'type'
+    assert trie.longest_prefix_value('num.query.tcp') == 'query'
+    assert trie.longest_prefix_value('num.answer.secure') is None
+    assert trie.longest_prefix_value('thr', default='none') == 'none'
+
+
+def test_iter_stats():
+    output = 'total.num.queries=12\n\nfoo\ntime.up=26.067263 \nname=value\nunwanted.queries=3'
+    assert list(iter_stats(output)) == [
+        ('total.num.queries', '12'),
+        ('time.up', '26.067263'),
+        ('unwanted.queries', '3'),
+    ]
+
+
+def test_stats_dispatch_is_cached(aggregator, mock_which, mock_extended_stats_1_9_2):
+    check = UnboundCheck('unbound', {}, {})
+    tags = ['foo:bar']
+    with mock.patch.object(check, 'thread_handler', wraps=check.thread_handler):
+        check.tag_handlers = PrefixTrie()
+        check.tag_handlers.add('thread', check.thread_handler)
+        check.check({'tags': tags})
+        calls = check.thread_handler.call_count
+        check.check({'tags': tags})
+        assert check.thread_handler.call_count == calls
+
+    submitted = [m for m in aggregator.metrics('unbound.thread.num.queries') if 'thread:0' in m.tags]
+    assert [m.value for m in submitted] == [3, 3]
+
+
+def read_fixture(name):
+    with open(os.path.join(os.path.dirname(__file__), 'fixtures', name), 'r') as f:
+        return f.read()
+
+
+def test_command_prefix_is_cached(aggregator, mock_basic_stats_1_4_22):
+    check = UnboundCheck('unbound', {}, {})
+    with mock.patch('datadog_checks.unbound.unbound.which', return_value='arbitrary') as mock_which:
+        with mock.patch('datadog_checks.unbound.unbound.os.system', return_value=0) as mock_system:
+            for _ in range(3):
+                check.check({'use_sudo': True})
+
+    assert mock_which.call_count == 1
+    assert mock_system.call_count == 1
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK, count=3)
+
+
+def test_control_socket_tls(aggregator, unbound_control_server):
+    server = unbound_control_server(read_fixture('stats.basic.1.9.2'))
+    tags = ['foo:bar']
+    instance = {
+        'use_control_socket': True,
+        'control_interface': server.interface,
+        'control_key_file': server.paths['unbound_control.key'],
+        'control_cert_file': server.paths['unbound_control.pem'],
+        'server_cert_file': server.paths['unbound_server.pem'],
+        'stats_command': 'stats_noreset',
+        'tags': tags,
+    }
+    check = UnboundCheck('unbound', {}, [instance])
+
+    with mock.patch('datadog_checks.unbound.unbound.get_subprocess_output') as mock_subprocess:
+        check.check(instance)
+        client = check._control_client
+        check.check(instance)
+    mock_subprocess.assert_not_called()
+
+    assert check._control_client is client
+    assert server.commands == ['stats_noreset', 'stats_noreset']
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK, count=2)
+    submitted = [m for m in aggregator.metrics('unbound.thread.num.queries') if 'thread:0' in m.tags]
+    assert [m.value for m in submitted] == [1, 1]
+
+
+def test_control_socket_unix(aggregator, unbound_control_server):
+    server = unbound_control_server(read_fixture('stats.basic.1.9.2'), unix=True)
+    tags = ['foo:bar']
+    instance = {'use_control_socket': True, 'control_interface': server.interface, 'tags': tags}
+    check = UnboundCheck('unbound', {}, [instance])
+    check.check(instance)
+
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK)
+    assert_basic_stats_1_9_2(aggregator, tags)
+    aggregator.assert_all_metrics_covered()
+
+
+def test_control_socket_error(aggregator, unbound_control_server):
+    server = unbound_control_server(read_fixture('stats.basic.1.9.2'), use_cert=False)
+    instance = {
+        'use_control_socket': True,
+        'control_interface': server.interface,
+        'control_use_cert': False,
+        'stats_command': 'nostats',
+    }
+    check = UnboundCheck('unbound', {}, [instance])
+    with pytest.raises(Exception, match="Unable to get unbound stats: error unknown command 'nostats'"):
+        check.check(instance)
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.CRITICAL)
+
+
+def test_control_socket_untrusted_server(aggregator, unbound_control_server):
+    server = unbound_control_server(read_fixture('stats.basic.1.9.2'))
+    instance = {
+        'use_control_socket': True,
+        'control_interface': server.interface,
+        'control_key_file': server.paths['unbound_control.key'],
+        'control_cert_file': server.paths['unbound_control.pem'],
+        # Any certificate other than the server one
+        'server_cert_file': server.paths['unbound_control.pem'],
+    }
+    check = UnboundCheck('unbound', {}, [instance])
+    with pytest.raises(Exception, match='Unable to get unbound stats: .*CERTIFICATE_VERIFY_FAILED'):
+        check.check(instance)
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.CRITICAL)
@@ -9,16 +9,21 @@ import json
 import logging
 import os
 import re
-import subprocess
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import StringIO
 
 import requests
 from kubernetes import client, config
-from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.parser import text_fd_to_metric_families
 
 from datadog_checks.base import AgentCheck, ConfigurationError
 
 from .__about__ import __version__
+from .pod_inventory import DEFAULT_TTL, PodInventory
+from .port_forward import PortForwardManager
 
 # Agent Behavior
 #
@@ -37,6 +42,9 @@ NAME_IDX = 0
 LABEL_IDX = 1
 VALUE_IDX = 2
 
+# Characters ending a metric name in a Prometheus sample line
+METRIC_NAME_END_RE = re.compile(r'[{\s]')
+
 # Upbound predefined metric set categories
 METRICS_DEFAULTS = ['none', 'min', 'more', 'max']
 
@@ -45,7 +53,7 @@ METRICS_DEFAULTS = ['none', 'min', 'more', 'max']
 # DataDog config yaml file and if there are no pod
 # annotations for the Universal Crossplane and provider
 # pods.
-METRICS_DEFAULT_MIN_SET = [
+METRICS_DEFAULT_MIN_SET = frozenset([
     # Upjet provider Terraform CLI invocations
     'upjet_terraform_active_cli_invocations',
     # Upjet provider Terraform running processes
@@ -76,10 +84,10 @@ METRICS_DEFAULT_MIN_SET = [
     'workqueue_work_duration_seconds_bucket',
     'workqueue_work_duration_seconds_count',
     'workqueue_work_duration_seconds_sum',
-]
+])
 
-# Upbound recommended set of metrics
-METRICS_DEFAULT_MORE_SET = [
+# Upbound recommended set of metrics, in addition to the min set
+METRICS_DEFAULT_MORE_SET = frozenset([
     # Upjet provider Terraform CLI duration
     'upjet_terraform_cli_duration',
     # Upjet provider Terraform resource time to reconcile
@@ -184,7 +192,39 @@ METRICS_DEFAULT_MORE_SET = [
     # threads. One can deduce the number of stuck
     # threads by observing the rate at which this increases.
     'workqueue_unfinished_work_seconds',
-]
+])
+
+
+class MetricFilter(object):
+    """
+    Immutable allow-list of Prometheus metric names.
+
+    Exact names are kept in a frozenset, prefixes and regular
+    expressions are compiled into a single combined pattern
+    matched from the start of the metric name. The outcome for
+    names only matched through the pattern is memoized.
+    """
+
+    def __init__(self, names=(), prefixes=(), patterns=()):
+        self.names = frozenset(names)
+        self.prefixes = tuple(prefixes)
+        self.patterns = tuple(patterns)
+
+        alternatives = [re.escape(prefix) for prefix in self.prefixes]
+        alternatives.extend(f'(?:{pattern})' for pattern in self.patterns)
+        self._matcher = re.compile('|'.join(alternatives)).match if alternatives else None
+        self._matched = {}
+
+    def __contains__(self, name):
+        if name in self.names:
+            return True
+        if self._matcher is None:
+            return False
+
+        matched = self._matched.get(name)
+        if matched is None:
+            matched = self._matched[name] = self._matcher(name) is not None
+        return matched
 
 
 class UpboundUxpCheck(AgentCheck):
@@ -287,6 +327,25 @@ class UpboundUxpCheck(AgentCheck):
 
                 self.check_count = 0
 
+                self.max_workers = instance.get('max_workers')
+                if self.max_workers is None:
+                    self.max_workers = 4
+                else:
+                    self._raise_if_type_err(self.max_workers, 'max_workers', 'int')
+                if self.max_workers < 1:
+                    self._raise_format_err('max_workers', 'Expected a positive number of workers.')
+
+                self.pod_cache_ttl = instance.get('pod_cache_ttl')
+                if self.pod_cache_ttl is None:
+                    self.pod_cache_ttl = DEFAULT_TTL
+                else:
+                    self._raise_if_type_err(self.pod_cache_ttl, 'pod_cache_ttl', 'int')
+                self.pod_inventory = None
+
+                self.port_forwards = PortForwardManager(
+                    f'{self.home}/uxp.kubeconfig', self.namespace, self.uxp_port, self.log
+                )
+
                 if instance.get('metrics_limit') is not None:
                     DEFAULT_METRIC_LIMIT = instance.get('metrics_limit')
                     self._raise_if_type_err(DEFAULT_METRIC_LIMIT, 'DEFAULT_METRIC_LIMIT', 'int')
@@ -318,6 +377,23 @@ class UpboundUxpCheck(AgentCheck):
                 if self.metrics_default not in METRICS_DEFAULTS:
                     self.metrics_default = 'min'
 
+                self.metrics_include_prefixes = instance.get('metrics_include_prefixes')
+                if self.metrics_include_prefixes is None:
+                    self.metrics_include_prefixes = []
+                else:
+                    self._raise_if_type_err(self.metrics_include_prefixes, 'metrics_include_prefixes', 'list')
+
+                self.metrics_include_patterns = instance.get('metrics_include_patterns')
+                if self.metrics_include_patterns is None:
+                    self.metrics_include_patterns = []
+                else:
+                    self._raise_if_type_err(self.metrics_include_patterns, 'metrics_include_patterns', 'list')
+                for pattern in self.metrics_include_patterns:
+                    try:
+                        re.compile(pattern)
+                    except (re.error, TypeError) as e:
+                        self._raise_format_err('metrics_include_patterns', f'Invalid regular expression {pattern}: {e}')
+
                 # Determine which exposed metrics to observe and
                 # feed into DataDog. Note, this will work without
                 # pod annotations.
@@ -325,15 +401,15 @@ class UpboundUxpCheck(AgentCheck):
                 self.metrics_set = []
                 self.metrics_map = {}
                 if self.metrics_default == 'min':
-                    self.metrics_set = METRICS_DEFAULT_MIN_SET
+                    self.metrics_set = sorted(METRICS_DEFAULT_MIN_SET)
                 elif self.metrics_default == 'more':
-                    self.metrics_set = METRICS_DEFAULT_MIN_SET
-                    self.metrics_set.extend(METRICS_DEFAULT_MORE_SET)
+                    self.metrics_set = sorted(METRICS_DEFAULT_MIN_SET | METRICS_DEFAULT_MORE_SET)
 
                 # No metrics set is needed to compare against
                 # when collecting the max or none.
 
                 self.metrics_set = self._merge_conf()
+                self.metric_filter = self._build_metric_filter(self.metrics_set)
                 if self.verbose:
                     self.log.debug(self.metrics_set)
 
@@ -403,9 +479,24 @@ class UpboundUxpCheck(AgentCheck):
 
         return m
 
+    # Build the filter engine of the observed metrics,
+    # None means every metric is collected.
+
+    def _build_metric_filter(self, metrics_set, prefixes=None, patterns=None):
+        if self.metrics_default == 'max':
+            return None
+        if prefixes is None:
+            prefixes = self.metrics_include_prefixes
+        if patterns is None:
+            patterns = self.metrics_include_patterns
+        return MetricFilter(metrics_set, prefixes, patterns)
+
+    # Pod annotations supersede the metrics selected in the
+    # configuration, returns the metric filter to apply to the pod.
+
     def _merge_annotations(self, annotations, pod_name):
         if self.metrics_ignore_pod_annotations:
-            return self.metrics_set
+            return self.metric_filter
 
         key_match_start = f'ad.datadoghq.com/uxp.{pod_name}'
         m = []
@@ -430,7 +521,7 @@ class UpboundUxpCheck(AgentCheck):
                             continue
 
         # When there are no pod annotations, use the default metrics set
-        return self.metrics_set if not m else m
+        return self.metric_filter if not m else self._build_metric_filter(m, prefixes=(), patterns=())
 
     def check(self, instance):
         if self.verbose:
@@ -439,28 +530,8 @@ class UpboundUxpCheck(AgentCheck):
         incluster = True
 
         if self.uxp_hosts:
-            for host in self.uxp_hosts:
-                try:
-                    response = requests.get(
-                        f'http://{host}:{self.uxp_port}{self.uxp_url}', timeout=200
-                    )
-                    metrics = response.text
-                except Exception as e:
-                    # We were unable to get metrics for this host.
-                    # Let's continue with the next one.
-
-                    self.log.exception(e)
-                    sys.stdout.flush()
-                    self.service_check(
-                        self.SERVICE_CHECK_CONNECT_NAME,
-                        self.CRITICAL,
-                        message="Error {0}".format(e),
-                        tags=None,
-                        hostname=host,
-                    )
-                    continue
-
-                self.get_metrics(metrics, host)
+            targets = [(host, f'http://{host}:{self.uxp_port}{self.uxp_url}', None, host) for host in self.uxp_hosts]
+            self._scrape_targets(targets)
 
             self.count(
                 'datadog_agent_checks',
@@ -481,12 +552,19 @@ class UpboundUxpCheck(AgentCheck):
         # Get Pods in upbound-system or another namespace
         # is overwritten in the upbound_uxp (auth_conf.yaml)
         # config file
+        if 'KUBERNETES_SERVICE_HOST' not in os.environ and 'KUBERNETES_SERVICE_PORT' not in os.environ:
+            incluster = False
         try:
-            if 'KUBERNETES_SERVICE_HOST' not in os.environ and 'KUBERNETES_SERVICE_PORT' not in os.environ:
-                incluster = False
-                config.load_kube_config(f"{self.home}/uxp.kubeconfig")
-            else:
-                config.load_incluster_config()
+            # The configuration and the pod inventory are kept
+            # once loaded, pods are refreshed by the inventory.
+            if self.pod_inventory is None:
+                if not incluster:
+                    config.load_kube_config(f"{self.home}/uxp.kubeconfig")
+                else:
+                    config.load_incluster_config()
+                self.pod_inventory = PodInventory(
+                    client.CoreV1Api(), self.namespace, self._merge_annotations, self.log, ttl=self.pod_cache_ttl
+                )
         except Exception as e:
             # Without the config, we will not be
             # able to get pods and their metrics
@@ -497,71 +575,137 @@ class UpboundUxpCheck(AgentCheck):
             raise
         self.service_check(self.SERVICE_CHECK_CONNECT_NAME, self.OK, message=None, tags=None, hostname=None)
 
-        v1 = client.CoreV1Api()
-        pods = []
+        # Pod annotations overwrite the config file and default
+        # metric set. If no pod annotations are present then the
+        # upbound_uxp (auto_conf.yaml) config file determines the
+        # metrics to scrape. If no metrics selection is included in
+        # the config file, then the minimum default is selected
+        # automatically. The inventory parses the annotations when
+        # pods are discovered or their annotations change.
+        pods = self.pod_inventory.get_pods()
+
+        targets = []
+        for pod in pods:
+            if incluster:
+                url = f'http://{pod.pod_ip}:{self.uxp_port}{self.uxp_url}'
+            else:
+                # Resolved through the pod port-forward by the scraping worker
+                url = None
+            targets.append((pod.name, url, pod.metric_filter, pod.pod_ip))
+
+        if not incluster:
+            self.port_forwards.prune({pod.name for pod in pods})
+
+        self._scrape_targets(targets)
+
+    # Scrape targets concurrently through the shared HTTP session.
+    # Workers only open the streamed responses, the payloads are read
+    # and parsed line by line in this thread, in the order the
+    # responses arrive. A target is (name, url, metric filter,
+    # hostname), a target without url is a pod scraped through its
+    # port-forward.
+
+    def _scrape_targets(self, targets):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._scrape, target[0], target[1]): target for target in targets}
+            for future in as_completed(futures):
+                target_name, url, metric_filter, hostname = futures[future]
+                try:
+                    with future.result() as response:
+                        self.get_metrics(self._iter_response_lines(response), target_name, metric_filter)
+                except Exception as e:
+                    if url is None and isinstance(e, requests.exceptions.ConnectionError):
+                        # The port-forward broke while streaming, it will be restarted on the next run
+                        self.port_forwards.stop(target_name)
+
+                    # We were unable to get metrics for this target.
+                    # Let's continue with the next one.
+
+                    self.log.exception(e)
+                    sys.stdout.flush()
+                    self.service_check(
+                        self.SERVICE_CHECK_CONNECT_NAME,
+                        self.CRITICAL,
+                        message="Error {0}".format(e),
+                        tags=None,
+                        hostname=hostname,
+                    )
 
+    def _scrape(self, target_name, url):
+        if url is not None:
+            return self.http.get(url, timeout=200, persist=True, stream=True)
+
+        local_port = self.port_forwards.get_local_port(target_name)
         try:
-            pods = v1.list_namespaced_pod(self.namespace)
-        except Exception as e:
+            return self.http.get(
+                f'http://localhost:{local_port}{self.uxp_url}', timeout=200, persist=True, stream=True
+            )
+        except requests.exceptions.ConnectionError:
+            # The port-forward is broken, it will be restarted on the next run
+            self.port_forwards.stop(target_name)
             raise
 
-        port_forward_target = 8080
-        for pod in pods.items:
-            # Get Pod annotations to overwrite config file and
-            # default metric set. If no pod annotations are present
-            # then the upbound_uxp (auto_conf.yaml) config file
-            # determines the metrics to scrape. If no metrics
-            # selection is included in the config file, then
-            # the minimum default is selected automatically.
-
-            self.metrics_set = self._merge_annotations(pod.metadata.annotations, pod.metadata.name)
+    @staticmethod
+    def _iter_response_lines(response):
+        # Stream the payload instead of loading the whole body in memory
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        return response.iter_lines(decode_unicode=True)
+
+    def cancel(self):
+        self.port_forwards.close()
+
+    # Filter the exposition lines before they reach the Prometheus
+    # parser. Sample lines of metrics that are not observed are
+    # dropped without being parsed, HELP and TYPE lines are consumed
+    # here so the parser only sees samples. The declared type of
+    # every forwarded sample is queued in metric_types, in order.
+    # The number of samples evaluated and dropped and the time spent
+    # evaluating the filter are accumulated in filter_stats.
+
+    def _filter_lines(self, lines, metric_filter, metric_types, filter_stats):
+        metric_type = ''
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#'):
+                # Determine metrics type based on info
+                # in the metrics feed, example format is
+                # TYPE workqueue_work_duration_seconds histogram
+                if line.startswith('# TYPE'):
+                    try:
+                        metric_type = line.split(' ')[3]
+                    except Exception as e:
+                        self.log.exception(e)
+                        metric_type = ''
+                continue
 
-            metrics = ''
-            try:
-                if not incluster:
-                    port_forward_target_str = str(port_forward_target)
-                    cmd1 = f'kubectl --kubeconfig {self.home}/uxp.kubeconfig '
-                    cmd2 = f'-n {self.namespace} port-forward '
-                    cmd3 = f'pods/{pod.metadata.name} '
-                    cmd4 = f'{port_forward_target_str}:{self.uxp_port}'
-                    cmd = cmd1 + cmd2 + cmd3 + cmd4
-                    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-                    port_forward_info = p.stdout.readline()
-                    if self.verbose:
-                        self.log.debug(port_forward_info)
-                    response = requests.get(
-                        f'http://localhost:{port_forward_target_str}{self.uxp_url}',
-                        timeout=200,
-                    )
-                    metrics = response.text
-                    p.terminate()
-                else:
-                    response = requests.get(
-                        f'http://{pod.status.pod_ip}:{self.uxp_port}{self.uxp_url}',
-                        timeout=200,
-                    )
-                    metrics = response.text
-            except Exception as e:
-                # We were unable to get metrics for this pod.
-                # Let's continue with the next one.
-
-                self.log.exception(e)
-                sys.stdout.flush()
-                self.service_check(
-                    self.SERVICE_CHECK_CONNECT_NAME,
-                    self.CRITICAL,
-                    message="Error {0}".format(e),
-                    tags=None,
-                    hostname=pod.status.pod_ip,
-                )
+            if not line:
                 continue
 
-            self.get_metrics(metrics, pod.metadata.name)
+            if metric_filter is not None:
+                filter_start = time.perf_counter()
+                observed = METRIC_NAME_END_RE.split(line, 1)[0] in metric_filter
+                filter_stats['time'] += time.perf_counter() - filter_start
+                filter_stats['samples'] += 1
+                if not observed:
+                    filter_stats['dropped'] += 1
+                    continue
+
+            metric_types.append(metric_type)
+            yield line
 
-    def get_metrics(self, metrics, target_name):
-        metrics_map_keys = list(self.metrics_map.keys())
+    def get_metrics(self, metrics, target_name, metric_filter=None):
+        """Parse a Prometheus text payload in a single pass and submit the observed metrics.
+
+        `metrics` is either the whole payload or an iterable of its lines, e.g. a streamed response.
+        `metric_filter` defaults to the metrics selected in the configuration.
+        """
+        start_time = time.time()
+        if metric_filter is None:
+            metric_filter = self.metric_filter
+        if isinstance(metrics, str):
+            metrics = StringIO(metrics)
 
-        metric_type = ''
         metrics_prefix = ''
         if self.metrics_prefix is not None:
             if len(self.metrics_prefix) > 0:
@@ -572,69 +716,59 @@ class UpboundUxpCheck(AgentCheck):
             self.log.debug("Mapping metrics names")
             self.log.debug(self.metrics_map)
 
-        for line in metrics.split('\n'):
-            if line.startswith('#'):
-                # Determine metrics type based on info
-                # in the metrics feed, example format is
-                # TYPE workqueue_work_duration_seconds histogram
-                if line.startswith('# TYPE'):
+        # Without TYPE lines every sample is yielded as its own family
+        metric_types = deque()
+        filter_stats = {'samples': 0, 'dropped': 0, 'time': 0.0}
+        samples = self._filter_lines(metrics, metric_filter, metric_types, filter_stats)
+        for family in text_fd_to_metric_families(samples):
+            for sample in family.samples:
+                metric_type = metric_types.popleft()
+                name = sample[NAME_IDX]
+                tags = self._labels_to_tags(sample[LABEL_IDX], target_name)
+                value = sample[VALUE_IDX]
+
+                if name in self.metrics_map:
+                    if self.verbose:
+                        self.log.debug("Sending metric: %s as: %s", name, self.metrics_map[name])
+                    name = self.metrics_map[name]
+                name = metrics_prefix + name
+
+                if name.endswith('sum'):
+                    metric_type = 'summary'
+                if name.endswith('count'):
+                    metric_type = 'counter'
+                if name.endswith('bucket'):
+                    metric_type = 'histogram'
+
+                # counter: _total
+                if metric_type == 'counter':
+                    if self.verbose:
+                        self.log.debug("%s: Name: %s, Tags: %s, Value: %s", metric_type, name, tags, str(value))
                     try:
-                        metric_type = line.split(' ')[3]
+                        self.count(name, value, tags=tags)
                     except Exception as e:
                         self.log.exception(e)
-                        metric_type = ''
-
-                # Continue to metrics line
-                continue
-
-            for family in text_string_to_metric_families(line):
-                for sample in family.samples:
-                    name = sample[NAME_IDX]
-                    tags = self._labels_to_tags(sample[LABEL_IDX], target_name)
-                    value = sample[VALUE_IDX]
-
-                    if self.metrics_default != 'max' and name not in self.metrics_set:
-                        continue
-
-                    if name in metrics_map_keys:
-                        if self.verbose:
-                            self.log.debug("Sending metric: %s as: %s", name, self.metrics_map[name])
-                        name = self.metrics_map[name]
-                    name = metrics_prefix + name
-
-                    if name.endswith('sum'):
-                        metric_type = 'summary'
-                    if name.endswith('count'):
-                        metric_type = 'counter'
-                    if name.endswith('bucket'):
-                        metric_type = 'histogram'
-
-                    # counter: _total
-                    if metric_type == 'counter':
-                        if self.verbose:
-                            self.log.debug("%s: Name: %s, Tags: %s, Value: %s", metric_type, name, tags, str(value))
-                        try:
-                            self.count(name, value, tags=tags)
-                        except Exception as e:
-                            self.log.exception(e)
-                    elif (
-                        metric_type == 'histogram'
-                        or metric_type != 'summary'
-                        and metric_type == 'gauge'
-                    ):
-                        if self.verbose:
-                            self.log.debug("%s: Name: %s, Tags: %s, Value: %s", metric_type, name, tags, str(value))
-                        try:
-                            # self.histogram(name, value, tags=tags)
-                            self.gauge(name, value, tags=tags)
-                        except Exception as e:
-                            self.log.exception(e)
-                    elif metric_type == 'summary':
-                        if self.verbose:
-                            self.log.debug("%s: Name: %s, Labels: %s, Value: %s", metric_type, name, tags, str(value))
-                        try:
-                            self.count(name, value, tags=tags)
-                        except Exception as e:
-                            self.log.exception(e)
-                    else:
-                        self.log.warning("WARNING: metric type %s unknown for %s", metric_type, name)
+                elif metric_type == 'histogram' or metric_type != 'summary' and metric_type == 'gauge':
+                    if self.verbose:
+                        self.log.debug("%s: Name: %s, Tags: %s, Value: %s", metric_type, name, tags, str(value))
+                    try:
+                        # self.histogram(name, value, tags=tags)
+                        self.gauge(name, value, tags=tags)
+                    except Exception as e:
+                        self.log.exception(e)
+                elif metric_type == 'summary':
+                    if self.verbose:
+                        self.log.debug("%s: Name: %s, Labels: %s, Value: %s", metric_type, name, tags, str(value))
+                    try:
+                        self.count(name, value, tags=tags)
+                    except Exception as e:
+                        self.log.exception(e)
+                else:
+                    self.log.warning("WARNING: metric type %s unknown for %s", metric_type, name)
+
+        internal_tags = [f'pod:{target_name}', f'agent_integration_version={__version__}']
+        self.gauge('datadog_agent_parse_time_seconds', time.time() - start_time, tags=internal_tags)
+        if metric_filter is not None:
+            self.gauge('datadog_agent_filter_time_seconds', filter_stats['time'], tags=internal_tags)
+            self.gauge('datadog_agent_filter_samples', filter_stats['samples'], tags=internal_tags)
+            self.gauge('datadog_agent_filter_dropped_samples', filter_stats['dropped'], tags=internal_tags)
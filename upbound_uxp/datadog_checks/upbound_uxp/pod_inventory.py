@@ -0,0 +1,114 @@
+# Cache of the Crossplane and provider pods to scrape, kept up
+# to date with the pod events since the last known resourceVersion.
+
+import time
+from collections import namedtuple
+
+from kubernetes import watch
+
+DEFAULT_TTL = 60
+DEFAULT_WATCH_TIMEOUT = 1
+
+CachedPod = namedtuple('CachedPod', ['uid', 'name', 'pod_ip', 'annotations', 'metric_filter'])
+
+
+class PodInventory(object):
+    """
+    Inventory of the pods of a namespace.
+
+    The pods are listed once, later refreshes only apply the
+    events that happened since the last seen resourceVersion and
+    fall back to a full list when that version expired. Between
+    refreshes, at most every `ttl` seconds, no API call is made.
+
+    The pod annotations are parsed with `parse_annotations` when
+    a pod is discovered or its annotations change, the result is
+    cached with the pod.
+    """
+
+    def __init__(
+        self,
+        api,
+        namespace,
+        parse_annotations,
+        log,
+        ttl=DEFAULT_TTL,
+        watch_timeout=DEFAULT_WATCH_TIMEOUT,
+        watch_factory=watch.Watch,
+        time_func=time.time,
+    ):
+        self.api = api
+        self.namespace = namespace
+        self.log = log
+        self.ttl = ttl
+        self.watch_timeout = watch_timeout
+        self._parse_annotations = parse_annotations
+        self._watch_factory = watch_factory
+        self._time = time_func
+
+        self._pods = {}
+        self._resource_version = None
+        self._next_refresh = 0
+
+    def get_pods(self):
+        """Return the cached pods, refreshing them once the TTL expired."""
+        now = self._time()
+        if now >= self._next_refresh:
+            self.refresh()
+            self._next_refresh = now + self.ttl
+        return list(self._pods.values())
+
+    def refresh(self):
+        if self._resource_version is not None:
+            try:
+                if self._watch():
+                    return
+            except Exception as e:
+                self.log.debug("Unable to watch pods since resourceVersion %s: %s", self._resource_version, e)
+        self._list()
+
+    def _list(self):
+        pod_list = self.api.list_namespaced_pod(self.namespace)
+        uids = set()
+        for pod in pod_list.items:
+            self._update(pod)
+            uids.add(pod.metadata.uid)
+        for uid in list(self._pods):
+            if uid not in uids:
+                del self._pods[uid]
+        self._resource_version = pod_list.metadata.resource_version
+
+    # Apply the pod events since the last resourceVersion, returns
+    # False when the version expired and a full list is needed.
+
+    def _watch(self):
+        pod_watch = self._watch_factory()
+        try:
+            for event in pod_watch.stream(
+                self.api.list_namespaced_pod,
+                self.namespace,
+                resource_version=self._resource_version,
+                timeout_seconds=self.watch_timeout,
+            ):
+                if event['type'] == 'ERROR':
+                    return False
+
+                pod = event['object']
+                if event['type'] == 'DELETED':
+                    self._pods.pop(pod.metadata.uid, None)
+                else:
+                    self._update(pod)
+                self._resource_version = pod.metadata.resource_version
+        finally:
+            pod_watch.stop()
+        return True
+
+    def _update(self, pod):
+        uid = pod.metadata.uid
+        annotations = pod.metadata.annotations
+        cached = self._pods.get(uid)
+        if cached is not None and cached.annotations == annotations:
+            metric_filter = cached.metric_filter
+        else:
+            metric_filter = self._parse_annotations(annotations, pod.metadata.name)
+        self._pods[uid] = CachedPod(uid, pod.metadata.name, pod.status.pod_ip, annotations, metric_filter)
@@ -0,0 +1,172 @@
+# Long lived kubectl port-forwards used to scrape the Crossplane
+# and provider pods when the agent runs out of cluster.
+
+import re
+import subprocess
+import threading
+import time
+
+# kubectl reports the local port it picked, example format is
+# Forwarding from 127.0.0.1:41847 -> 8080
+FORWARDING_RE = re.compile(r'Forwarding from [^\s]*:(\d+) ->')
+
+DEFAULT_MIN_BACKOFF = 1
+DEFAULT_MAX_BACKOFF = 300
+
+
+class PortForwardError(Exception):
+    pass
+
+
+class PortForward(object):
+    """
+    A single kubectl port-forward to a pod, the local port is
+    allocated by kubectl and read from its output.
+    """
+
+    def __init__(self, process, local_port):
+        self.process = process
+        self.local_port = local_port
+        self.drain_thread = None
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class PortForwardManager(object):
+    """
+    Keeps one port-forward per pod alive across check runs.
+
+    Dead port-forwards are restarted on the next request, pods
+    whose port-forward fails to start are retried with an
+    exponential backoff. `popen` and `time_func` can be replaced
+    to test without kubectl.
+    """
+
+    def __init__(
+        self,
+        kubeconfig,
+        namespace,
+        remote_port,
+        log,
+        min_backoff=DEFAULT_MIN_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        popen=subprocess.Popen,
+        time_func=time.time,
+    ):
+        self.kubeconfig = kubeconfig
+        self.namespace = namespace
+        self.remote_port = remote_port
+        self.log = log
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._popen = popen
+        self._time = time_func
+
+        self._lock = threading.Lock()
+        self._forwards = {}
+        # pod name -> (consecutive failures, next retry time)
+        self._backoff = {}
+
+    def _command(self, pod_name):
+        return [
+            'kubectl',
+            '--kubeconfig',
+            self.kubeconfig,
+            '-n',
+            self.namespace,
+            'port-forward',
+            f'pods/{pod_name}',
+            f':{self.remote_port}',
+        ]
+
+    def _start(self, pod_name):
+        # stderr goes to the same pipe, so that kubectl errors are reported and only one pipe is drained
+        process = self._popen(self._command(pod_name), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output = []
+        match = None
+        for line in process.stdout:
+            self.log.debug(line)
+            output.append(line.strip())
+            match = FORWARDING_RE.search(line)
+            if match is not None:
+                break
+
+        if match is None:
+            if process.poll() is None:
+                process.terminate()
+            raise PortForwardError(f'Unable to port-forward to pod {pod_name}: {" ".join(output)}')
+
+        forward = PortForward(process, int(match.group(1)))
+        # kubectl logs every connection, the pipe is drained until it exits so that it never blocks on a full pipe
+        forward.drain_thread = threading.Thread(
+            target=self._drain, args=(process, pod_name), name=f'port-forward-{pod_name}', daemon=True
+        )
+        forward.drain_thread.start()
+        return forward
+
+    def _drain(self, process, pod_name):
+        try:
+            for line in process.stdout:
+                self.log.debug("Port-forward to pod %s: %s", pod_name, line.rstrip())
+        except (OSError, ValueError):
+            # The pipe was closed
+            pass
+
+    def get_local_port(self, pod_name):
+        """Return the local port forwarded to the pod, (re)starting the port-forward when needed."""
+        with self._lock:
+            forward = self._forwards.get(pod_name)
+            if forward is not None:
+                if forward.is_alive():
+                    return forward.local_port
+                self.log.debug("Port-forward to pod %s exited, restarting it", pod_name)
+                del self._forwards[pod_name]
+
+            failures, next_retry = self._backoff.get(pod_name, (0, 0))
+            now = self._time()
+            if now < next_retry:
+                raise PortForwardError(
+                    f'Port-forward to pod {pod_name} is backing off for {next_retry - now:.0f} more seconds'
+                )
+
+        try:
+            forward = self._start(pod_name)
+        except Exception:
+            with self._lock:
+                delay = min(self.min_backoff * 2**failures, self.max_backoff)
+                self._backoff[pod_name] = (failures + 1, self._time() + delay)
+            raise
+
+        with self._lock:
+            self._backoff.pop(pod_name, None)
+            self._forwards[pod_name] = forward
+        return forward.local_port
+
+    def stop(self, pod_name):
+        """Stop the port-forward to the pod, the next request will start a new one."""
+        with self._lock:
+            forward = self._forwards.pop(pod_name, None)
+        if forward is not None:
+            forward.stop()
+
+    def prune(self, pod_names):
+        """Stop the port-forwards to pods that are not in `pod_names` anymore."""
+        with self._lock:
+            stale = [pod_name for pod_name in self._forwards if pod_name not in pod_names]
+            for pod_name in list(self._backoff):
+                if pod_name not in pod_names:
+                    del self._backoff[pod_name]
+        for pod_name in stale:
+            self.stop(pod_name)
+
+    def close(self):
+        self.prune(())
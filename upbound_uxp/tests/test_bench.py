@@ -0,0 +1,36 @@
+import pytest
+
+from datadog_checks.upbound_uxp import UpboundUxpCheck
+
+PAYLOAD_LINES = 50000
+
+
+def make_payload(num_lines):
+    """Build a Prometheus payload with `num_lines` lines mixing observed and ignored metric families."""
+    families = [
+        ('controller_runtime_reconcile_total', 'counter'),
+        ('go_goroutines', 'gauge'),
+        ('workqueue_depth', 'gauge'),
+        ('certwatcher_read_certificate_total', 'counter'),
+        ('go_memstats_heap_objects', 'gauge'),
+        ('rest_client_request_duration_seconds_bucket', 'histogram'),
+    ]
+    lines = []
+    i = 0
+    while len(lines) < num_lines:
+        name, metric_type = families[i % len(families)]
+        lines.append(f'# HELP {name} Generated metric')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for j in range(98):
+            lines.append(f'{name}{{controller="controller-{i}-{j}",result="success"}} {j}')
+        i += 1
+    return '\n'.join(lines[:num_lines])
+
+
+@pytest.mark.parametrize('metrics_default', ['min', 'max'])
+def test_get_metrics(benchmark, metrics_default):
+    check = UpboundUxpCheck('upbound_uxp', {}, [{'metrics_default': metrics_default, 'uxp_hosts': ['localhost']}])
+    check.count = check.gauge = lambda *args, **kwargs: None
+    payload = make_payload(PAYLOAD_LINES)
+
+    benchmark.pedantic(check.get_metrics, args=(payload, 'localhost'), rounds=5, warmup_rounds=1)
@@ -0,0 +1,165 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from datadog_checks.upbound_uxp import UpboundUxpCheck
+from datadog_checks.upbound_uxp.pod_inventory import PodInventory
+
+LOG = logging.getLogger(__name__)
+
+
+def make_pod(name, resource_version, annotations=None, pod_ip='10.0.0.1'):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(
+            uid=f'uid-{name}', name=name, annotations=annotations, resource_version=str(resource_version)
+        ),
+        status=SimpleNamespace(pod_ip=pod_ip),
+    )
+
+
+class FakeCoreV1Api(object):
+    def __init__(self, pods, resource_version):
+        self.pods = pods
+        self.resource_version = str(resource_version)
+        self.list_calls = 0
+
+    def list_namespaced_pod(self, namespace, **kwargs):
+        self.list_calls += 1
+        return SimpleNamespace(items=list(self.pods), metadata=SimpleNamespace(resource_version=self.resource_version))
+
+
+class FakeWatch(object):
+    """Replays the queued events of the next watch, records the resourceVersion it was started from."""
+
+    def __init__(self):
+        self.events = []
+        self.started_from = []
+
+    def __call__(self):
+        return self
+
+    def stream(self, func, namespace, resource_version=None, timeout_seconds=None):
+        self.started_from.append(resource_version)
+        events, self.events = self.events, []
+        return iter(events)
+
+    def stop(self):
+        pass
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AnnotationsParser(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, annotations, pod_name):
+        self.calls.append(pod_name)
+        return frozenset(annotations or ())
+
+
+def make_inventory(api, parser=None, fake_watch=None, clock=None):
+    return PodInventory(
+        api,
+        'upbound-system',
+        parser or AnnotationsParser(),
+        LOG,
+        ttl=60,
+        watch_factory=fake_watch or FakeWatch(),
+        time_func=clock or FakeClock(),
+    )
+
+
+@pytest.mark.unit
+def test_steady_state_uses_cache():
+    api = FakeCoreV1Api([make_pod('crossplane', 5), make_pod('provider', 6)], 10)
+    parser = AnnotationsParser()
+    fake_watch = FakeWatch()
+    clock = FakeClock()
+    inventory = make_inventory(api, parser, fake_watch, clock)
+
+    assert sorted(pod.name for pod in inventory.get_pods()) == ['crossplane', 'provider']
+    for _ in range(3):
+        clock.now += 15
+        assert len(inventory.get_pods()) == 2
+
+    assert api.list_calls == 1
+    assert fake_watch.started_from == []
+    assert parser.calls == ['crossplane', 'provider']
+
+
+@pytest.mark.unit
+def test_refresh_applies_events_since_resource_version():
+    api = FakeCoreV1Api([make_pod('crossplane', 5), make_pod('provider', 6)], 10)
+    parser = AnnotationsParser()
+    fake_watch = FakeWatch()
+    clock = FakeClock()
+    inventory = make_inventory(api, parser, fake_watch, clock)
+    inventory.get_pods()
+
+    fake_watch.events = [
+        {'type': 'ADDED', 'object': make_pod('provider-aws', 11, pod_ip='10.0.0.3')},
+        {'type': 'MODIFIED', 'object': make_pod('crossplane', 12, pod_ip='10.0.0.2')},
+        {'type': 'MODIFIED', 'object': make_pod('provider', 13, annotations={'a': 'b'})},
+        {'type': 'DELETED', 'object': make_pod('crossplane', 14)},
+    ]
+    clock.now += 60
+    pods = {pod.name: pod for pod in inventory.get_pods()}
+
+    assert fake_watch.started_from == ['10']
+    assert api.list_calls == 1
+    assert sorted(pods) == ['provider', 'provider-aws']
+    assert pods['provider-aws'].pod_ip == '10.0.0.3'
+    assert pods['provider'].metric_filter == frozenset(['a'])
+    # Annotations are only parsed again when they changed
+    assert parser.calls == ['crossplane', 'provider', 'provider-aws', 'provider']
+
+    clock.now += 60
+    inventory.get_pods()
+    assert fake_watch.started_from == ['10', '14']
+
+
+@pytest.mark.unit
+def test_expired_resource_version_relists():
+    api = FakeCoreV1Api([make_pod('crossplane', 5)], 10)
+    fake_watch = FakeWatch()
+    clock = FakeClock()
+    inventory = make_inventory(api, fake_watch=fake_watch, clock=clock)
+    inventory.get_pods()
+
+    api.pods = [make_pod('provider', 20)]
+    api.resource_version = '20'
+    fake_watch.events = [{'type': 'ERROR', 'object': SimpleNamespace(code=410)}]
+    clock.now += 60
+
+    assert [pod.name for pod in inventory.get_pods()] == ['provider']
+    assert api.list_calls == 2
+
+    clock.now += 60
+    inventory.get_pods()
+    assert fake_watch.started_from == ['10', '20']
+
+
+@pytest.mark.unit
+def test_pod_annotations_parsed_once():
+    instance = {'metrics_ignore_pod_annotations': False, 'metrics_default': 'min'}
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    annotations = {
+        'ad.datadoghq.com/uxp.instances': json.dumps([{'metrics': [{'go_threads': None}]}]),
+    }
+    api = FakeCoreV1Api([make_pod('crossplane', 5, annotations=annotations), make_pod('provider', 6)], 10)
+    clock = FakeClock()
+    inventory = PodInventory(api, 'upbound-system', check._merge_annotations, LOG, time_func=clock)
+
+    pods = {pod.name: pod for pod in inventory.get_pods()}
+    assert 'go_threads' in pods['crossplane'].metric_filter
+    assert 'go_goroutines' not in pods['crossplane'].metric_filter
+    assert pods['provider'].metric_filter is check.metric_filter
@@ -0,0 +1,182 @@
+import io
+import logging
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from datadog_checks.upbound_uxp import UpboundUxpCheck
+from datadog_checks.upbound_uxp.port_forward import PortForwardError, PortForwardManager
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeProcess(object):
+    def __init__(self, output):
+        self.stdout = io.StringIO(output)
+        self.returncode = None if output else 1
+        self.terminated = False
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.returncode = -15
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class FakePopen(object):
+    """Stand-in for subprocess.Popen, every new process forwards to the next port of `ports`."""
+
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.commands = []
+        self.processes = []
+        # Output of the next process instead of the forwarding line
+        self.output = None
+
+    def __call__(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        port = self.ports.pop(0) if self.ports else None
+        output = f'Forwarding from 127.0.0.1:{port} -> 8080\n' if port else ''
+        if self.output is not None:
+            output, self.output = self.output, None
+        process = FakeProcess(output)
+        self.processes.append(process)
+        return process
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_manager(popen, clock=None):
+    return PortForwardManager(
+        '/home/uxp.kubeconfig', 'upbound-system', '8080', LOG, popen=popen, time_func=clock or FakeClock()
+    )
+
+
+@pytest.mark.unit
+def test_port_forward_reused():
+    popen = FakePopen([41001])
+    manager = make_manager(popen)
+
+    assert manager.get_local_port('crossplane') == 41001
+    assert manager.get_local_port('crossplane') == 41001
+    assert len(popen.commands) == 1
+    assert popen.commands[0][-2:] == ['pods/crossplane', ':8080']
+
+
+@pytest.mark.unit
+def test_port_forward_output_drained():
+    popen = FakePopen([41001])
+    manager = make_manager(popen)
+    process_output = 'Forwarding from 127.0.0.1:41001 -> 8080\n' + 'Handling connection for 8080\n' * 10000
+    popen.output = process_output
+
+    assert manager.get_local_port('crossplane') == 41001
+    forward = manager._forwards['crossplane']
+    forward.drain_thread.join(5)
+    # kubectl keeps logging every connection, nothing is left in the pipe
+    assert not forward.drain_thread.is_alive()
+    assert popen.processes[0].stdout.read() == ''
+
+
+@pytest.mark.unit
+def test_port_forward_error_reported():
+    popen = FakePopen([])
+    popen.output = 'error: unable to forward port because pod is not running. Current status=Pending\n'
+    manager = make_manager(popen)
+
+    with pytest.raises(PortForwardError, match='pod is not running'):
+        manager.get_local_port('crossplane')
+
+
+@pytest.mark.unit
+def test_port_forward_restarted_when_dead():
+    popen = FakePopen([41001, 41002])
+    manager = make_manager(popen)
+
+    assert manager.get_local_port('crossplane') == 41001
+    popen.processes[0].returncode = 1
+    assert manager.get_local_port('crossplane') == 41002
+
+
+@pytest.mark.unit
+def test_port_forward_backoff():
+    popen = FakePopen([])
+    clock = FakeClock()
+    manager = make_manager(popen, clock)
+
+    with pytest.raises(PortForwardError, match='Unable to port-forward'):
+        manager.get_local_port('crossplane')
+    with pytest.raises(PortForwardError, match='backing off'):
+        manager.get_local_port('crossplane')
+    assert len(popen.commands) == 1
+
+    clock.now += 1
+    with pytest.raises(PortForwardError, match='Unable to port-forward'):
+        manager.get_local_port('crossplane')
+    clock.now += 1
+    with pytest.raises(PortForwardError, match='backing off'):
+        manager.get_local_port('crossplane')
+
+    popen.ports.append(41003)
+    clock.now += 1
+    assert manager.get_local_port('crossplane') == 41003
+    assert len(popen.commands) == 3
+
+
+@pytest.mark.unit
+def test_port_forward_prune():
+    popen = FakePopen([41001, 41002])
+    manager = make_manager(popen)
+    manager.get_local_port('crossplane')
+    manager.get_local_port('provider')
+
+    manager.prune({'provider'})
+    assert popen.processes[0].terminated
+    assert not popen.processes[1].terminated
+
+    manager.close()
+    assert popen.processes[1].terminated
+
+
+@pytest.mark.unit
+def test_scrape_pods_through_port_forwards(aggregator, metrics_server):
+    pods = [
+        SimpleNamespace(
+            metadata=SimpleNamespace(uid=f'uid-{i}', name=f'provider-{i}', annotations=None, resource_version='1'),
+            status=SimpleNamespace(pod_ip=None),
+        )
+        for i in range(3)
+    ]
+    check = UpboundUxpCheck('upbound_uxp', {}, [{'max_workers': 3}])
+    popen = FakePopen([metrics_server] * 3)
+    check.port_forwards = make_manager(popen)
+
+    with mock.patch('datadog_checks.upbound_uxp.check.config'), mock.patch(
+        'datadog_checks.upbound_uxp.check.client'
+    ) as kube_client, mock.patch.dict('os.environ', clear=True):
+        kube_client.CoreV1Api.return_value.list_namespaced_pod.return_value = SimpleNamespace(
+            items=pods, metadata=SimpleNamespace(resource_version='1')
+        )
+        check.check({})
+        check.check({})
+
+    # Port-forwards are kept across runs
+    assert len(popen.commands) == 3
+    for i in range(3):
+        aggregator.assert_metric_has_tag('uxp.go_goroutines', f'pod:provider-{i}', at_least=2)
+    aggregator.assert_service_check('uxp.can_connect', UpboundUxpCheck.OK)
+    aggregator.assert_service_check('uxp.can_connect', UpboundUxpCheck.CRITICAL, count=0)
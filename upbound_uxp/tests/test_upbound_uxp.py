@@ -1,7 +1,20 @@
+import os
+
+import mock
 import pytest
 
 from datadog_checks.dev.utils import get_metadata_metrics
+from datadog_checks.base import ConfigurationError
+from datadog_checks.base.utils.http import RequestsWrapper
 from datadog_checks.upbound_uxp import UpboundUxpCheck
+from datadog_checks.upbound_uxp.check import METRICS_DEFAULT_MIN_SET, MetricFilter
+
+from . import common
+
+
+def get_metrics_fixture():
+    with open(os.path.join(common.HERE, 'docker', 'fixtures', 'metrics')) as f:
+        return f.read()
 
 
 @pytest.mark.integration
@@ -26,6 +39,10 @@ def test_check_min(dd_run_check, aggregator, instance):
 
     aggregator.assert_metric('uxp.controller_runtime_reconcile_total')
     aggregator.assert_metric('uxp.datadog_agent_checks')
+    aggregator.assert_metric('uxp.datadog_agent_parse_time_seconds')
+    aggregator.assert_metric('uxp.datadog_agent_filter_dropped_samples')
+    aggregator.assert_metric('uxp.datadog_agent_filter_samples')
+    aggregator.assert_metric('uxp.datadog_agent_filter_time_seconds')
     aggregator.assert_metric('uxp.go_goroutines')
     aggregator.assert_metric('uxp.go_memstats_alloc_bytes')
     aggregator.assert_metric('uxp.go_memstats_alloc_bytes_total')
@@ -124,6 +141,7 @@ def test_emits_ok_service_check_when_service_is_up(dd_run_check, aggregator, ins
     aggregator.assert_metric('uxp.controller_runtime_webhook_requests_in_flight')
     aggregator.assert_metric('uxp.controller_runtime_webhook_requests_total')
     aggregator.assert_metric('uxp.datadog_agent_checks')  # count
+    aggregator.assert_metric('uxp.datadog_agent_parse_time_seconds')  # gauge
     aggregator.assert_metric('uxp.go_goroutines')  # gauge
     aggregator.assert_metric('uxp.go_memstats_alloc_bytes')  # gauge
     aggregator.assert_metric('uxp.go_memstats_alloc_bytes_total')  # count
@@ -208,3 +226,107 @@ def test_emits_critical_service_check_when_service_is_down(dd_run_check, aggrega
     aggregator.assert_metric('uxp.datadog_agent_checks')  # count
     aggregator.assert_service_check('uxp.can_connect', UpboundUxpCheck.CRITICAL)
     aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_get_metrics_single_pass(aggregator, instance):
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    check.get_metrics(get_metrics_fixture(), 'localhost')
+
+    aggregator.assert_metric(
+        'uxp.controller_runtime_reconcile_total',
+        metric_type=aggregator.COUNT,
+        tags=['controller:packages/lock.pkg.crossplane.io', 'result:success', 'pod:localhost'],
+    )
+    aggregator.assert_metric('uxp.go_goroutines', metric_type=aggregator.GAUGE)
+    aggregator.assert_metric('uxp.workqueue_work_duration_seconds_bucket', metric_type=aggregator.GAUGE)
+    aggregator.assert_metric('uxp.workqueue_work_duration_seconds_count', metric_type=aggregator.COUNT)
+    aggregator.assert_metric('uxp.workqueue_work_duration_seconds_sum', metric_type=aggregator.COUNT)
+    aggregator.assert_metric('uxp.datadog_agent_parse_time_seconds', count=1, metric_type=aggregator.GAUGE)
+    # Metrics outside of the observed set are dropped before parsing
+    aggregator.assert_metric('uxp.go_threads', count=0)
+
+
+@pytest.mark.unit
+def test_get_metrics_streamed_lines(aggregator, instance):
+    instance["metrics_default"] = "max"
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    check.get_metrics(iter(get_metrics_fixture().split('\n')), 'localhost')
+
+    aggregator.assert_metric('uxp.go_threads', metric_type=aggregator.GAUGE)
+    aggregator.assert_metric('uxp.go_gc_duration_seconds_count', metric_type=aggregator.COUNT)
+    aggregator.assert_metric('uxp.certwatcher_read_certificate_total', metric_type=aggregator.COUNT)
+
+
+@pytest.mark.unit
+def test_metric_filter():
+    metric_filter = MetricFilter(['go_goroutines'], prefixes=['workqueue_'], patterns=[r'.*_errors_total$'])
+
+    assert 'go_goroutines' in metric_filter
+    assert 'workqueue_depth' in metric_filter
+    assert 'controller_runtime_reconcile_errors_total' in metric_filter
+    assert 'go_threads' not in metric_filter
+    assert 'go_goroutines_total' not in metric_filter
+    assert 'go_goroutines' not in MetricFilter()
+
+
+@pytest.mark.unit
+def test_metrics_sets_not_mutated(instance):
+    min_set = frozenset(METRICS_DEFAULT_MIN_SET)
+    instance["metrics_default"] = "more"
+    more_check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    min_check = UpboundUxpCheck('upbound_uxp', {}, [dict(instance, metrics_default="min")])
+
+    assert METRICS_DEFAULT_MIN_SET == min_set
+    assert 'go_threads' in more_check.metric_filter
+    assert 'go_threads' not in min_check.metric_filter
+
+
+@pytest.mark.unit
+def test_get_metrics_include_prefixes_and_patterns(aggregator, instance):
+    instance["metrics_default"] = "none"
+    instance["metrics_include_prefixes"] = ["certwatcher_"]
+    instance["metrics_include_patterns"] = [r"go_memstats_heap_\w+_bytes"]
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    check.get_metrics(get_metrics_fixture(), 'localhost')
+
+    aggregator.assert_metric('uxp.certwatcher_read_certificate_total')
+    aggregator.assert_metric('uxp.certwatcher_read_certificate_errors_total')
+    aggregator.assert_metric('uxp.go_memstats_heap_idle_bytes')
+    aggregator.assert_metric('uxp.go_memstats_heap_objects', count=0)
+    aggregator.assert_metric('uxp.go_goroutines', count=0)
+    aggregator.assert_metric('uxp.datadog_agent_filter_time_seconds', count=1)
+    aggregator.assert_metric('uxp.datadog_agent_filter_samples', count=1)
+    aggregator.assert_metric('uxp.datadog_agent_filter_dropped_samples', count=1)
+
+
+@pytest.mark.unit
+def test_invalid_include_pattern(instance):
+    instance["metrics_include_patterns"] = ["go_("]
+    with pytest.raises(ConfigurationError):
+        UpboundUxpCheck('upbound_uxp', {}, [instance])
+
+
+@pytest.mark.unit
+def test_scrape_hosts_concurrently(aggregator, metrics_server):
+    instance = {"uxp_hosts": ["127.0.0.1", "localhost"], "uxp_port": str(metrics_server), "max_workers": 2}
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    check.check(instance)
+
+    aggregator.assert_metric_has_tag('uxp.go_goroutines', 'pod:127.0.0.1', at_least=1)
+    aggregator.assert_metric_has_tag('uxp.go_goroutines', 'pod:localhost', at_least=1)
+    aggregator.assert_service_check('uxp.can_connect', UpboundUxpCheck.CRITICAL, count=0)
+
+
+@pytest.mark.unit
+def test_scrape_streams_payload(aggregator, metrics_server):
+    instance = {"uxp_hosts": ["127.0.0.1"], "uxp_port": str(metrics_server)}
+    check = UpboundUxpCheck('upbound_uxp', {}, [instance])
+    http_get = mock.patch.object(RequestsWrapper, 'get', autospec=True, side_effect=RequestsWrapper.get)
+    with http_get as http_get, mock.patch.object(check, 'get_metrics', wraps=check.get_metrics) as get_metrics:
+        check.check(instance)
+
+    # The payload is parsed from the lines of the streamed response, not from a buffered body
+    assert http_get.call_args.kwargs['stream'] is True
+    assert not isinstance(get_metrics.call_args.args[0], str)
+    aggregator.assert_metric_has_tag('uxp.go_goroutines', 'pod:127.0.0.1', at_least=1)
@@ -1,25 +1,56 @@
 import json
+import time
+from itertools import count
 
 from datadog_checks.base import AgentCheck, ConfigurationError
 
 from .metrics import METRICS
 
+# Zabbix value types that can be sent as gauges: numeric float and numeric unsigned
+# https://www.zabbix.com/documentation/6.2/en/manual/api/reference/item/object?hl=value_typ#:~:text=ID%7D%2C%20%7BITEM.KEY%7D.-,value_type,-(required) # noqa: E501
+NUMERIC_VALUE_TYPES = ('0', '3')
+
+# Error details returned by the API when the session token expired or was revoked
+AUTH_ERROR_MARKERS = ('re-login', 'not authori')
+
+
+class ZabbixAuthError(Exception):
+    pass
+
 
 class ZabbixCheck(AgentCheck):
 
     SERVICE_CHECK_NAME = "zabbix.can_connect"
+    HISTORY_CURSOR_CACHE_KEY = "history_cursor"
+    DEFAULT_HISTORY_BATCH_SIZE = 100
+    DEFAULT_HISTORY_LOOKBACK = 3600
 
     def __init__(self, name, init_config, instances):
         super(ZabbixCheck, self).__init__(name, init_config, instances)
         self.tags = self.instance.get('tags', [])
 
+        self.history_batch_size = self.instance.get('history_batch_size', self.DEFAULT_HISTORY_BATCH_SIZE)
+        if not isinstance(self.history_batch_size, int) or self.history_batch_size < 1:
+            raise ConfigurationError('Configuration error, history_batch_size must be a positive integer.')
+
+        self.history_lookback = self.instance.get('history_lookback', self.DEFAULT_HISTORY_LOOKBACK)
+        if not isinstance(self.history_lookback, int) or self.history_lookback < 1:
+            raise ConfigurationError('Configuration error, history_lookback must be a positive integer.')
+
+        # The session token is kept across runs until the API rejects it
+        self.token = None
+        self.zabbix_api = None
+        self._request_ids = count(1)
+        # itemid -> [clock, value] of the latest value seen
+        self.history_cursor = None
+
     def request(self, zabbix_api, req_data):
         req_header = {
             'Content-Type': 'application/json-rpc',
         }
 
         try:
-            res = self.http.post(zabbix_api, data=req_data.encode(), headers=req_header)
+            res = self.http.post(zabbix_api, data=req_data.encode(), headers=req_header, persist=True)
         except Exception as e:
             self.log.debug("Unable to get make request to api=%s with req_data=%s", zabbix_api, req_data)
             self.warning("Request failed: %s", str(e))
@@ -41,9 +72,7 @@ class ZabbixCheck(AgentCheck):
         response = self.request(zabbix_api, req_data)
         token = response.get('result')
         if token is None:
-            raise Exception(
-                f"Unable to login with params user={zabbix_user} api={zabbix_api}: {response.get('error')}"
-            )
+            raise Exception(f"Unable to login with params user={zabbix_user} api={zabbix_api}: {response.get('error')}")
         return token
 
     def logout(self, token, zabbix_api):
@@ -52,82 +81,150 @@ class ZabbixCheck(AgentCheck):
         self.log.debug("Logging out: %s", response)
         return response
 
-    def get_hosts(self, token, zabbix_api, hosts=None):
-        if hosts is not None:
-            req_data = json.dumps(
-                {
-                    'jsonrpc': '2.0',
-                    'method': 'host.get',
-                    'params': {'filter': {'host': hosts}, 'output': ['hostid', 'host']},
-                    'auth': token,
-                    'id': 1,
-                }
-            )
-        else:
-            req_data = json.dumps(
+    def cancel(self):
+        # Revoke the session token when the check is unscheduled
+        if self.token is not None:
+            try:
+                self.logout(self.token, self.zabbix_api)
+            except Exception as e:
+                self.log.debug("Unable to log out: %s", e)
+            self.token = None
+
+    def _get_result(self, response):
+        error = response.get('error')
+        if error is not None:
+            details = f"{error.get('message', '')} {error.get('data', '')}".lower()
+            if any(marker in details for marker in AUTH_ERROR_MARKERS):
+                raise ZabbixAuthError(error)
+            raise Exception(f"Zabbix API error: {error}")
+        return response.get('result')
+
+    def call_batch(self, zabbix_user, zabbix_pass, zabbix_api, method, params_list):
+        """
+        Send the calls in a single JSON-RPC batch and return their results in order.
+
+        The session token is reused until the API rejects it, then the check
+        logs in again and retries the batch once.
+        """
+        if not params_list:
+            return []
+
+        for attempt in range(2):
+            if self.token is None:
+                self.token = self.login(zabbix_user, zabbix_pass, zabbix_api)
+
+            calls = [
                 {
                     'jsonrpc': '2.0',
-                    'method': 'host.get',
-                    'params': {'output': ['hostid', 'host']},
-                    'auth': token,
-                    'id': 1,
+                    'method': method,
+                    'params': params,
+                    'auth': self.token,
+                    'id': next(self._request_ids),
                 }
-            )
-        response = self.request(zabbix_api, req_data)
+                for params in params_list
+            ]
+            req_data = json.dumps(calls[0] if len(calls) == 1 else calls)
+            response = self.request(zabbix_api, req_data)
+            responses = {res.get('id'): res for res in (response if isinstance(response, list) else [response])}
+            try:
+                return [self._get_result(responses.get(call['id'], {})) for call in calls]
+            except ZabbixAuthError as e:
+                if attempt:
+                    raise Exception(f"Zabbix API rejected a new session token: {e}")
+                self.log.debug("Session token rejected, logging in again: %s", e)
+                self.token = None
+
+    def call(self, zabbix_user, zabbix_pass, zabbix_api, method, params):
+        return self.call_batch(zabbix_user, zabbix_pass, zabbix_api, method, [params])[0]
 
-        result = response.get('result')
-        self.log.debug("Getting zabbix items: %s", result)
+    def get_hosts(self, zabbix_user, zabbix_pass, zabbix_api, hosts=None):
+        params = {'output': ['hostid', 'host']}
+        if hosts is not None:
+            params['filter'] = {'host': hosts}
+        result = self.call(zabbix_user, zabbix_pass, zabbix_api, 'host.get', params)
+        self.log.debug("Getting zabbix hosts: %s", result)
         return result
 
-    def get_items(self, token, hostids, zabbix_api, items=None):
+    def get_items(self, zabbix_user, zabbix_pass, zabbix_api, hostids, items=None):
+        params = {'hostids': hostids, 'output': ['itemid', 'name', 'hostid', 'value_type']}
         if items is not None:
-            req_data = json.dumps(
-                {
-                    'jsonrpc': '2.0',
-                    'method': 'item.get',
-                    'params': {
-                        'hostids': hostids,
-                        'filter': {'name': items},
-                        'output': ['itemid', 'name', 'hostid', 'value_type'],
-                    },
-                    'auth': token,
-                    'id': 1,
-                }
-            )
-        else:
-            req_data = json.dumps(
+            params['filter'] = {'name': items}
+        return self.call(zabbix_user, zabbix_pass, zabbix_api, 'item.get', params)
+
+    def get_history(self, zabbix_user, zabbix_pass, zabbix_api, items):
+        """
+        Return the latest [clock, value] of each item, keyed by itemid.
+
+        Items seen on a previous run are queried together with one history.get per
+        value type, cursor age and batch, for the values since their oldest cursor.
+        Other items are queried one history.get each, packed in JSON-RPC batches.
+
+        The age of the oldest cursor of a group is less than twice the age of its
+        newest one, so that items without recent values don't make the query return
+        the values of the whole window for every other item.
+        """
+        now = int(time.time())
+        latest = {}
+        new_items = []
+        known_items = {}
+        for item in items:
+            cursor = self.history_cursor.get(item['itemid'])
+            if cursor is None:
+                new_items.append(item)
+            else:
+                latest[item['itemid']] = cursor
+                age = min(max(now - cursor[0], 1), self.history_lookback)
+                known_items.setdefault((item['value_type'], age.bit_length()), []).append(item)
+
+        for batch in self._batches(new_items):
+            params_list = [
                 {
-                    'jsonrpc': '2.0',
-                    'method': 'item.get',
-                    'params': {'hostids': hostids, 'output': ['itemid', 'name', 'hostid', 'value_type']},
-                    'auth': token,
-                    'id': 1,
+                    'itemids': item['itemid'],
+                    'output': ['itemid', 'clock', 'value'],
+                    'history': item['value_type'],
+                    'sortfield': 'clock',
+                    'sortorder': 'DESC',
+                    'limit': 1,
                 }
-            )
-        response = self.request(zabbix_api, req_data)
-        return response.get('result')
+                for item in batch
+            ]
+            for result in self.call_batch(zabbix_user, zabbix_pass, zabbix_api, 'history.get', params_list):
+                self._update_latest(latest, result)
 
-    def get_history(self, token, hostid, itemid, value_type, zabbix_api):
-        req_data = json.dumps(
-            {
-                'jsonrpc': '2.0',
-                'method': 'history.get',
-                'params': {
-                    'hostids': hostid,
-                    'itemids': itemid,
-                    'output': ['itemid', 'value'],
+        for (value_type, _), group_items in known_items.items():
+            for batch in self._batches(group_items):
+                time_from = min(latest[item['itemid']][0] for item in batch)
+                params = {
+                    'itemids': [item['itemid'] for item in batch],
+                    'output': ['itemid', 'clock', 'value'],
                     'history': value_type,
+                    'time_from': max(time_from, now - self.history_lookback),
                     'sortfield': 'clock',
                     'sortorder': 'DESC',
-                    'limit': 1,
-                },
-                'auth': token,
-                'id': 1,
-            }
-        )
+                }
+                self._update_latest(latest, self.call(zabbix_user, zabbix_pass, zabbix_api, 'history.get', params))
 
-        response = self.request(zabbix_api, req_data)
-        return response.get('result')
+        return latest
+
+    def _batches(self, items):
+        for i in range(0, len(items), self.history_batch_size):
+            yield items[i : i + self.history_batch_size]
+
+    @staticmethod
+    def _update_latest(latest, history):
+        for entry in history or ():
+            clock = int(entry['clock'])
+            current = latest.get(entry['itemid'])
+            if current is None or clock > current[0]:
+                latest[entry['itemid']] = [clock, entry['value']]
+
+    def load_history_cursor(self):
+        if self.history_cursor is None:
+            cached = self.read_persistent_cache(self.HISTORY_CURSOR_CACHE_KEY)
+            try:
+                self.history_cursor = json.loads(cached) if cached else {}
+            except ValueError:
+                self.history_cursor = {}
 
     def check(self, instance):
         zabbix_user = instance.get('zabbix_user')
@@ -143,17 +240,12 @@ class ZabbixCheck(AgentCheck):
         if not zabbix_api:
             raise ConfigurationError('Configuration error, please specify zabbix_api.')
 
+        self.zabbix_api = zabbix_api
         hosts = instance.get('hosts')
         metrics = instance.get('metrics')
 
-        # Get token
-        token = self.login(zabbix_user, zabbix_pass, zabbix_api)
-
         # Get hosts
-        if hosts is not None:
-            zabbixhosts = self.get_hosts(token, zabbix_api, hosts)
-        else:
-            zabbixhosts = self.get_hosts(token, zabbix_api)
+        zabbixhosts = self.get_hosts(zabbix_user, zabbix_pass, zabbix_api, hosts)
 
         hostdic = {}
         hostids = []
@@ -162,40 +254,35 @@ class ZabbixCheck(AgentCheck):
             hostids.append(host['hostid'])
 
         # Get items
-        if metrics is not None:
-            zabbixitems = self.get_items(token, hostids, zabbix_api, metrics)
-        else:
-            zabbixitems = self.get_items(token, hostids, zabbix_api)
+        zabbixitems = self.get_items(zabbix_user, zabbix_pass, zabbix_api, hostids, metrics)
 
-        # Get metrics value
+        # To avoid sending non-numeric values as gauge, only query the history of numeric items
+        items = []
         for item in zabbixitems:
-            hostid = item['hostid']
-            itemid = item['itemid']
-            value_type = item['value_type']
             item_name = item['name']
+            if item_name not in METRICS:
+                self.log.debug("Item name %s not found in metric mapping", item_name)
+            elif item['value_type'] not in NUMERIC_VALUE_TYPES:
+                self.log.debug('\"%s\" value is not numeric_float and numeric unsigned', item_name)
+            else:
+                items.append(item)
 
-            if item_name in METRICS:
-                history = self.get_history(token, hostid, itemid, value_type, zabbix_api)
-                mname = METRICS[item_name]
-
-                # To avoid sending non-numeric values as gauge
-                # https://www.zabbix.com/documentation/6.2/en/manual/api/reference/item/object?hl=value_typ#:~:text=ID%7D%2C%20%7BITEM.KEY%7D.-,value_type,-(required) # noqa: E501
-                if value_type not in ['0', '3']:
-                    self.log.debug('\"%s\" value is not numeric_float and numeric unsigned', item_name)
-                    continue
-
-                try:
-                    dd_metricname = f'zabbix.{mname}'
-                    dd_metricvalue = history[0]['value']
-                    dd_hostname = hostdic[hostid].replace(' ', '_')
-                except Exception as e:
-                    self.log.debug("Unable to get metric for item %s: %s", itemid, str(e))
-                else:
-                    self.gauge(dd_metricname, dd_metricvalue, tags=self.tags, hostname=dd_hostname, device_name=None)
+        # Get metrics value
+        self.load_history_cursor()
+        latest = self.get_history(zabbix_user, zabbix_pass, zabbix_api, items)
+        for item in items:
+            itemid = item['itemid']
+            try:
+                dd_metricname = f"zabbix.{METRICS[item['name']]}"
+                dd_metricvalue = latest[itemid][1]
+                dd_hostname = hostdic[item['hostid']].replace(' ', '_')
+            except Exception as e:
+                self.log.debug("Unable to get metric for item %s: %s", itemid, str(e))
             else:
-                self.log.debug("Item name %s not found in metric mapping", item_name)
+                self.gauge(dd_metricname, dd_metricvalue, tags=self.tags, hostname=dd_hostname, device_name=None)
+
+        # Only keep the cursor of the items still collected
+        self.history_cursor = {item['itemid']: latest[item['itemid']] for item in items if item['itemid'] in latest}
+        self.write_persistent_cache(self.HISTORY_CURSOR_CACHE_KEY, json.dumps(self.history_cursor))
 
-        # Revoke token
-        result = self.logout(token, zabbix_api)
-        self.log.debug("Logged out: %s", result)
         self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=self.tags)
@@ -1,9 +1,16 @@
+import json
 import os
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
 from datadog_checks.dev import docker_run, get_docker_hostname, get_here
 from datadog_checks.dev.conditions import CheckDockerLogs
+from datadog_checks.zabbix.metrics import METRICS
 
 HERE = get_here()
 HOST = get_docker_hostname()
@@ -46,3 +53,138 @@ def instance_missing_pass():
 @pytest.fixture(scope="session")
 def instance_missing_url():
     return {"zabbix_user": "zabbix", "zabbix_password": "zabbix"}
+
+
+class FakeZabbix(object):
+    """
+    In memory Zabbix API serving `host_count` hosts with one item per known
+    metric, plus a text item per host. Every item starts with one value.
+    """
+
+    def __init__(self, host_count):
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.calls = Counter()
+        self.requests = 0
+        # Number of history entries returned
+        self.returned = 0
+        self.hosts = [{'hostid': str(10000 + i), 'host': f'host {i}'} for i in range(host_count)]
+        self.items = []
+        self.history = {}
+        for host in self.hosts:
+            for name in METRICS:
+                self._add_item(host['hostid'], name, '3' if 'process' in name.lower() else '0')
+            self._add_item(host['hostid'], 'Version of zabbix_agent(d) running', '1')
+        self.push(int(time.time()) - 60)
+
+    def _add_item(self, hostid, name, value_type):
+        itemid = str(20000 + len(self.items))
+        self.items.append({'itemid': itemid, 'name': name, 'hostid': hostid, 'value_type': value_type})
+        self.history[itemid] = []
+
+    def push(self, clock, offset=0, itemids=None):
+        """Add a value to every item, or the ones of `itemids`, the value is the item position plus `offset`."""
+        with self.lock:
+            for i, item in enumerate(self.items):
+                if itemids is not None and item['itemid'] not in itemids:
+                    continue
+                entry = {'itemid': item['itemid'], 'clock': str(clock), 'value': str(i + offset)}
+                self.history[item['itemid']].append(entry)
+
+    def expire_tokens(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def handle(self, call):
+        method = call['method']
+        params = call.get('params', {})
+        with self.lock:
+            self.calls[method] += 1
+            if method == 'user.login':
+                token = uuid.uuid4().hex
+                self.tokens.add(token)
+                return {'jsonrpc': '2.0', 'result': token, 'id': call['id']}
+            if call.get('auth') not in self.tokens:
+                error = {'code': -32602, 'message': 'Invalid params.', 'data': 'Session terminated, re-login, please.'}
+                return {'jsonrpc': '2.0', 'error': error, 'id': call['id']}
+            if method == 'user.logout':
+                self.tokens.discard(call['auth'])
+                result = True
+            elif method == 'host.get':
+                names = params.get('filter', {}).get('host')
+                result = [host for host in self.hosts if names is None or host['host'] in names]
+            elif method == 'item.get':
+                hostids = set(params['hostids'])
+                names = params.get('filter', {}).get('name')
+                result = [
+                    item
+                    for item in self.items
+                    if item['hostid'] in hostids and (names is None or item['name'] in names)
+                ]
+            elif method == 'history.get':
+                result = self._history(params)
+            else:
+                return {'jsonrpc': '2.0', 'error': {'code': -32601, 'message': 'Method not found.'}, 'id': call['id']}
+        return {'jsonrpc': '2.0', 'result': result, 'id': call['id']}
+
+    def _history(self, params):
+        itemids = params['itemids']
+        if not isinstance(itemids, list):
+            itemids = [itemids]
+        time_from = params.get('time_from', 0)
+        entries = [
+            entry for itemid in itemids for entry in self.history.get(itemid, ()) if int(entry['clock']) >= time_from
+        ]
+        entries.sort(key=lambda entry: int(entry['clock']), reverse=params.get('sortorder') == 'DESC')
+        if 'limit' in params:
+            entries = entries[: params['limit']]
+        self.returned += len(entries)
+        return entries
+
+
+@pytest.fixture
+def zabbix_api_server():
+    """
+    Start a local fake Zabbix JSON-RPC API, yields a factory taking the number of hosts.
+    """
+    servers = []
+
+    def start(host_count=50):
+        zabbix = FakeZabbix(host_count)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with zabbix.lock:
+                    zabbix.requests += 1
+                if isinstance(payload, list):
+                    body = [zabbix.handle(call) for call in payload]
+                else:
+                    body = zabbix.handle(payload)
+
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json-rpc')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        server.zabbix = zabbix
+        server.url = 'http://127.0.0.1:{}/api_jsonrpc.php'.format(server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
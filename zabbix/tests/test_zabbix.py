@@ -1,7 +1,10 @@
+import time
+
 import pytest
 
 from datadog_checks.base import ConfigurationError
 from datadog_checks.zabbix import ZabbixCheck
+from datadog_checks.zabbix.metrics import METRICS
 
 
 def test_empty_instance(aggregator, instance_empty):
@@ -23,3 +26,131 @@ def test_missing_url(aggregator, instance_missing_url):
 
     with pytest.raises(ConfigurationError):
         check.check(instance_missing_url)
+
+
+def make_instance(server, **options):
+    instance = {'zabbix_user': 'Admin', 'zabbix_password': 'zabbix', 'zabbix_api': server.url}
+    instance.update(options)
+    return instance
+
+
+def numeric_items(zabbix):
+    return [item for item in zabbix.items if item['value_type'] in ('0', '3')]
+
+
+@pytest.mark.parametrize('history_batch_size', [0, 'ten'])
+def test_invalid_history_batch_size(history_batch_size):
+    instance = {'zabbix_user': 'Admin', 'zabbix_password': 'zabbix', 'history_batch_size': history_batch_size}
+    with pytest.raises(ConfigurationError):
+        ZabbixCheck('zabbix', {}, [instance])
+
+
+def test_batched_history(aggregator, datadog_agent, zabbix_api_server):
+    server = zabbix_api_server(host_count=50)
+    zabbix = server.zabbix
+    items = numeric_items(zabbix)
+    assert len(items) > 2000
+
+    instance = make_instance(server, history_batch_size=200)
+    check = ZabbixCheck('zabbix', {}, [instance])
+    check.check(instance)
+
+    assert zabbix.calls['history.get'] == len(items)
+    # host.get, item.get and one JSON-RPC batch per 200 items
+    assert zabbix.requests == 1 + 2 + -(-len(items) // 200)
+    for item in items[:50]:
+        position = zabbix.items.index(item)
+        hostname = f"host_{int(item['hostid']) - 10000}"
+        aggregator.assert_metric(f"zabbix.{METRICS[item['name']]}", value=position, hostname=hostname)
+    assert len(aggregator.metric_names) == len(METRICS)
+
+
+def test_incremental_history(aggregator, datadog_agent, zabbix_api_server):
+    server = zabbix_api_server(host_count=50)
+    zabbix = server.zabbix
+    items = numeric_items(zabbix)
+    instance = make_instance(server)
+
+    check = ZabbixCheck('zabbix', {}, [instance])
+    check.check(instance)
+    zabbix.calls.clear()
+    zabbix.push(int(time.time()), offset=100000)
+    aggregator.reset()
+
+    # A new instance resumes from the persisted cursor
+    check = ZabbixCheck('zabbix', {}, [instance])
+    check.check(instance)
+
+    # One multi-item call per value type and batch of 100 items
+    value_types = {item['value_type'] for item in items}
+    assert zabbix.calls['history.get'] <= len(value_types) + -(-len(items) // 100)
+    for item in items[:50]:
+        metric = f"zabbix.{METRICS[item['name']]}"
+        hostname = f"host_{int(item['hostid']) - 10000}"
+        aggregator.assert_metric(metric, value=zabbix.items.index(item) + 100000, hostname=hostname)
+
+    # Without new values, the last value seen is submitted again
+    aggregator.reset()
+    check.check(instance)
+    for item in items[:50]:
+        metric = f"zabbix.{METRICS[item['name']]}"
+        hostname = f"host_{int(item['hostid']) - 10000}"
+        aggregator.assert_metric(metric, value=zabbix.items.index(item) + 100000, hostname=hostname, count=1)
+
+
+def test_session_reuse(aggregator, datadog_agent, zabbix_api_server):
+    server = zabbix_api_server(host_count=2)
+    zabbix = server.zabbix
+    instance = make_instance(server)
+    check = ZabbixCheck('zabbix', {}, [instance])
+
+    for _ in range(3):
+        check.check(instance)
+
+    assert zabbix.calls['user.login'] == 1
+    assert zabbix.calls['user.logout'] == 0
+
+    zabbix.expire_tokens()
+    aggregator.reset()
+    check.check(instance)
+
+    assert zabbix.calls['user.login'] == 2
+    assert len(aggregator.metric_names) == len(METRICS)
+
+    check.cancel()
+    assert zabbix.calls['user.logout'] == 1
+    assert not zabbix.tokens
+    aggregator.assert_service_check('zabbix.can_connect', ZabbixCheck.OK, tags=[], count=1)
+
+
+def test_history_grouped_by_cursor_age(aggregator, datadog_agent, zabbix_api_server):
+    server = zabbix_api_server(host_count=2)
+    zabbix = server.zabbix
+    items = numeric_items(zabbix)
+    slow_item = items[0]
+    fast_itemids = {item['itemid'] for item in items[1:]}
+    instance = make_instance(server)
+    check = ZabbixCheck('zabbix', {}, [instance])
+    check.check(instance)
+
+    # Every item but one gets a value every 10 seconds
+    now = int(time.time())
+    for clock in range(now - 50, now + 1, 10):
+        zabbix.push(clock, offset=1000, itemids=fast_itemids)
+    check.check(instance)
+
+    zabbix.push(now + 1, offset=2000, itemids=fast_itemids)
+    zabbix.returned = 0
+    aggregator.reset()
+    check.check(instance)
+
+    # The slow item is queried on its own, the other ones only return their values since the previous run
+    assert zabbix.returned <= 2 * len(fast_itemids) + 1
+    hostname = f"host_{int(slow_item['hostid']) - 10000}"
+    aggregator.assert_metric(
+        f"zabbix.{METRICS[slow_item['name']]}", value=zabbix.items.index(slow_item), hostname=hostname
+    )
+    for item in items[1:]:
+        metric = f"zabbix.{METRICS[item['name']]}"
+        hostname = f"host_{int(item['hostid']) - 10000}"
+        aggregator.assert_metric(metric, value=zabbix.items.index(item) + 2000, hostname=hostname)